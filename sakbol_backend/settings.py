@@ -49,6 +49,7 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'idempotency-key',
 ]
 
 # SESSION_COOKIE_SAMESITE = 'None'
@@ -81,6 +82,121 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
 
+# Сопоставление телефонной книги
+PHONE_DEFAULT_COUNTRY_CODE = '996'
+PHONE_NATIONAL_NUMBER_LENGTH = 9
+PHONE_HASH_SALT = 'sakbol-phonebook-v1'
+PHONE_MATCH_MAX_NUMBERS = 5000
+PHONE_MATCH_CHUNK_SIZE = 500
+
+# Идемпотентность POST-запросов (заголовок Idempotency-Key)
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+# после этого незавершённый ключ считается брошенным и его может занять повтор
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(seconds=60)
+
+# Ранжирование ближайших к SOS-сигналу людей (sos_module.ranking)
+SOS_RANKING = {
+    'TOP_K': 10,
+    'MAX_TOP_K': 100,
+    'TRAVEL_SPEED': 8.3,  # м/с, ~30 км/ч по городу — для оценки ETA
+    'STALENESS_SPEED': 1.4,  # м/с, насколько человек мог сместиться с момента последней точки
+    'FAVORITE_WEIGHT': 0.8,  # множитель «эффективного» расстояния для избранных
+    'MAX_LOCATION_AGE': 24 * 60 * 60,  # более старые точки не учитываются, с
+}
+
+# Безопасные зоны (sos_module.geofence)
+SAFE_ZONES = {
+    'GRID_CELL_DEG': 0.01,  # ~1.1 км по широте
+    'MAX_CELLS_PER_ZONE': 256,  # зоны крупнее проверяются без сетки, по прямоугольнику
+    'MAX_POLYGON_POINTS': 200,
+    'MAX_RADIUS_M': 50_000,
+}
+
+# Синхронизация (/api/sync/)
+SYNC_CURSOR_SKEW = timedelta(seconds=5)
+SYNC_TOMBSTONE_TTL = timedelta(days=30)  # курсор старше — полный снимок
+
+# Пакетные операции (bulk-accept, bulk-cancel, favorites/bulk, keywords/replace)
+BULK_MAX_ITEMS = 500
+
+# Фоновые задачи (sos_module.jobs, воркер: manage.py run_jobs)
+JOBS = {
+    'POLL_INTERVAL': 1.0,  # с, пауза воркера при пустой очереди
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BACKOFF': 5,  # с, задержка перед первым повтором, далее удваивается
+    'RETRY_BACKOFF_MAX': 60 * 60,
+    'VISIBILITY_TIMEOUT': 5 * 60,  # с, после которых задача пропавшего воркера возвращается в очередь
+    'HEARTBEAT_INTERVAL': 60,  # с, как часто воркер продлевает аренду выполняемых задач
+    'KEEP_DONE_FOR': timedelta(days=7),
+    # задачи, которые долгоживущий воркер ставит сам: имя -> интервал между запусками
+    'PERIODIC': {
+        'maintenance.purge': timedelta(hours=1),
+    },
+}
+
+# Семейный дашборд (/api/families/{id}/dashboard/)
+FAMILY_DASHBOARD = {
+    'CACHE_TTL': 5,  # с; экран обновляется каждые несколько секунд
+    'FRESH_SECONDS': 5 * 60,
+    'STALE_SECONDS': 60 * 60,
+}
+
+# Тепловая карта SOS для операторов (/api/sos/heatmap/).
+# На масштабе z ячейка — тайл уровня z + CELL_SHIFT (8×8 ячеек на тайл при 3).
+SOS_HEATMAP = {
+    'ZOOMS': (4, 6, 8, 10, 12, 14, 16),  # хранимые масштабы; нечётные берутся с ближайшего меньшего
+    'CELL_SHIFT': 3,
+    'MAX_CELLS': 5000,
+}
+
+# Транзакционный outbox (sos_module.outbox, manage.py relay_outbox)
+OUTBOX = {
+    'BATCH_SIZE': 500,
+    'POLL_INTERVAL': 1.0,  # с, пауза ретранслятора, когда новых событий нет
+    # с; сколько ждать событие с пропущенным id (его транзакция ещё не закоммичена),
+    # прежде чем считать id потерянным (откат транзакции). Больше самой длинной транзакции, пишущей события.
+    'GAP_TIMEOUT': 60,
+    'RETENTION': timedelta(days=7),
+}
+
+# Выборочное профилирование запросов (sos_module.middleware.ProfilingMiddleware).
+# SAMPLE_RATE = 0 — только по заголовку X-Profile от персонала.
+PROFILING = {
+    'SAMPLE_RATE': 0.0,
+    'HEADER': 'X-Profile',
+    'PATH_PREFIX': '/api/',
+    'DIR': BASE_DIR / 'profiles',
+    'MAX_PROFILES': 200,
+    'TOP_SQL': 10,
+    'TOP_FUNCTIONS': 30,
+}
+
+# Приоритетный допуск запросов (sos_module.middleware.AdmissionControlMiddleware).
+# Лимиты действуют на процесс воркера; critical не отбрасывается никогда.
+ADMISSION_CONTROL = {
+    'PATH_PREFIX': '/api/',
+    'DEFAULT_CLASS': 'best_effort',
+    'RETRY_AFTER': 2,
+    'LATENCY_WINDOW': 5.0,
+    # доля MAX_QUEUE_DEPTH, с которой начинается вероятностный сброс
+    'SHED_START': 0.5,
+    # алиас кэша для общих счётчиков (Redis/Memcached). Без него счётчики живут
+    # в памяти процесса и имеют смысл только под threaded WSGI или ASGI
+    'SHARED_CACHE': None,
+    'COUNTER_TTL': 60,
+    'CLASSES': {
+        'critical': {},
+        'bulk': {'MAX_CONCURRENCY': 16, 'MAX_QUEUE_DEPTH': 48, 'MAX_LATENCY': 2.0},
+        'best_effort': {'MAX_CONCURRENCY': 8, 'MAX_QUEUE_DEPTH': 24, 'MAX_LATENCY': 1.0},
+    },
+    # (метод или '*', регулярное выражение пути, класс) — первое совпадение побеждает
+    'ROUTES': [
+        ('POST', r'^/api/sos/$', 'critical'),
+        ('*', r'^/api/location/', 'bulk'),
+        ('*', r'^/api/auth/update-status/$', 'bulk'),
+    ],
+}
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
 
@@ -121,6 +237,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'sos_module.middleware.AdmissionControlMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -128,6 +245,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'sos_module.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'sakbol_backend.urls'
@@ -157,9 +275,20 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # файловая тестовая база: in-memory SQLite не выдерживает конкурентной записи из потоков
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Шарды таблицы Location (sos_module.sharding): точка пользователя лежит
+# в LOCATION_SHARDS[user_id % len(LOCATION_SHARDS)]. Каждый алиас должен быть
+# в DATABASES; новый шард создаётся init_location_shard <алиас>, затем split_locations.
+LOCATION_SHARDS = ['default']
+
+DATABASE_ROUTERS = ['sos_module.sharding.LocationShardRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
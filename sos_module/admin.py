@@ -1,9 +1,264 @@
 from django.contrib import admin
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.http import QueryDict
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .heatmap import resolve_signals
 from .models import *
-from django.contrib.auth.admin import UserAdmin
+from .sharding import shard_aliases
 
-admin.site.register(User)
-admin.site.register(Contact)
-admin.site.register(Location)
-admin.site.register(SosSignal)
-admin.site.register(FavoriteContact)
\ No newline at end of file
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для больших таблиц: для нефильтрованного списка берёт оценку
+    числа строк из статистики СУБД вместо точного COUNT(*).
+    Маленькие таблицы и отфильтрованные списки считаются как обычно.
+    """
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        estimate = self._estimated_count()
+        if estimate is not None and estimate >= self.exact_count_threshold:
+            self.count_is_estimated = True
+            return estimate
+        self.count_is_estimated = False
+        return super().count
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # оценка занижена: страница за «концом» может быть реальной
+            if not self._use_exact_count():
+                raise
+            return super().validate_number(number)
+
+    def page(self, number):
+        number = self.validate_number(number)
+        page = super().page(number)
+        if number > 1 and not page.object_list and self._use_exact_count():
+            # оценка завышена: вместо пустой страницы отдаём последнюю настоящую
+            page = super().page(min(number, self.num_pages))
+        return page
+
+    def _use_exact_count(self):
+        """Заменяет оценку точным COUNT(*). Возвращает False, если счёт уже точный."""
+        if not getattr(self, "count_is_estimated", False):
+            return False
+        self.count_is_estimated = False
+        self.__dict__["count"] = Paginator.count.func(self)
+        self.__dict__.pop("num_pages", None)
+        return True
+
+    def _estimated_count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, "query") or queryset.query.where:
+            return None
+
+        table = queryset.model._meta.db_table
+        connection = connections[queryset.db]
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+            elif connection.vendor == "sqlite":
+                # sqlite_stat1 появляется только после ANALYZE
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+                if cursor.fetchone() is None:
+                    return None
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table])
+                row = cursor.fetchone()
+                return int(row[0].split()[0]) if row else None
+            else:
+                return None
+            row = cursor.fetchone()
+        return int(row[0]) if row and row[0] > 0 else None
+
+
+class BaseAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+@admin.register(User)
+class UserAdmin(BaseAdmin):
+    list_display = ("id", "email", "first_name", "last_name", "phone_number", "role", "is_online", "last_seen")
+    list_filter = ("role", "is_online")
+    # префиксный поиск и точные совпадения используют индексы
+    search_fields = ("^email", "^phone_number", "=identifier")
+    ordering = ("-id",)
+
+
+@admin.register(Contact)
+class ContactAdmin(BaseAdmin):
+    list_display = ("id", "from_user", "to_user", "is_accepted", "created_at")
+    list_select_related = ("from_user", "to_user")
+    list_filter = ("is_accepted",)
+    autocomplete_fields = ("from_user", "to_user")
+    ordering = ("-id",)
+
+
+def requested_shard(request):
+    """
+    Шард из фильтра списка (или из сохранённых фильтров на странице объекта).
+    Без фильтра — явно первый шард: id в разных шардах пересекаются.
+    """
+    shard = request.GET.get(LocationShardFilter.parameter_name)
+    if shard is None:
+        shard = QueryDict(request.GET.get("_changelist_filters", "")).get(LocationShardFilter.parameter_name)
+    return shard if shard in shard_aliases() else shard_aliases()[0]
+
+
+class LocationShardFilter(admin.SimpleListFilter):
+    """Location шардирована по пользователю: список показывает один шард за раз."""
+    title = "Шард"
+    parameter_name = "shard"
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in shard_aliases()]
+
+    def value(self):
+        return super().value() or shard_aliases()[0]
+
+    def choices(self, changelist):
+        # пункта «Все» нет: общего списка по всем шардам не бывает
+        for lookup, title in self.lookup_choices:
+            yield {
+                "selected": self.value() == lookup,
+                "query_string": changelist.get_query_string({self.parameter_name: lookup}),
+                "display": title,
+            }
+
+    def queryset(self, request, queryset):
+        return queryset  # шард выбирает LocationAdmin.get_queryset
+
+
+@admin.register(Location)
+class LocationAdmin(BaseAdmin):
+    list_display = ("id", "user", "latitude", "longitude", "updated_at")
+    list_filter = (LocationShardFilter,)
+    # не False: иначе список сам сделает select_related("user"), а пользователи лежат в default —
+    # JOIN из шарда невозможен, их подтягивает prefetch_related
+    list_select_related = ()
+    autocomplete_fields = ("user",)
+    ordering = ("-id",)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(requested_shard(request)).prefetch_related("user")
+
+
+@admin.register(SosSignal)
+class SosSignalAdmin(BaseAdmin):
+    list_display = ("id", "sender", "latitude", "longitude", "created_at", "is_active")
+    list_select_related = ("sender",)
+    list_filter = ("is_active",)
+    autocomplete_fields = ("sender",)
+    # от координат и статуса зависят счётчики тепловой карты: закрытие — только действием,
+    # которое публикует событие outbox; удаление публикует его через post_delete
+    readonly_fields = ("latitude", "longitude", "is_active")
+    ordering = ("-created_at",)
+    actions = ("resolve_signals",)
+
+    def has_add_permission(self, request):
+        return False  # сигналы создаются только через API
+
+    @admin.action(description="Закрыть выбранные SOS сигналы")
+    def resolve_signals(self, request, queryset):
+        updated = resolve_signals(queryset)
+        self.message_user(request, f"Закрыто сигналов: {updated}")
+
+
+@admin.register(SosHeatCell)
+class SosHeatCellAdmin(BaseAdmin):
+    list_display = ("id", "granularity", "bucket_start", "zoom", "cell_x", "cell_y", "total_count", "active_count")
+    list_filter = ("granularity", "zoom")
+    ordering = ("-bucket_start",)
+
+
+@admin.register(FavoriteContact)
+class FavoriteContactAdmin(BaseAdmin):
+    list_display = ("id", "user", "contact")
+    list_select_related = ("user", "contact")
+    autocomplete_fields = ("user", "contact")
+    ordering = ("-id",)
+
+
+@admin.register(Keyword)
+class KeywordAdmin(BaseAdmin):
+    list_display = ("id", "user", "word")
+    list_select_related = ("user",)
+    autocomplete_fields = ("user",)
+    search_fields = ("=word",)
+    ordering = ("-id",)
+
+
+@admin.register(SafeZone)
+class SafeZoneAdmin(BaseAdmin):
+    list_display = ("id", "name", "kind", "parent", "child", "is_active", "is_child_inside", "updated_at")
+    list_select_related = ("parent", "child")
+    list_filter = ("kind", "is_active")
+    autocomplete_fields = ("parent", "child")
+    ordering = ("-id",)
+
+
+@admin.register(SafeZoneEvent)
+class SafeZoneEventAdmin(BaseAdmin):
+    list_display = ("id", "child", "zone", "event", "created_at")
+    list_select_related = ("child", "zone")
+    list_filter = ("event",)
+    raw_id_fields = ("zone", "child")
+    ordering = ("-created_at",)
+
+
+class FamilyMemberInline(admin.TabularInline):
+    model = FamilyMember
+    autocomplete_fields = ("user",)
+    extra = 0
+
+
+@admin.register(Family)
+class FamilyAdmin(BaseAdmin):
+    list_display = ("id", "name", "created_by", "created_at")
+    list_select_related = ("created_by",)
+    autocomplete_fields = ("created_by",)
+    inlines = (FamilyMemberInline,)
+    ordering = ("-id",)
+
+
+@admin.register(Job)
+class JobAdmin(BaseAdmin):
+    list_display = ("id", "name", "queue", "status", "attempts", "max_attempts", "run_at", "updated_at")
+    list_filter = ("status", "queue", "name")
+    readonly_fields = ("locked_by", "locked_at", "last_error", "created_at", "updated_at")
+    ordering = ("-id",)
+    actions = ("retry_jobs",)
+
+    @admin.action(description="Перезапустить выбранные задачи")
+    def retry_jobs(self, request, queryset):
+        # ручной перезапуск — разовая задача: периодическую по расписанию ставит schedule_periodic
+        updated = queryset.exclude(status=Job.RUNNING).update(
+            status=Job.PENDING, attempts=0, run_at=timezone.now(), last_error="", periodic=False,
+            updated_at=timezone.now(),
+        )
+        self.message_user(request, f"Перезапущено задач: {updated}")
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(BaseAdmin):
+    list_display = ("id", "topic", "key", "created_at")
+    list_filter = ("topic",)
+    search_fields = ("=key",)
+    ordering = ("-id",)
+
+
+@admin.register(OutboxOffset)
+class OutboxOffsetAdmin(BaseAdmin):
+    list_display = ("id", "consumer", "source", "last_event_id", "gap_count", "updated_at")
+    list_filter = ("consumer", "source")
+    ordering = ("consumer", "source")
+
+    @admin.display(description="Пропусков")
+    def gap_count(self, offset):
+        return len(offset.gaps)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class SosModuleConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sos_module'
+
+    def ready(self):
+        from . import consumers  # noqa: F401 — регистрирует потребителей outbox
+        from . import sync  # noqa: F401 — подключает отметки удалений к post_delete
+        from . import tasks  # noqa: F401 — регистрирует обработчики фоновых задач
@@ -0,0 +1,18 @@
+from . import heatmap, outbox
+from .family import invalidate_dashboard
+from .models import FamilyMember
+
+
+@outbox.consumer("family.dashboard_cache", topics=[outbox.LOCATION_UPDATED, outbox.SOS_CREATED])
+def invalidate_family_dashboards(events):
+    """Сбрасывает кеш дашбордов семей, где у участника сменилась точка или появился SOS."""
+    user_ids = {int(event.key) for event in events}
+    family_ids = set(FamilyMember.objects.filter(user_id__in=user_ids).values_list("family_id", flat=True))
+    for family_id in family_ids:
+        invalidate_dashboard(family_id)
+
+
+@outbox.consumer(heatmap.CONSUMER, topics=heatmap.TOPICS)
+def update_sos_heatmap(events):
+    """Счётчики тепловой карты SOS; пишутся в одной транзакции со сдвигом позиции."""
+    heatmap.apply_events(events)
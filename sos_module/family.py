@@ -0,0 +1,88 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import FamilyMember
+
+
+def dashboard_cache_key(family_id):
+    return f"family-dashboard:{family_id}"
+
+
+def invalidate_dashboard(family_id):
+    cache.delete(dashboard_cache_key(family_id))
+
+
+def location_freshness(age_seconds):
+    config = settings.FAMILY_DASHBOARD
+    if age_seconds is None:
+        return "unknown"
+    if age_seconds <= config["FRESH_SECONDS"]:
+        return "fresh"
+    if age_seconds <= config["STALE_SECONDS"]:
+        return "stale"
+    return "lost"
+
+
+def build_dashboard(family_id):
+    """
+    Состояние всех членов семьи одним запросом: профиль, последняя точка
+    и число активных SOS (агрегат по JOIN с сигналами).
+    """
+    now = timezone.now()
+    members = (
+        FamilyMember.objects
+        .filter(family_id=family_id, is_accepted=True)
+        .select_related("user")
+        .prefetch_related("user__location")
+        .annotate(active_sos=Count("user__sent_sos", filter=Q(user__sent_sos__is_active=True)))
+        .order_by("role", "user_id")
+    )
+
+    result = []
+    for member in members:
+        user = member.user
+        location = getattr(user, "location", None)
+        age = int((now - location.updated_at).total_seconds()) if location else None
+        result.append({
+            "user_id": user.pk,
+            "first_name": user.first_name,
+            "last_name": user.last_name,
+            "role": member.role,
+            "avatar": user.avatar.url if user.avatar else None,
+            "is_online": user.is_online,
+            "last_seen": user.last_seen,
+            "location": {
+                "latitude": location.latitude,
+                "longitude": location.longitude,
+                "updated_at": location.updated_at,
+            } if location else None,
+            "location_age_seconds": age,
+            "freshness": location_freshness(age),
+            "active_sos": member.active_sos,
+        })
+    return {"family_id": family_id, "generated_at": now, "members": result}
+
+
+def get_dashboard(family_id):
+    """
+    Дашборд из кеша (на FAMILY_DASHBOARD["CACHE_TTL"] секунд) вместе с ETag,
+    чтобы частые обновления экрана обходились без пересборки и без тела ответа.
+    """
+    key = dashboard_cache_key(family_id)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    payload = json.loads(json.dumps(build_dashboard(family_id), cls=DjangoJSONEncoder))
+    # возраст точки растёт сам по себе — в ETag учитываем только реальные изменения
+    members = [{k: v for k, v in m.items() if k != "location_age_seconds"} for m in payload["members"]]
+    digest = hashlib.sha256(json.dumps(members, sort_keys=True).encode()).hexdigest()[:32]
+    cached = (f'"{digest}"', payload)
+    cache.set(key, cached, settings.FAMILY_DASHBOARD["CACHE_TTL"])
+    return cached
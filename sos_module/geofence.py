@@ -0,0 +1,200 @@
+import math
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .models import SafeZone, SafeZoneEvent
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = 111320.0
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def circle_bounds(latitude, longitude, radius_m):
+    """Ограничивающий прямоугольник круга: (min_lat, max_lat, min_lon, max_lon)."""
+    dlat = radius_m / METERS_PER_DEGREE
+    dlon = radius_m / (METERS_PER_DEGREE * max(math.cos(math.radians(latitude)), 1e-6))
+    return latitude - dlat, latitude + dlat, longitude - dlon, longitude + dlon
+
+
+def polygon_bounds(points):
+    lats = [lat for lat, _ in points]
+    lons = [lon for _, lon in points]
+    return min(lats), max(lats), min(lons), max(lons)
+
+
+def point_in_polygon(latitude, longitude, points):
+    """Проверка лучом (ray casting) в плоскости широта/долгота."""
+    inside = False
+    j = len(points) - 1
+    for i in range(len(points)):
+        lat_i, lon_i = points[i]
+        lat_j, lon_j = points[j]
+        if (lat_i > latitude) != (lat_j > latitude):
+            crossing = lon_i + (latitude - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+            if longitude < crossing:
+                inside = not inside
+        j = i
+    return inside
+
+
+class ZoneShape:
+    """Геометрия зоны, отвязанная от ORM, — то, что хранится в индексе."""
+
+    __slots__ = ("id", "kind", "bounds", "center", "radius_m", "points")
+
+    def __init__(self, zone_id, kind, bounds, center=None, radius_m=None, points=None):
+        self.id = zone_id
+        self.kind = kind
+        self.bounds = bounds
+        self.center = center
+        self.radius_m = radius_m
+        self.points = points
+
+    @classmethod
+    def from_zone(cls, zone):
+        bounds = (zone.min_latitude, zone.max_latitude, zone.min_longitude, zone.max_longitude)
+        if zone.kind == SafeZone.CIRCLE:
+            return cls(zone.id, zone.kind, bounds, (zone.center_latitude, zone.center_longitude), zone.radius_m)
+        return cls(zone.id, zone.kind, bounds, points=tuple(tuple(point) for point in zone.polygon))
+
+    def contains(self, latitude, longitude):
+        min_lat, max_lat, min_lon, max_lon = self.bounds
+        if not (min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon):
+            return False
+        if self.kind == SafeZone.CIRCLE:
+            return distance_m(latitude, longitude, *self.center) <= self.radius_m
+        return point_in_polygon(latitude, longitude, self.points)
+
+
+class ZoneIndex:
+    """
+    Равномерная сетка поверх зон: точка проверяется только против зон,
+    чьи ограничивающие прямоугольники пересекают её ячейку, и уже затем — точно.
+    Слишком большие зоны хранятся отдельно и проверяются по прямоугольнику.
+    """
+
+    def __init__(self, shapes, cell_size=None, max_cells_per_zone=None):
+        config = settings.SAFE_ZONES
+        self.cell_size = cell_size or config["GRID_CELL_DEG"]
+        max_cells = max_cells_per_zone or config["MAX_CELLS_PER_ZONE"]
+        self.cells = {}
+        self.large = []
+        for shape in shapes:
+            min_lat, max_lat, min_lon, max_lon = shape.bounds
+            x0, y0 = self._cell(min_lat, min_lon)
+            x1, y1 = self._cell(max_lat, max_lon)
+            if (x1 - x0 + 1) * (y1 - y0 + 1) > max_cells:
+                self.large.append(shape)
+                continue
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    self.cells.setdefault((x, y), []).append(shape)
+
+    def _cell(self, latitude, longitude):
+        return math.floor(latitude / self.cell_size), math.floor(longitude / self.cell_size)
+
+    def containing(self, latitude, longitude):
+        """id зон, внутри которых находится точка."""
+        candidates = self.cells.get(self._cell(latitude, longitude), ())
+        found = {shape.id for shape in candidates if shape.contains(latitude, longitude)}
+        found.update(shape.id for shape in self.large if shape.contains(latitude, longitude))
+        return found
+
+
+class ZoneIndexCache:
+    """
+    Индексы зон по ребёнку в памяти процесса. Индекс перестраивается, когда
+    меняется «подпись» набора зон (число активных зон и последнее изменение).
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, child):
+        zones = SafeZone.objects.filter(child=child, is_active=True)
+        signature = tuple(zones.aggregate(count=Count("id"), changed=Max("updated_at")).values())
+        with self.lock:
+            entry = self.entries.get(child.pk)
+            if entry is not None and entry[0] == signature:
+                self.entries.move_to_end(child.pk)
+                return entry[1]
+
+        index = ZoneIndex(ZoneShape.from_zone(zone) for zone in zones)
+        with self.lock:
+            self.entries[child.pk] = (signature, index)
+            self.entries.move_to_end(child.pk)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return index
+
+
+zone_indexes = ZoneIndexCache()
+
+
+def evaluate_location(child, latitude, longitude):
+    """
+    Проверяет новую точку ребёнка против его зон и записывает события
+    только для переходов вход/выход. Возвращает созданные события.
+    """
+    latitude = float(latitude)
+    longitude = float(longitude)
+    inside_now = zone_indexes.get(child).containing(latitude, longitude)
+    inside_before = set(
+        SafeZone.objects.filter(child=child, is_active=True, is_child_inside=True).values_list("id", flat=True)
+    )
+    if inside_now == inside_before:
+        # быстрый путь без блокировок: переходов нет, а таких точек большинство
+        return []
+    return record_transitions(child, inside_now, latitude, longitude)
+
+
+def record_transitions(child, inside_now, latitude, longitude):
+    """
+    Записывает переходы под блокировкой зон ребёнка. Две точки одного ребёнка,
+    пришедшие одновременно, видят состояние по очереди, поэтому каждый переход
+    даёт ровно одно событие, даже если обе прочитали старое состояние без блокировки.
+    """
+    with transaction.atomic():
+        state = dict(
+            SafeZone.objects.select_for_update()
+            .filter(child=child, is_active=True)
+            .values_list("id", "is_child_inside")
+        )
+        inside_before = {zone_id for zone_id, inside in state.items() if inside}
+        inside_now = inside_now & state.keys()  # зону могли выключить за это время
+        entered = inside_now - inside_before
+        exited = inside_before - inside_now
+        if not entered and not exited:
+            return []
+
+        now = timezone.now()
+        # сначала выходы, потом входы — в том порядке, в каком ребёнок пересекал границы
+        events = [
+            SafeZoneEvent(zone_id=zone_id, child=child, event=SafeZoneEvent.EXIT, latitude=latitude, longitude=longitude)
+            for zone_id in sorted(exited)
+        ] + [
+            SafeZoneEvent(zone_id=zone_id, child=child, event=SafeZoneEvent.ENTER, latitude=latitude, longitude=longitude)
+            for zone_id in sorted(entered)
+        ]
+        # update() не трогает updated_at, поэтому индекс зон не перестраивается
+        if entered:
+            SafeZone.objects.filter(pk__in=entered).update(is_child_inside=True, state_changed_at=now)
+        if exited:
+            SafeZone.objects.filter(pk__in=exited).update(is_child_inside=False, state_changed_at=now)
+        SafeZoneEvent.objects.bulk_create(events)
+    return events
@@ -0,0 +1,250 @@
+"""
+Тепловая карта SOS-сигналов для операторов.
+
+Сигналы агрегируются в ячейки сетки поверх тайлов карты (Web Mercator):
+на масштабе z ячейка — это тайл уровня z + CELL_SHIFT. Счётчики хранятся
+в SosHeatCell по часовым и суточным бакетам, поэтому запрос вьюпорта
+читает только непустые ячейки и не сканирует сами сигналы.
+
+Счётчики обновляет потребитель outbox (CONSUMER) по событиям создания,
+закрытия, изменения и удаления сигнала (удаление публикуется из post_delete,
+поэтому учитываются и каскадные) — вне транзакции, создающей SOS,
+так что отправка сигнала не ждёт блокировок горячих ячеек. Карта отстаёт
+от сигналов на паузу ретранслятора outbox.
+"""
+import math
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Sum
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import outbox
+from .models import OutboxEvent, SosHeatCell, SosSignal
+
+CONSUMER = "sos.heatmap"
+TOPICS = (outbox.SOS_CREATED, outbox.SOS_RESOLVED, outbox.SOS_UPDATED, outbox.SOS_DELETED)
+
+MAX_LATITUDE = 85.05112878
+
+WINDOWS = {
+    # окно: (гранулярность бакетов, длительность)
+    "hour": (SosHeatCell.HOUR, timedelta(hours=1)),
+    "day": (SosHeatCell.HOUR, timedelta(days=1)),
+    "week": (SosHeatCell.DAY, timedelta(days=7)),
+}
+
+
+def cell_level(zoom):
+    return zoom + settings.SOS_HEATMAP["CELL_SHIFT"]
+
+
+def cell_for(latitude, longitude, zoom):
+    """Номер ячейки (x, y) точки на масштабе zoom."""
+    n = 2 ** cell_level(zoom)
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    x = int((longitude + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def cell_center(cell_x, cell_y, zoom):
+    n = 2 ** cell_level(zoom)
+    longitude = (cell_x + 0.5) / n * 360.0 - 180.0
+    latitude = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (cell_y + 0.5) / n))))
+    return latitude, longitude
+
+
+def stored_zoom(zoom):
+    """Ближайший хранимый масштаб, не крупнее запрошенного."""
+    zooms = settings.SOS_HEATMAP["ZOOMS"]
+    return max([z for z in zooms if z <= zoom] or [min(zooms)])
+
+
+def bucket_start(moment, granularity):
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if granularity == SosHeatCell.DAY:
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def signal_keys(latitude, longitude, created_at):
+    """Все ячейки, в которые попадает сигнал: по каждому масштабу и гранулярности."""
+    keys = []
+    for granularity in (SosHeatCell.HOUR, SosHeatCell.DAY):
+        start = bucket_start(created_at, granularity)
+        for zoom in settings.SOS_HEATMAP["ZOOMS"]:
+            cell_x, cell_y = cell_for(latitude, longitude, zoom)
+            keys.append((granularity, zoom, start, cell_x, cell_y))
+    return keys
+
+
+def _apply(deltas):
+    """deltas — Counter ключ ячейки → (изменение total, изменение active)."""
+    fields = ("granularity", "zoom", "bucket_start", "cell_x", "cell_y")
+    with transaction.atomic():
+        for key, (total, active) in deltas.items():
+            lookup = dict(zip(fields, key))
+            changes = {"total_count": F("total_count") + total, "active_count": F("active_count") + active}
+            if SosHeatCell.objects.filter(**lookup).update(**changes):
+                continue
+            try:
+                with transaction.atomic():
+                    SosHeatCell.objects.create(total_count=total, active_count=active, **lookup)
+            except IntegrityError:
+                # ячейку только что создал параллельный запрос
+                SosHeatCell.objects.filter(**lookup).update(**changes)
+
+
+def _add(deltas, signal, total, active):
+    for key in signal_keys(signal.latitude, signal.longitude, signal.created_at):
+        current = deltas.get(key, (0, 0))
+        deltas[key] = (current[0] + total, current[1] + active)
+
+
+def _snapshot(payload):
+    """Сигнал, каким он был в момент события (из sos_payload)."""
+    return SimpleNamespace(
+        latitude=float(payload["latitude"]),
+        longitude=float(payload["longitude"]),
+        created_at=parse_datetime(payload["created_at"]),
+        is_active=payload.get("is_active", True),
+    )
+
+
+def apply_events(events):
+    """Переносит пачку событий о сигналах в счётчики ячеек одним набором UPDATE."""
+    deltas = {}
+    for event in events:
+        payload = event.payload
+        if event.topic == outbox.SOS_CREATED:
+            signal = _snapshot(payload)
+            _add(deltas, signal, 1, 1 if signal.is_active else 0)
+        elif event.topic == outbox.SOS_RESOLVED:
+            _add(deltas, _snapshot(payload), 0, -1)
+        elif event.topic == outbox.SOS_DELETED:
+            signal = _snapshot(payload)
+            _add(deltas, signal, -1, -1 if signal.is_active else 0)
+        elif event.topic == outbox.SOS_UPDATED:
+            # перенос или смена статуса — снимаем старый вклад в ячейки и добавляем новый
+            before, after = _snapshot(payload["before"]), _snapshot(payload["after"])
+            _add(deltas, before, -1, -1 if before.is_active else 0)
+            _add(deltas, after, 1, 1 if after.is_active else 0)
+    deltas = {key: change for key, change in deltas.items() if change != (0, 0)}
+    if deltas:
+        _apply(deltas)
+
+
+@receiver(post_delete, sender=SosSignal, dispatch_uid="heatmap.sos_deleted")
+def publish_sos_deletion(sender, instance, using, **kwargs):
+    # любое удаление — из API, админки или каскадом за пользователем — снимает вклад сигнала с карты
+    outbox.publish(outbox.SOS_DELETED, outbox.sos_payload(instance), key=instance.sender_id, using=using)
+
+
+def resolve_signals(queryset):
+    """Закрывает активные сигналы из queryset и публикует события для карты. Возвращает число закрытых."""
+    with transaction.atomic():
+        signals = list(queryset.filter(is_active=True).select_for_update())
+        if not signals:
+            return 0
+        SosSignal.objects.filter(pk__in=[s.pk for s in signals]).update(is_active=False, updated_at=timezone.now())
+        outbox.publish_many([(outbox.SOS_RESOLVED, outbox.sos_payload(s), s.sender_id) for s in signals])
+    return len(signals)
+
+
+def parse_bbox(value):
+    """'min_lon,min_lat,max_lon,max_lat' → кортеж чисел или ValueError."""
+    parts = [float(part) for part in value.split(",")]
+    if len(parts) != 4:
+        raise ValueError
+    min_lon, min_lat, max_lon, max_lat = parts
+    if not (-180 <= min_lon <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise ValueError
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def heatmap(bbox, zoom, window, now=None):
+    """
+    Ячейки внутри bbox с суммой счётчиков за окно. Окно отсчитывается
+    с начала бакета, в который попадает его левая граница. Если ячеек больше
+    MAX_CELLS, карта строится на более мелком хранимом масштабе; если не помещается
+    и там, отдаются первые MAX_CELLS ячеек с truncated=True.
+    """
+    granularity, length = WINDOWS[window]
+    now = now or timezone.now()
+    max_cells = settings.SOS_HEATMAP["MAX_CELLS"]
+    zooms = sorted((z for z in settings.SOS_HEATMAP["ZOOMS"] if z <= stored_zoom(zoom)), reverse=True)
+    min_lon, min_lat, max_lon, max_lat = bbox
+
+    for zoom in zooms:
+        x0, y0 = cell_for(max_lat, min_lon, zoom)
+        x1, y1 = cell_for(min_lat, max_lon, zoom)
+        rows = list(
+            SosHeatCell.objects
+            .filter(
+                granularity=granularity,
+                zoom=zoom,
+                bucket_start__gte=bucket_start(now - length, granularity),
+                cell_x__range=(x0, x1),
+                cell_y__range=(y0, y1),
+            )
+            .values("cell_x", "cell_y")
+            .annotate(total=Sum("total_count"), active=Sum("active_count"))
+            .filter(total__gt=0)
+            .order_by("cell_x", "cell_y")[:max_cells + 1]
+        )
+        truncated = len(rows) > max_cells
+        if not truncated:
+            break
+
+    cells = []
+    for row in rows[:max_cells]:
+        latitude, longitude = cell_center(row["cell_x"], row["cell_y"], zoom)
+        cells.append({
+            "x": row["cell_x"],
+            "y": row["cell_y"],
+            "latitude": round(latitude, 6),
+            "longitude": round(longitude, 6),
+            "total": row["total"],
+            "active": row["active"],
+        })
+    return {
+        "zoom": zoom,
+        "cell_level": cell_level(zoom),
+        "window": window,
+        "truncated": truncated,
+        "cells": cells,
+    }
+
+
+def rebuild(batch_size=5000):
+    """Полный пересчёт таблицы по всем сигналам (первичное заполнение или ремонт)."""
+    fields = ("granularity", "zoom", "bucket_start", "cell_x", "cell_y")
+    with transaction.atomic():
+        # события до этого момента попадут в пересчёт — потребитель продолжит со следующего
+        outbox.replay(CONSUMER, from_id=(OutboxEvent.objects.aggregate(last=Max("id"))["last"] or 0) + 1)
+
+        deltas = Counter()
+        active = Counter()
+        signals = SosSignal.objects.values_list("latitude", "longitude", "created_at", "is_active")
+        for latitude, longitude, created_at, is_active in signals.iterator(chunk_size=batch_size):
+            for key in signal_keys(latitude, longitude, created_at):
+                deltas[key] += 1
+                if is_active:
+                    active[key] += 1
+
+        SosHeatCell.objects.all().delete()
+        SosHeatCell.objects.bulk_create(
+            [
+                SosHeatCell(total_count=total, active_count=active[key], **dict(zip(fields, key)))
+                for key, total in deltas.items()
+            ],
+            batch_size=batch_size,
+        )
+    return len(deltas)
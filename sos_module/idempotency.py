@@ -0,0 +1,150 @@
+import hashlib
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+RETRY_AFTER_SECONDS = 1
+
+
+def request_fingerprint(request):
+    """Отпечаток запроса: один ключ нельзя переиспользовать для другого тела или адреса."""
+    data = request.data
+    if hasattr(data, "lists"):
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(f"{request.method}:{request.path}:{body}".encode()).hexdigest()
+
+
+def claim_key(user, key, fingerprint):
+    """
+    Пытается занять ключ. Возвращает (запись, True), если запрос первый
+    или если он перехватил брошенный ключ, и (существующая запись, False)
+    для повторов. Уникальный индекс (user, key) гарантирует, что при гонке
+    ключ займёт ровно один запрос.
+
+    Пока запрос выполняется, ключ держится арендой locked_at. Если процесс
+    умер, не дописав ответ (OOM, таймаут воркера), его транзакция с записью
+    откатывается, аренда истекает через IDEMPOTENCY_LOCK_TIMEOUT и ключ
+    перехватывает следующий повтор.
+    """
+    for _ in range(2):
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(
+                    user=user,
+                    key=key,
+                    request_hash=fingerprint,
+                    locked_at=now,
+                    expires_at=now + settings.IDEMPOTENCY_KEY_TTL,
+                )
+            return record, True
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if record is None:
+                continue  # запись успели удалить — пробуем ещё раз
+            if record.expires_at <= now:
+                IdempotencyKey.objects.filter(pk=record.pk, expires_at__lte=now).delete()
+                continue
+            if record.is_complete or record.request_hash != fingerprint or not lease_expired(record, now):
+                return record, False
+            # условный UPDATE: из нескольких повторов ключ перехватит ровно один
+            taken = IdempotencyKey.objects.filter(
+                pk=record.pk, status_code__isnull=True, locked_at=record.locked_at
+            ).update(locked_at=now)
+            if taken:
+                record.locked_at = now
+                return record, True
+            return IdempotencyKey.objects.filter(pk=record.pk).first(), False
+    return None, False
+
+
+def lease_expired(record, now=None):
+    now = now or timezone.now()
+    return record.locked_at is None or record.locked_at <= now - settings.IDEMPOTENCY_LOCK_TIMEOUT
+
+
+def owned(record):
+    """Запись, пока её аренда принадлежит этому запросу."""
+    return IdempotencyKey.objects.filter(pk=record.pk, locked_at=record.locked_at, status_code__isnull=True)
+
+
+def purge_expired_keys():
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+
+def in_flight_response():
+    # не держим воркер в ожидании — клиент повторит позже
+    response = Response(
+        {"detail": "Запрос с этим Idempotency-Key ещё обрабатывается."},
+        status=status.HTTP_409_CONFLICT,
+    )
+    response["Retry-After"] = str(RETRY_AFTER_SECONDS)
+    return response
+
+
+def idempotent(view_method):
+    """
+    Декоратор для POST-обработчиков: при заголовке Idempotency-Key первый ответ
+    сохраняется и повторно отдаётся на все повторы с тем же ключом,
+    не выполняя обработчик ещё раз.
+    """
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"detail": f"Idempotency-Key длиннее {MAX_KEY_LENGTH} символов."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        fingerprint = request_fingerprint(request)
+        record, created = claim_key(request.user, key, fingerprint)
+
+        if not created:
+            if record is not None and record.request_hash != fingerprint:
+                return Response(
+                    {"detail": "Idempotency-Key уже использован для другого запроса."},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if record is None or not record.is_complete:
+                return in_flight_response()
+            response = Response(record.response_body, status=record.status_code)
+            response["Idempotent-Replayed"] = "true"
+            return response
+
+        try:
+            with transaction.atomic():
+                # обработчик и ответ коммитятся вместе: ключ становится окончательным ровно
+                # тогда, когда закоммичена запись. Условный UPDATE держит строку ключа до коммита —
+                # повтор, перехватывающий аренду медленного запроса, дождётся его ответа.
+                now = timezone.now()
+                if not owned(record).update(locked_at=now):
+                    return in_flight_response()
+                record.locked_at = now
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code < 500:
+                    owned(record).update(status_code=response.status_code, response_body=response.data)
+                    return response
+                # ошибку сервера не запоминаем — клиент должен иметь возможность повторить
+                transaction.set_rollback(True)
+        except BaseException:
+            owned(record).delete()
+            raise
+        owned(record).delete()
+        return response
+
+    return wrapper
@@ -0,0 +1,225 @@
+"""
+Фоновые задачи поверх основной базы данных.
+
+Задача — строка Job; воркер (manage.py run_jobs) забирает готовые к запуску
+строки, выполняет зарегистрированный обработчик и при ошибке откладывает
+повтор с экспоненциальной задержкой. После max_attempts задача попадает
+в статус dead, откуда её можно перезапустить из админки.
+
+Пока задача выполняется, воркер раз в HEARTBEAT_INTERVAL продлевает locked_at,
+поэтому в очередь возвращаются только задачи действительно пропавших воркеров.
+Долгоживущий воркер также ставит периодические задачи из JOBS["PERIODIC"]
+(например, maintenance.purge).
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+def task(name, max_attempts=None):
+    """Регистрирует функцию как обработчик задачи: @task("sos.notify")."""
+
+    def decorator(func):
+        registry[name] = (func, max_attempts)
+        return func
+
+    return decorator
+
+
+def enqueue(name, payload=None, queue="default", run_at=None, max_attempts=None, periodic=False):
+    """
+    Ставит задачу в очередь. Строка Job пишется в текущей транзакции вместе
+    с данными: воркер увидит её только после коммита, а при откате задача
+    исчезнет вместе с изменениями. Периодическая задача (periodic=True) может
+    ждать или выполняться только в одном экземпляре — второй даст IntegrityError.
+    """
+    if name not in registry:
+        raise KeyError(f"Неизвестная задача: {name}")
+    _, default_attempts = registry[name]
+    return Job.objects.create(
+        name=name,
+        queue=queue,
+        payload=payload or {},
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts or default_attempts or settings.JOBS["MAX_ATTEMPTS"],
+        periodic=periodic,
+    )
+
+
+def retry_delay(attempts):
+    config = settings.JOBS
+    delay = min(config["RETRY_BACKOFF"] * 2 ** (attempts - 1), config["RETRY_BACKOFF_MAX"])
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def claim(worker_id, queues, limit):
+    """
+    Забирает до limit готовых задач. На PostgreSQL/MySQL строки блокируются
+    через SELECT … FOR UPDATE SKIP LOCKED; на SQLite (записи и так
+    сериализуются) задача забирается условным UPDATE по статусу.
+    """
+    now = timezone.now()
+    ready = Job.objects.filter(status=Job.PENDING, queue__in=queues, run_at__lte=now).order_by("run_at", "id")
+    claimed_fields = {
+        "status": Job.RUNNING,
+        "locked_by": worker_id,
+        "locked_at": now,
+        "attempts": F("attempts") + 1,
+        "updated_at": now,
+    }
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(ready.select_for_update(skip_locked=True).values_list("id", flat=True)[:limit])
+            Job.objects.filter(pk__in=ids).update(**claimed_fields)
+    else:
+        ids = []
+        for job_id in ready.values_list("id", flat=True)[:limit]:
+            if Job.objects.filter(pk=job_id, status=Job.PENDING).update(**claimed_fields):
+                ids.append(job_id)
+    return list(Job.objects.filter(pk__in=ids).order_by("run_at", "id"))
+
+
+def requeue_stale(queues):
+    """
+    Возвращает в очередь задачи, чей воркер пропал (не продлевал аренду
+    VISIBILITY_TIMEOUT секунд). Попытка пропавшего воркера засчитана ещё при
+    захвате, поэтому задача, которая раз за разом роняет воркер, после
+    max_attempts уходит в dead, а не крутится вечно.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        queue__in=queues,
+        locked_at__lt=now - timedelta(seconds=settings.JOBS["VISIBILITY_TIMEOUT"]),
+    )
+    released = {"locked_by": "", "locked_at": None, "updated_at": now}
+    dead = stale.filter(attempts__gte=F("max_attempts")).update(
+        status=Job.DEAD, last_error="Воркер пропал во время выполнения.", **released
+    )
+    if dead:
+        logger.error("Задач без воркера, исчерпавших попытки: %s — перенесены в dead", dead)
+    return stale.update(status=Job.PENDING, **released)
+
+
+def heartbeat(worker_id):
+    """Продлевает аренду всех задач, которые сейчас выполняет воркер."""
+    return Job.objects.filter(status=Job.RUNNING, locked_by=worker_id).update(locked_at=timezone.now())
+
+
+def schedule_periodic():
+    """
+    Ставит задачи из JOBS["PERIODIC"] ({имя: интервал}), если следующий запуск
+    ещё не запланирован: не раньше чем через интервал после последнего выполнения.
+    Гонку воркеров, стартовавших одновременно, решает ограничение job_periodic_unique.
+    """
+    now = timezone.now()
+    scheduled = []
+    for name, interval in settings.JOBS.get("PERIODIC", {}).items():
+        if Job.objects.filter(name=name, periodic=True, status__in=(Job.PENDING, Job.RUNNING)).exists():
+            continue
+        last = Job.objects.filter(name=name, periodic=True, status=Job.DONE).aggregate(last=Max("updated_at"))["last"]
+        try:
+            with transaction.atomic():
+                scheduled.append(enqueue(name, run_at=max(now, last + interval) if last else now, periodic=True))
+        except IntegrityError:
+            pass  # задачу только что поставил другой воркер
+    return scheduled
+
+
+def execute(job):
+    """Выполняет одну задачу и записывает результат: done, повтор или dead."""
+    try:
+        handler, _ = registry[job.name]
+        handler(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error("Задача %s исчерпала попытки и перенесена в dead", job)
+            fields = {"status": Job.DEAD}
+        else:
+            logger.warning("Задача %s упала, повтор через backoff", job)
+            fields = {"status": Job.PENDING, "run_at": timezone.now() + retry_delay(job.attempts)}
+        Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+            last_error=error, locked_by="", locked_at=None, updated_at=timezone.now(), **fields
+        )
+        return False
+
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        status=Job.DONE, locked_by="", locked_at=None, updated_at=timezone.now()
+    )
+    return True
+
+
+class Worker:
+    """Пул потоков, которые выполняют задачи из указанных очередей."""
+
+    def __init__(self, queues=("default",), concurrency=4, poll_interval=None):
+        self.queues = list(queues)
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval or settings.JOBS["POLL_INTERVAL"]
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{id(self):x}"
+        self.stop_event = threading.Event()
+        self.slots = threading.Semaphore(concurrency)
+        self.heartbeat_interval = settings.JOBS.get("HEARTBEAT_INTERVAL", settings.JOBS["VISIBILITY_TIMEOUT"] / 3)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _run(self, job):
+        try:
+            execute(job)
+        finally:
+            # у каждого потока своё соединение — не оставляем его висеть между задачами
+            connection.close()
+            self.slots.release()
+
+    def run(self, burst=False):
+        """
+        Основной цикл. burst=True — выйти, как только очередь опустеет
+        (удобно для разовых прогонов и тестов); периодические задачи
+        в этом режиме не планируются.
+        """
+        processed = 0
+        next_heartbeat = 0.0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while not self.stop_event.is_set():
+                if time.monotonic() >= next_heartbeat:
+                    heartbeat(self.worker_id)
+                    requeue_stale(self.queues)
+                    if not burst:
+                        schedule_periodic()
+                    next_heartbeat = time.monotonic() + self.heartbeat_interval
+                free = 0
+                while self.slots.acquire(blocking=False):
+                    free += 1
+                jobs = claim(self.worker_id, self.queues, free) if free else []
+                for _ in range(free - len(jobs)):
+                    self.slots.release()
+                for job in jobs:
+                    pool.submit(self._run, job)
+                processed += len(jobs)
+
+                if not jobs:
+                    if burst and free == self.concurrency:
+                        break
+                    # в burst-режиме ждём только завершения уже взятых задач
+                    self.stop_event.wait(min(self.poll_interval, 0.05) if burst else self.poll_interval)
+        return processed
@@ -0,0 +1,93 @@
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+# имя сценария -> (метод, путь, тело)
+SCENARIOS = {
+    "sos": ("POST", "/api/sos/", {"latitude": 42.87, "longitude": 74.59}),
+    "location": ("POST", "/api/location/update/", {"latitude": 42.87, "longitude": 74.59}),
+    "status": ("POST", "/api/auth/update-status/", {"is_online": True}),
+    "list": ("GET", "/api/contacts/", None),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Локальный генератор нагрузки для проверки приоритетного допуска: "
+        "смешивает SOS, обновления геолокации и списки и печатает задержки по сценариям"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Адрес запущенного сервера")
+        parser.add_argument("--token", required=True, help="JWT access-токен пользователя")
+        parser.add_argument("--duration", type=float, default=10.0, help="Длительность в секундах")
+        parser.add_argument("--concurrency", type=int, default=50, help="Число параллельных клиентов")
+        parser.add_argument(
+            "--mix",
+            default="sos=1,location=10,status=5,list=20",
+            help="Веса сценариев, например sos=1,location=10,list=20",
+        )
+
+    def handle(self, *args, **options):
+        weights = {}
+        for part in options["mix"].split(","):
+            name, _, weight = part.partition("=")
+            if name not in SCENARIOS:
+                raise CommandError(f"Неизвестный сценарий: {name}")
+            weights[name] = float(weight or 1)
+
+        names = list(weights)
+        stats = defaultdict(lambda: {"latencies": [], "statuses": defaultdict(int)})
+        lock = threading.Lock()
+        deadline = time.monotonic() + options["duration"]
+
+        def worker():
+            while time.monotonic() < deadline:
+                name = random.choices(names, weights=[weights[n] for n in names])[0]
+                method, path, body = SCENARIOS[name]
+                request = urllib.request.Request(
+                    options["url"].rstrip("/") + path,
+                    data=json.dumps(body).encode() if body is not None else None,
+                    method=method,
+                    headers={
+                        "Authorization": f"Bearer {options['token']}",
+                        "Content-Type": "application/json",
+                    },
+                )
+                started = time.monotonic()
+                try:
+                    with urllib.request.urlopen(request, timeout=30) as response:
+                        response.read()
+                        code = response.status
+                except urllib.error.HTTPError as exc:
+                    code = exc.code
+                except OSError:
+                    code = 0
+                elapsed = time.monotonic() - started
+                with lock:
+                    stats[name]["latencies"].append(elapsed)
+                    stats[name]["statuses"][code] += 1
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(options["concurrency"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.stdout.write(f"{'сценарий':<10} {'запросов':>8} {'p50, мс':>9} {'p95, мс':>9} {'503':>6}  коды")
+        for name in names:
+            latencies = sorted(stats[name]["latencies"])
+            if not latencies:
+                continue
+            p50 = latencies[len(latencies) // 2] * 1000
+            p95 = latencies[int(len(latencies) * 0.95)] * 1000
+            statuses = dict(stats[name]["statuses"])
+            self.stdout.write(
+                f"{name:<10} {len(latencies):>8} {p50:>9.1f} {p95:>9.1f} {statuses.get(503, 0):>6}  {statuses}"
+            )
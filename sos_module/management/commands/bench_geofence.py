@@ -0,0 +1,105 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from sos_module.geofence import ZoneIndex, ZoneShape, circle_bounds, evaluate_location, polygon_bounds
+from sos_module.models import SafeZone, User
+
+# окрестности Бишкека
+CENTER_LAT = 42.87
+CENTER_LON = 74.59
+SPREAD_DEG = 0.3
+
+
+def random_shape(zone_id, rng):
+    lat = CENTER_LAT + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+    lon = CENTER_LON + rng.uniform(-SPREAD_DEG, SPREAD_DEG)
+    radius = rng.uniform(50, 2000)
+    if zone_id % 2:
+        return ZoneShape(zone_id, SafeZone.CIRCLE, circle_bounds(lat, lon, radius), (lat, lon), radius)
+    step = radius / 111320
+    points = tuple(
+        (lat + step * math.sin(angle), lon + step * math.cos(angle))
+        for angle in sorted(rng.uniform(0, 2 * math.pi) for _ in range(rng.randint(3, 12)))
+    )
+    return ZoneShape(zone_id, SafeZone.POLYGON, polygon_bounds(points), points=points)
+
+
+class Command(BaseCommand):
+    help = "Бенчмарк проверки точки против безопасных зон: сетка + точная проверка против полного перебора"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--zones", type=int, default=5000)
+        parser.add_argument("--pings", type=int, default=20000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--child-zones", type=int, default=20, help="зон у ребёнка в проверке с базой")
+        parser.add_argument("--db-pings", type=int, default=2000, help="точек в проверке с базой (0 — пропустить)")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        shapes = [random_shape(zone_id, rng) for zone_id in range(options["zones"])]
+        pings = [
+            (CENTER_LAT + rng.uniform(-SPREAD_DEG, SPREAD_DEG), CENTER_LON + rng.uniform(-SPREAD_DEG, SPREAD_DEG))
+            for _ in range(options["pings"])
+        ]
+
+        started = time.perf_counter()
+        index = ZoneIndex(shapes)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        indexed = [index.containing(lat, lon) for lat, lon in pings]
+        indexed_us = (time.perf_counter() - started) / len(pings) * 1e6
+
+        brute_pings = pings[:max(1, len(pings) // 20)]
+        started = time.perf_counter()
+        brute = [{s.id for s in shapes if s.contains(lat, lon)} for lat, lon in brute_pings]
+        brute_us = (time.perf_counter() - started) / len(brute_pings) * 1e6
+
+        if brute != indexed[:len(brute)]:
+            self.stderr.write("Результаты индекса и полного перебора расходятся!")
+
+        self.stdout.write(f"зон: {len(shapes)}, точек: {len(pings)}, построение индекса: {build_ms:.1f} мс")
+        self.stdout.write(f"сетка + точная проверка: {indexed_us:.1f} мкс на точку")
+        self.stdout.write(f"полный перебор:          {brute_us:.1f} мкс на точку")
+
+        if options["db_pings"]:
+            self.bench_with_database(rng, options["child_zones"], options["db_pings"])
+
+    def bench_with_database(self, rng, zone_count, ping_count):
+        """
+        Полный путь одной точки, как в /api/location/update/: подпись набора зон,
+        чтение состояния, запись переходов. Все данные откатываются в конце.
+        """
+        with transaction.atomic():
+            child = User.objects.create(email="bench-geofence@sakbol.invalid", role="child")
+            for zone_id in range(zone_count):
+                shape = random_shape(zone_id, rng)
+                if shape.kind == SafeZone.CIRCLE:
+                    geometry = {"center_latitude": shape.center[0], "center_longitude": shape.center[1],
+                                "radius_m": shape.radius_m}
+                else:
+                    geometry = {"polygon": [list(point) for point in shape.points]}
+                SafeZone.objects.create(parent=child, child=child, name=f"bench {zone_id}", kind=shape.kind, **geometry)
+
+            # ребёнок идёт по прямой через город — переходы случаются, но редко
+            path = [
+                (CENTER_LAT - SPREAD_DEG + 2 * SPREAD_DEG * i / ping_count, CENTER_LON + 0.01 * math.sin(i / 50))
+                for i in range(ping_count)
+            ]
+            events = 0
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                for lat, lon in path:
+                    events += len(evaluate_location(child, lat, lon))
+                elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+
+        self.stdout.write(
+            f"с базой ({connection.vendor}, {zone_count} зон у ребёнка): {elapsed / ping_count * 1e6:.1f} мкс на точку, "
+            f"{len(queries) / ping_count:.2f} запроса на точку, переходов: {events}"
+        )
@@ -0,0 +1,74 @@
+import multiprocessing
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings
+
+from sos_module.models import Location
+from sos_module.sharding import add_sqlite_alias
+
+
+def write_locations(items):
+    for user_id, latitude, longitude in items:
+        Location.objects.update_or_create(user_id=user_id, defaults={"latitude": latitude, "longitude": longitude})
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        "Бенчмарк записи геолокаций в N шардов на локальных SQLite-файлах: "
+        "параллельные процессы с update_or_create, как у /api/location/update/"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shards", default="1,2,4,8", help="число шардов через запятую")
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument("--writes", type=int, default=4000, help="записей на прогон")
+        parser.add_argument("--processes", type=int, default=8, help="параллельных писателей")
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = None
+            for count in [int(value) for value in options["shards"].split(",")]:
+                rate = self.run(Path(directory) / f"x{count}", count, options)
+                baseline = baseline or rate
+                self.stdout.write(f"шардов: {count:>2}  записей/с: {rate:>8.0f}  ускорение: {rate / baseline:.2f}x")
+
+    def run(self, directory, count, options):
+        directory.mkdir()
+        aliases = [f"bench_location_{count}_{i}" for i in range(count)]
+        for i, alias in enumerate(aliases):
+            add_sqlite_alias(alias, directory / f"shard_{i}.sqlite3")
+            with connections[alias].schema_editor() as editor:
+                editor.create_model(Location)
+
+        rng = random.Random(options["seed"])
+        writes = [
+            (rng.randint(1, options["users"]), rng.uniform(42.7, 43.0), rng.uniform(74.4, 74.8))
+            for _ in range(options["writes"])
+        ]
+        chunks = [writes[i::options["processes"]] for i in range(options["processes"])]
+
+        with override_settings(LOCATION_SHARDS=aliases):
+            # соединения нельзя наследовать через fork — каждый процесс откроет свои
+            connections.close_all()
+            context = multiprocessing.get_context("fork")
+            processes = [context.Process(target=write_locations, args=(chunk,)) for chunk in chunks]
+            started = time.perf_counter()
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            elapsed = time.perf_counter() - started
+
+            stored = sum(Location.objects.using(alias).count() for alias in aliases)
+            expected = len({user_id for user_id, _, _ in writes})
+            if stored != expected:
+                self.stderr.write(f"Ожидалось {expected} точек, в шардах {stored}")
+        connections.close_all()
+        return len(writes) / elapsed
@@ -0,0 +1,43 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
+
+from sos_module.sharding import SHARD_LOCAL_MODELS, SHARDED_MODEL, shard_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        "Создаёт таблицы нового шарда (Location и локальные таблицы шарда) по текущим моделям "
+        "и отмечает все миграции применёнными. Дальнейшие миграции — обычным migrate --database=<алиас>."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("alias", help="алиас базы из LOCATION_SHARDS")
+
+    def handle(self, *args, **options):
+        alias = options["alias"]
+        if alias == "default" or alias not in shard_aliases():
+            raise CommandError(f"{alias} не шард: укажите алиас из LOCATION_SHARDS, кроме default")
+        connection = connections[alias]
+        recorder = MigrationRecorder(connection)
+        if recorder.has_table() and recorder.applied_migrations():
+            raise CommandError(f"В {alias} уже есть применённые миграции — используйте migrate --database={alias}")
+
+        # модели в текущем состоянии: поле user без ограничения FK, в отличие от 0001
+        models = [apps.get_model("sos_module", name) for name in (SHARDED_MODEL, *SHARD_LOCAL_MODELS)]
+        existing = set(connection.introspection.table_names())
+        with connection.schema_editor() as editor:
+            for model in models:
+                if model._meta.db_table not in existing:
+                    editor.create_model(model)
+
+        # остальные таблицы роутер в шард не пускает, так что migrate для них ничего бы не сделал
+        loader = MigrationLoader(connection)
+        recorder.ensure_schema()
+        for app_label, name in loader.graph.nodes:
+            recorder.record_applied(app_label, name)
+
+        self.stdout.write(f"Шард {alias}: таблицы {', '.join(m._meta.db_table for m in models)}, "
+                          f"миграций отмечено: {len(loader.graph.nodes)}")
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from sos_module.sync import purge_tombstones
+
+
+class Command(BaseCommand):
+    help = "Удаляет отметки об удалении старше SYNC_TOMBSTONE_TTL (такие курсоры всё равно получают полный снимок)"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Удалено отметок: {purge_tombstones()}")
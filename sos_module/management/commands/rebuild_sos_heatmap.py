@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from sos_module.heatmap import rebuild
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает тепловую карту SOS-сигналов с нуля"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Ячеек записано: {rebuild(batch_size=options['batch_size'])}")
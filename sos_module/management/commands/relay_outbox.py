@@ -0,0 +1,37 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from sos_module import outbox
+
+
+class Command(BaseCommand):
+    help = "Ретранслятор outbox: доставляет доменные события зарегистрированным потребителям"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--consumer", action="append", dest="consumers", help="Потребитель (можно несколько раз)")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--once", action="store_true", help="Один проход и выход")
+
+    def handle(self, *args, **options):
+        consumers = options["consumers"] or list(outbox.registry)
+        unknown = set(consumers) - set(outbox.registry)
+        if unknown:
+            raise CommandError(f"Неизвестные потребители: {', '.join(sorted(unknown))}")
+
+        if options["once"]:
+            delivered = outbox.relay(consumers, options["batch_size"])
+            self.stdout.write(f"Доставлено событий: {delivered}")
+            return
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        signal.signal(signal.SIGINT, lambda *args: stop.set())
+        while not stop.is_set():
+            if not outbox.relay(consumers, options["batch_size"]):
+                # не держим соединения открытыми, пока ждём новых событий
+                connections.close_all()
+                stop.wait(settings.OUTBOX["POLL_INTERVAL"])
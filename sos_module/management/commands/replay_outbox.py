@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from sos_module import outbox
+
+
+class Command(BaseCommand):
+    help = "Перематывает позицию потребителя outbox, чтобы заново получить события (например, после сбоя)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("consumer")
+        parser.add_argument("--source", action="append", dest="sources", help="База-источник (по умолчанию все)")
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument("--from-id", type=int, help="id первого события для повторной доставки")
+        group.add_argument("--since", help="Дата и время ISO 8601: повторить события начиная с этого момента")
+
+    def handle(self, *args, **options):
+        if options["consumer"] not in outbox.registry:
+            raise CommandError(f"Неизвестный потребитель: {options['consumer']}")
+        since = None
+        if options["since"]:
+            since = parse_datetime(options["since"])
+            if since is None:
+                raise CommandError("--since должен быть датой в формате ISO 8601.")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+
+        for source in options["sources"] or outbox.sources():
+            position = outbox.replay(options["consumer"], source, from_id=options["from_id"], since=since)
+            self.stdout.write(f"{options['consumer']}@{source}: позиция {position}")
+        self.stdout.write("События будут доставлены при следующем проходе relay_outbox.")
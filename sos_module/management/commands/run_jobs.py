@@ -0,0 +1,51 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from sos_module.jobs import Worker
+
+
+def run_worker(queues, threads, burst):
+    worker = Worker(queues=queues, concurrency=threads)
+    signal.signal(signal.SIGTERM, lambda *args: worker.stop())
+    signal.signal(signal.SIGINT, lambda *args: worker.stop())
+    return worker.run(burst=burst)
+
+
+class Command(BaseCommand):
+    help = "Воркер фоновых задач: пул потоков (и при необходимости процессов), забирающий задачи из базы"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queue", action="append", dest="queues", help="Очередь (можно указать несколько раз)")
+        parser.add_argument("--threads", type=int, default=4, help="Потоков в каждом процессе")
+        parser.add_argument("--processes", type=int, default=1, help="Число процессов-воркеров")
+        parser.add_argument("--burst", action="store_true", help="Выйти, когда очередь опустеет")
+
+    def handle(self, *args, **options):
+        queues = options["queues"] or ["default"]
+        threads = options["threads"]
+        burst = options["burst"]
+
+        if options["processes"] <= 1:
+            processed = run_worker(queues, threads, burst)
+            self.stdout.write(f"Выполнено задач: {processed}")
+            return
+
+        # соединения нельзя наследовать через fork — каждый процесс откроет свои
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(target=run_worker, args=(queues, threads, burst))
+            for _ in range(options["processes"])
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
+                process.join()
@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from sos_module.models import Location
+from sos_module.sharding import shard_aliases, shard_for
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит точки из базы-источника в шарды по текущему LOCATION_SHARDS. "
+        "Таблицы в шардах должны быть созданы заранее (init_location_shard <алиас>)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--source", default="default", help="алиас, из которого переносятся точки")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        source = options["source"]
+        if source not in connections:
+            raise CommandError(f"Неизвестный алиас базы: {source}")
+
+        moved = kept = 0
+        last_id = 0
+        while True:
+            batch = list(
+                Location.objects.using(source).filter(id__gt=last_id).order_by("id")[: options["batch_size"]]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            groups = {}
+            for location in batch:
+                target = shard_for(location.user_id)
+                if target == source:
+                    kept += 1
+                else:
+                    groups.setdefault(target, []).append(location)
+
+            for target, locations in groups.items():
+                moved += len(locations)
+                if not options["dry_run"]:
+                    self.move(source, target, locations)
+
+        self.stdout.write(
+            f"Шарды: {', '.join(shard_aliases())}. Перенесено: {moved}, осталось на месте: {kept}"
+            + (" (dry-run)" if options["dry_run"] else "")
+        )
+
+    def move(self, source, target, locations):
+        """
+        Копирует пачку в шард и удаляет её из источника. Повторный запуск безопасен:
+        если в шарде уже есть более свежая точка пользователя, она не перезаписывается.
+        """
+        existing = {
+            location.user_id: location
+            for location in Location.objects.using(target).filter(user_id__in=[location.user_id for location in locations])
+        }
+        created, updated = [], []
+        for location in locations:
+            current = existing.get(location.user_id)
+            if current is None:
+                created.append(Location(
+                    user_id=location.user_id,
+                    latitude=location.latitude,
+                    longitude=location.longitude,
+                    updated_at=location.updated_at,
+                ))
+            elif current.updated_at < location.updated_at:
+                current.latitude = location.latitude
+                current.longitude = location.longitude
+                current.updated_at = location.updated_at
+                updated.append(current)
+
+        # auto_now при вставке ставит текущее время — исходное восстанавливаем после
+        timestamps = {location.user_id: location.updated_at for location in created}
+        with transaction.atomic(using=target):
+            Location.objects.using(target).bulk_create(created)
+            if created:
+                inserted = list(Location.objects.using(target).filter(user_id__in=timestamps))
+                for location in inserted:
+                    location.updated_at = timestamps[location.user_id]
+                updated.extend(inserted)
+            Location.objects.using(target).bulk_update(updated, ["latitude", "longitude", "updated_at"])
+        Location.objects.using(source).filter(pk__in=[location.pk for location in locations]).delete()
@@ -0,0 +1,275 @@
+import cProfile
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.http import JsonResponse
+
+CRITICAL = "critical"
+
+
+TOTAL = "__total__"
+
+
+class AdmissionClass:
+    """Класс приоритета: лимиты и сглаженная задержка ответов этого процесса."""
+
+    def __init__(self, name, max_concurrency=None, max_latency=None, max_queue_depth=None):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_latency = max_latency
+        self.max_queue_depth = max_queue_depth
+        self.latency = 0.0
+        self.latency_updated_at = 0.0
+
+
+class LocalCounters:
+    """
+    Счётчики запросов в работе в памяти процесса. Видят только потоки
+    своего процесса, поэтому годятся лишь для threaded WSGI или ASGI:
+    у sync-воркера в работе всегда не больше одного запроса.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def incr(self, name, delta=1):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + delta
+            return self.values[name]
+
+
+class CacheCounters:
+    """
+    Общие для всех воркеров счётчики в кэше (Redis/Memcached) — для sync WSGI
+    с несколькими процессами. Каждое изменение продлевает ключ на TTL секунд:
+    если воркер умер посреди запроса, потерянная единица исчезнет вместе с ключом,
+    как только класс простоит TTL без запросов, а не останется навсегда.
+    """
+
+    def __init__(self, alias, ttl):
+        self.cache = caches[alias]
+        self.ttl = ttl
+
+    def incr(self, name, delta=1):
+        key = f"admission:{name}"
+        for _ in range(2):
+            self.cache.add(key, 0, self.ttl)
+            try:
+                value = self.cache.incr(key, delta)
+            except ValueError:
+                continue  # ключ истёк между add и incr
+            # incr не продлевает TTL: иначе ключ истекал бы под запросами в работе
+            self.cache.touch(key, self.ttl)
+            if value < 0:
+                # освобождение запроса, начатого до истечения ключа: возвращаем счётчик к нулю,
+                # а не оставляем в минусе — иначе следующие запросы прошли бы сверх лимита
+                try:
+                    value = self.cache.incr(key, -value)
+                except ValueError:
+                    value = 0
+            return max(value, 0)
+        return 0
+
+
+class AdmissionController:
+    """
+    Разделяет запросы на классы по маршруту и ограничивает каждый класс
+    по числу одновременных запросов, общей глубине очереди и задержке.
+    Лимит параллелизма жёсткий; по глубине очереди и задержке запросы
+    отбрасываются с вероятностью, растущей вместе с перегрузкой,
+    чтобы нагрузка снижалась плавно, а не обрывом.
+    Критичный класс (SOS) не отбрасывается никогда.
+    """
+
+    def __init__(self, config):
+        self.default_class = config.get("DEFAULT_CLASS", "best_effort")
+        self.path_prefix = config.get("PATH_PREFIX", "/api/")
+        self.retry_after = config.get("RETRY_AFTER", 2)
+        self.latency_window = config.get("LATENCY_WINDOW", 5.0)
+        self.smoothing = config.get("LATENCY_SMOOTHING", 0.2)
+        self.shed_start = config.get("SHED_START", 0.5)
+        self.classes = {
+            name: AdmissionClass(
+                name,
+                max_concurrency=options.get("MAX_CONCURRENCY"),
+                max_latency=options.get("MAX_LATENCY"),
+                max_queue_depth=options.get("MAX_QUEUE_DEPTH"),
+            )
+            for name, options in config.get("CLASSES", {}).items()
+        }
+        self.classes.setdefault(CRITICAL, AdmissionClass(CRITICAL))
+        self.classes.setdefault(self.default_class, AdmissionClass(self.default_class))
+        self.routes = [
+            (method.upper(), re.compile(pattern), class_name)
+            for method, pattern, class_name in config.get("ROUTES", [])
+        ]
+        if config.get("SHARED_CACHE"):
+            self.counters = CacheCounters(config["SHARED_CACHE"], config.get("COUNTER_TTL", 60))
+        else:
+            self.counters = LocalCounters()
+        self.random = random.random
+        self.lock = threading.Lock()
+
+    def classify(self, request):
+        if not request.path.startswith(self.path_prefix):
+            return None
+        for method, pattern, class_name in self.routes:
+            if method in ("*", request.method) and pattern.match(request.path):
+                return self.classes[class_name]
+        return self.classes[self.default_class]
+
+    def try_acquire(self, admission_class):
+        # сначала занимаем место, потом проверяем: так проверка атомарна и для общих счётчиков
+        in_flight = self.counters.incr(admission_class.name)
+        total = self.counters.incr(TOTAL)
+        if admission_class.name == CRITICAL or not self._should_shed(admission_class, in_flight - 1, total - 1):
+            return True
+        self.counters.incr(admission_class.name, -1)
+        self.counters.incr(TOTAL, -1)
+        return False
+
+    def release(self, admission_class, elapsed):
+        self.counters.incr(admission_class.name, -1)
+        self.counters.incr(TOTAL, -1)
+        with self.lock:
+            now = time.monotonic()
+            if now - admission_class.latency_updated_at > self.latency_window:
+                admission_class.latency = elapsed
+            else:
+                admission_class.latency += self.smoothing * (elapsed - admission_class.latency)
+            admission_class.latency_updated_at = now
+
+    def _should_shed(self, admission_class, in_flight, total):
+        if admission_class.max_concurrency is not None and in_flight >= admission_class.max_concurrency:
+            return True
+        probability = max(self._queue_pressure(admission_class, total), self._latency_pressure(admission_class))
+        return probability > 0 and self.random() < probability
+
+    def _queue_pressure(self, admission_class, total):
+        """0 до SHED_START·MAX_QUEUE_DEPTH, дальше линейно до 1 на самом лимите."""
+        limit = admission_class.max_queue_depth
+        if limit is None:
+            return 0.0
+        start = limit * self.shed_start
+        if total >= limit:
+            return 1.0
+        if total <= start:
+            return 0.0
+        return (total - start) / (limit - start)
+
+    def _latency_pressure(self, admission_class):
+        """Доля отбрасываемых растёт от 0 на MAX_LATENCY до 1 на удвоенной MAX_LATENCY."""
+        limit = admission_class.max_latency
+        if limit is None:
+            return 0.0
+        # устаревшая оценка задержки не должна держать класс закрытым вечно
+        if time.monotonic() - admission_class.latency_updated_at > self.latency_window:
+            return 0.0
+        return min(max((admission_class.latency - limit) / limit, 0.0), 1.0)
+
+
+class AdmissionControlMiddleware:
+    """
+    Приоритетный допуск запросов к API: при перегрузке отвечает 503 + Retry-After
+    для фоновых и второстепенных запросов, оставляя ресурсы для SOS.
+    Настраивается через settings.ADMISSION_CONTROL. Под sync WSGI с несколькими
+    процессами лимиты работают только с общими счётчиками (SHARED_CACHE).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.controller = AdmissionController(getattr(settings, "ADMISSION_CONTROL", {}))
+
+    def __call__(self, request):
+        admission_class = self.controller.classify(request)
+        if admission_class is None:
+            return self.get_response(request)
+
+        if not self.controller.try_acquire(admission_class):
+            response = JsonResponse(
+                {"detail": "Сервер перегружен, повторите запрос позже."},
+                status=503,
+            )
+            response["Retry-After"] = str(self.controller.retry_after)
+            response["X-Admission-Class"] = admission_class.name
+            return response
+
+        started = time.monotonic()
+        try:
+            return self.get_response(request)
+        finally:
+            self.controller.release(admission_class, time.monotonic() - started)
+
+
+class ProfilingMiddleware:
+    """
+    Выборочный cProfile запросов к API: доля PROFILING["SAMPLE_RATE"] случайных
+    запросов плюс любой запрос персонала с заголовком PROFILING["HEADER"].
+    Когда профилирование выключено, на запрос тратится одна проверка заголовка.
+    Профили сохраняет sos_module.profiling.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = settings.PROFILING
+        self.sample_rate = config["SAMPLE_RATE"]
+        self.path_prefix = config["PATH_PREFIX"]
+        self.header = "HTTP_" + config["HEADER"].upper().replace("-", "_")
+        # cProfile один на процесс: параллельные запросы не профилируются, а пропускаются
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        if self.header in request.META:
+            reason = "header" if self._is_staff(request) else None
+        elif self.sample_rate and random.random() < self.sample_rate:
+            reason = "sample"
+        else:
+            reason = None
+
+        if reason is None or not request.path.startswith(self.path_prefix) or not self.lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self._profile(request, reason)
+        finally:
+            self.lock.release()
+
+    def _is_staff(self, request):
+        """Заголовок принимается только от персонала: сессия админки или JWT."""
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return user.is_staff
+        from rest_framework.exceptions import AuthenticationFailed
+        from rest_framework_simplejwt.authentication import JWTAuthentication
+        from rest_framework_simplejwt.exceptions import InvalidToken
+
+        try:
+            authenticated = JWTAuthentication().authenticate(request)
+        except (AuthenticationFailed, InvalidToken):
+            return False
+        return bool(authenticated and authenticated[0].is_staff)
+
+    def _profile(self, request, reason):
+        from .profiling import SqlRecorder, save_profile
+
+        sql = SqlRecorder()
+        profiler = cProfile.Profile()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(sql))
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            elapsed = time.perf_counter() - started
+
+        response["X-Profile-Id"] = save_profile(profiler, request, response, elapsed, sql, reason)
+        return response
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:42
+
+import hashlib
+import re
+
+from django.db import migrations, models, router
+
+# Копия логики sos_module.phones на момент миграции: результат не должен
+# меняться вместе с кодом и настройками. Смена соли — отдельная миграция с пересчётом.
+COUNTRY_CODE = '996'
+NATIONAL_NUMBER_LENGTH = 9
+HASH_SALT = 'sakbol-phonebook-v1'
+TRUNK_PREFIXES = {'8': ('7', 10)}
+
+
+def normalize_phone(value):
+    if not value:
+        return None
+    value = value.strip()
+    digits = re.sub(r'\D', '', value)
+    if value.startswith('+'):
+        pass
+    elif digits.startswith('00'):
+        digits = digits[2:]
+    elif digits.startswith('0'):
+        digits = COUNTRY_CODE + digits[1:]
+    elif len(digits) <= NATIONAL_NUMBER_LENGTH:
+        digits = COUNTRY_CODE + digits
+    elif digits[0] in TRUNK_PREFIXES:
+        trunk_country_code, national_length = TRUNK_PREFIXES[digits[0]]
+        if len(digits) - 1 != national_length:
+            return None
+        digits = trunk_country_code + digits[1:]
+    if not 8 <= len(digits) <= 15:
+        return None
+    return f'+{digits}'
+
+
+def hash_phone(e164):
+    return hashlib.sha256(f'{HASH_SALT}{e164}'.encode()).hexdigest()
+
+
+def fill_phone_index(apps, schema_editor):
+    User = apps.get_model('sos_module', 'User')
+    db = schema_editor.connection.alias
+    if not router.allow_migrate_model(db, User):
+        return
+    users = list(User.objects.using(db).exclude(phone_number__isnull=True).only('id', 'phone_number'))
+    for user in users:
+        user.phone_e164 = normalize_phone(user.phone_number)
+        user.phone_hash = hash_phone(user.phone_e164) if user.phone_e164 else None
+    User.objects.using(db).bulk_update(users, ['phone_e164', 'phone_hash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos_module', '0003_alter_user_phone_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='phone_e164',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=16, null=True, verbose_name='Номер телефона (E.164)'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='phone_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, null=True, verbose_name='Хеш номера телефона'),
+        ),
+        migrations.RunPython(fill_phone_index, migrations.RunPython.noop),
+    ]
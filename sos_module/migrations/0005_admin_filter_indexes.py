@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos_module', '0004_user_phone_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='is_online',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='Онлайн статус'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='role',
+            field=models.CharField(choices=[('user', 'user'), ('parent', 'parent'), ('child', 'child'), ('admin', 'admin')], db_index=True, default='user', max_length=20, verbose_name='Роль'),
+        ),
+        migrations.AddIndex(
+            model_name='sossignal',
+            index=models.Index(fields=['is_active', '-created_at'], name='sos_active_created_idx'),
+        ),
+    ]
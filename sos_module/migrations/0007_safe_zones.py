@@ -0,0 +1,63 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos_module', '0006_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SafeZone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название')),
+                ('kind', models.CharField(choices=[('circle', 'circle'), ('polygon', 'polygon')], default='circle', max_length=10, verbose_name='Тип')),
+                ('center_latitude', models.FloatField(blank=True, null=True, verbose_name='Широта центра')),
+                ('center_longitude', models.FloatField(blank=True, null=True, verbose_name='Долгота центра')),
+                ('radius_m', models.FloatField(blank=True, null=True, verbose_name='Радиус, м')),
+                ('polygon', models.JSONField(blank=True, null=True, verbose_name='Вершины многоугольника [[широта, долгота], ...]')),
+                ('min_latitude', models.FloatField(editable=False, verbose_name='Мин. широта')),
+                ('max_latitude', models.FloatField(editable=False, verbose_name='Макс. широта')),
+                ('min_longitude', models.FloatField(editable=False, verbose_name='Мин. долгота')),
+                ('max_longitude', models.FloatField(editable=False, verbose_name='Макс. долгота')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активна')),
+                ('is_child_inside', models.BooleanField(default=False, verbose_name='Ребёнок внутри')),
+                ('state_changed_at', models.DateTimeField(blank=True, null=True, verbose_name='Состояние изменено')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('child', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='safe_zones', to=settings.AUTH_USER_MODEL, verbose_name='Ребёнок')),
+                ('parent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='owned_safe_zones', to=settings.AUTH_USER_MODEL, verbose_name='Родитель')),
+            ],
+            options={
+                'verbose_name': 'Безопасная зона',
+                'verbose_name_plural': 'Безопасные зоны',
+            },
+        ),
+        migrations.CreateModel(
+            name='SafeZoneEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.CharField(choices=[('enter', 'enter'), ('exit', 'exit')], max_length=10, verbose_name='Событие')),
+                ('latitude', models.FloatField(verbose_name='Широта')),
+                ('longitude', models.FloatField(verbose_name='Долгота')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата создания')),
+                ('child', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='safe_zone_events', to=settings.AUTH_USER_MODEL, verbose_name='Ребёнок')),
+                ('zone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='sos_module.safezone', verbose_name='Зона')),
+            ],
+            options={
+                'verbose_name': 'Событие безопасной зоны',
+                'verbose_name_plural': 'События безопасных зон',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='safezone',
+            index=models.Index(fields=['child', 'is_active', 'is_child_inside'], name='safezone_child_state_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos_module', '0009_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Family',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='created_families', to=settings.AUTH_USER_MODEL, verbose_name='Создатель')),
+            ],
+            options={
+                'verbose_name': 'Семья',
+                'verbose_name_plural': 'Семьи',
+            },
+        ),
+        migrations.CreateModel(
+            name='FamilyMember',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('parent', 'parent'), ('child', 'child')], max_length=10, verbose_name='Роль в семье')),
+                ('joined_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата вступления')),
+                ('family', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='sos_module.family', verbose_name='Семья')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='family_memberships', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Член семьи',
+                'verbose_name_plural': 'Члены семьи',
+                'unique_together': {('family', 'user')},
+            },
+        ),
+    ]
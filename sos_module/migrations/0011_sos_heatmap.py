@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-19 01:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos_module', '0010_family'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SosHeatCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'hour'), ('day', 'day')], max_length=4, verbose_name='Бакет')),
+                ('bucket_start', models.DateTimeField(verbose_name='Начало бакета')),
+                ('zoom', models.PositiveSmallIntegerField(verbose_name='Масштаб')),
+                ('cell_x', models.IntegerField(verbose_name='Ячейка X')),
+                ('cell_y', models.IntegerField(verbose_name='Ячейка Y')),
+                ('total_count', models.IntegerField(default=0, verbose_name='Всего сигналов')),
+                ('active_count', models.IntegerField(default=0, verbose_name='Активных сигналов')),
+            ],
+            options={
+                'verbose_name': 'Ячейка тепловой карты SOS',
+                'verbose_name_plural': 'Ячейки тепловой карты SOS',
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'zoom', 'bucket_start', 'cell_x', 'cell_y'), name='sos_heat_cell_unique')],
+            },
+        ),
+    ]
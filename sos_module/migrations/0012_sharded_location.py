@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-19 02:00
+
+import django.db.models.deletion
+import sos_module.sharding
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos_module', '0011_sos_heatmap'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='location',
+            name='user',
+            field=sos_module.sharding.ShardedOneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos_module', '0013_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='locked_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Занят с'),
+        ),
+    ]
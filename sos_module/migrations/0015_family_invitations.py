@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-19 02:24
+
+from django.db import migrations, models, router
+from django.db.models import F
+
+
+def accept_creator_memberships(apps, schema_editor):
+    # создатель семьи вступил в неё сам; остальные участники добавлены без их согласия
+    # и должны принять приглашение заново
+    FamilyMember = apps.get_model('sos_module', 'FamilyMember')
+    db = schema_editor.connection.alias
+    if not router.allow_migrate_model(db, FamilyMember):
+        return
+    FamilyMember.objects.using(db).filter(user_id=F('family__created_by_id')).update(is_accepted=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos_module', '0014_idempotency_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='familymember',
+            name='is_accepted',
+            field=models.BooleanField(default=False, verbose_name='Приглашение принято'),
+        ),
+        migrations.RunPython(accept_creator_memberships, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos_module', '0015_family_invitations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxoffset',
+            name='gaps',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Пропуски'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-19 02:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sos_module', '0016_outbox_gaps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='periodic',
+            field=models.BooleanField(default=False, verbose_name='Периодическая'),
+        ),
+        migrations.AddConstraint(
+            model_name='job',
+            constraint=models.UniqueConstraint(condition=models.Q(('periodic', True), ('status__in', ['pending', 'running'])), fields=('name',), name='job_periodic_unique'),
+        ),
+    ]
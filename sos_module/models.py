@@ -1,6 +1,14 @@
 import random
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+from .phones import hash_phone, normalize_phone
+from .sharding import LocationQuerySet, ShardedOneToOneField
 
 class User(AbstractUser):
     ROLE_CHOICES = [
@@ -9,9 +17,11 @@ class User(AbstractUser):
         ('child', 'child'),
         ('admin', 'admin'),
     ]
-    role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='user', verbose_name='Роль')
+    role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='user', db_index=True, verbose_name='Роль')
     phone_number = models.CharField(max_length=20, unique=True, verbose_name='Номер телефона', null=True, blank=True)
-    is_online = models.BooleanField(default=False, verbose_name='Онлайн статус')
+    phone_e164 = models.CharField(max_length=16, null=True, blank=True, db_index=True, editable=False, verbose_name='Номер телефона (E.164)')
+    phone_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True, editable=False, verbose_name='Хеш номера телефона')
+    is_online = models.BooleanField(default=False, db_index=True, verbose_name='Онлайн статус')
     last_seen = models.DateTimeField(null=True, blank=True, verbose_name='Последний раз в сети')
     identifier = models.CharField(max_length=6, unique=True, blank=True, null=True, verbose_name='Идентификатор')
     email = models.EmailField(unique=True)
@@ -27,6 +37,11 @@ class User(AbstractUser):
             first_letters = (self.first_name[:2]).upper().ljust(2, 'X')
             last_letters = (self.last_name[:2]).upper().ljust(2, 'X')
             self.identifier = f"{digits}{first_letters}{last_letters}"
+        self.phone_e164 = normalize_phone(self.phone_number)
+        self.phone_hash = hash_phone(self.phone_e164) if self.phone_e164 else None
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "phone_number" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "phone_e164", "phone_hash"}
         super().save(*args, **kwargs)
 
     class Meta:
@@ -41,6 +56,7 @@ class Contact(models.Model):
     to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_requests', verbose_name='К пользователю')
     is_accepted = models.BooleanField(default=False, verbose_name='Принята')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата обновления')
 
     class Meta:
         verbose_name = 'Контакт'
@@ -50,11 +66,15 @@ class Contact(models.Model):
         return f"Заявка на добавление в контакты от {self.from_user.email} для {self.to_user.email} ({self.created_at})"
     
 class Location(models.Model):
-    user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name='Пользователь')
+    # таблица шардирована по user_id (sos_module.sharding): пользователь может
+    # лежать в другой базе, поэтому без FK-ограничения, а удаление — в delete_user_location
+    user = ShardedOneToOneField(User, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='Пользователь')
     latitude = models.FloatField(verbose_name='Широта')
     longitude = models.FloatField(verbose_name='Долгота')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
 
+    objects = LocationQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Местоположение'
         verbose_name_plural = 'Местоположения'
@@ -62,16 +82,26 @@ class Location(models.Model):
     def __str__(self):
         return f"{self.user.email} (широта: {self.latitude}, долгота: {self.longitude}) - {self.updated_at}"
 
+
+@receiver(post_delete, sender=User)
+def delete_user_location(sender, instance, **kwargs):
+    Location.objects.filter(user_id=instance.pk).delete()
+
+
 class SosSignal(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_sos', verbose_name='Отправитель')
     latitude = models.FloatField(verbose_name='Широта')
     longitude = models.FloatField(verbose_name='Долгота')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     is_active = models.BooleanField(default=True, verbose_name='Активен')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата обновления')
 
     class Meta:
         verbose_name = 'SOS сигнал'
         verbose_name_plural = 'SOS сигналы'
+        indexes = [
+            models.Index(fields=['is_active', '-created_at'], name='sos_active_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender.email} (широта: {self.latitude}, долгота: {self.longitude}) - {self.created_at}"
@@ -79,6 +109,7 @@ class SosSignal(models.Model):
 class FavoriteContact(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favorites', verbose_name='Пользователь')
     contact = models.ForeignKey(User, on_delete=models.CASCADE, related_name='favorited_by', verbose_name='Контакт')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата обновления')
 
     class Meta:
         unique_together = ("user", "contact")
@@ -91,10 +122,294 @@ class FavoriteContact(models.Model):
 class Keyword(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='keywords', verbose_name='Пользователь')
     word = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата обновления')
 
     class Meta:
         verbose_name = 'Ключевое слово'
         verbose_name_plural = 'Ключевые слова'
 
     def __str__(self):
-        return f"{self.user.email} ({self.word})"
\ No newline at end of file
+        return f"{self.user.email} ({self.word})"
+
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys', verbose_name='Пользователь')
+    key = models.CharField(max_length=255, verbose_name='Ключ')
+    request_hash = models.CharField(max_length=64, verbose_name='Отпечаток запроса')
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name='Код ответа')
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder, verbose_name='Тело ответа')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='Занят с')
+    expires_at = models.DateTimeField(db_index=True, verbose_name='Истекает')
+
+    class Meta:
+        unique_together = ("user", "key")
+        verbose_name = 'Ключ идемпотентности'
+        verbose_name_plural = 'Ключи идемпотентности'
+
+    def __str__(self):
+        return f"{self.user_id}: {self.key} ({self.status_code or 'в обработке'})"
+
+    @property
+    def is_complete(self):
+        return self.status_code is not None
+
+
+class Tombstone(models.Model):
+    """Отметка об удалении строки — чтобы дельта-синхронизация сообщила о ней клиенту."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tombstones', verbose_name='Пользователь')
+    resource = models.CharField(max_length=32, verbose_name='Ресурс')
+    object_id = models.BigIntegerField(verbose_name='ID объекта')
+    deleted_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата удаления')
+
+    class Meta:
+        verbose_name = 'Удалённый объект'
+        verbose_name_plural = 'Удалённые объекты'
+        indexes = [
+            models.Index(fields=['user', 'deleted_at'], name='tombstone_user_deleted_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.resource}#{self.object_id} для {self.user_id} ({self.deleted_at})"
+
+
+class Family(models.Model):
+    name = models.CharField(max_length=100, verbose_name='Название')
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_families', verbose_name='Создатель')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Семья'
+        verbose_name_plural = 'Семьи'
+
+    def __str__(self):
+        return self.name
+
+
+class FamilyMember(models.Model):
+    PARENT = 'parent'
+    CHILD = 'child'
+    ROLE_CHOICES = [
+        (PARENT, 'parent'),
+        (CHILD, 'child'),
+    ]
+    family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='members', verbose_name='Семья')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='family_memberships', verbose_name='Пользователь')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES, verbose_name='Роль в семье')
+    # приглашённый становится членом семьи, только когда сам примет приглашение
+    is_accepted = models.BooleanField(default=False, verbose_name='Приглашение принято')
+    joined_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата вступления')
+
+    class Meta:
+        unique_together = ("family", "user")
+        verbose_name = 'Член семьи'
+        verbose_name_plural = 'Члены семьи'
+
+    def __str__(self):
+        return f"{self.user_id} ({self.role}) в семье {self.family_id}"
+
+
+class SafeZone(models.Model):
+    CIRCLE = 'circle'
+    POLYGON = 'polygon'
+    KIND_CHOICES = [
+        (CIRCLE, 'circle'),
+        (POLYGON, 'polygon'),
+    ]
+    parent = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_safe_zones', verbose_name='Родитель')
+    child = models.ForeignKey(User, on_delete=models.CASCADE, related_name='safe_zones', verbose_name='Ребёнок')
+    name = models.CharField(max_length=100, verbose_name='Название')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=CIRCLE, verbose_name='Тип')
+    center_latitude = models.FloatField(null=True, blank=True, verbose_name='Широта центра')
+    center_longitude = models.FloatField(null=True, blank=True, verbose_name='Долгота центра')
+    radius_m = models.FloatField(null=True, blank=True, verbose_name='Радиус, м')
+    polygon = models.JSONField(null=True, blank=True, verbose_name='Вершины многоугольника [[широта, долгота], ...]')
+    min_latitude = models.FloatField(editable=False, verbose_name='Мин. широта')
+    max_latitude = models.FloatField(editable=False, verbose_name='Макс. широта')
+    min_longitude = models.FloatField(editable=False, verbose_name='Мин. долгота')
+    max_longitude = models.FloatField(editable=False, verbose_name='Макс. долгота')
+    is_active = models.BooleanField(default=True, verbose_name='Активна')
+    is_child_inside = models.BooleanField(default=False, verbose_name='Ребёнок внутри')
+    state_changed_at = models.DateTimeField(null=True, blank=True, verbose_name='Состояние изменено')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Безопасная зона'
+        verbose_name_plural = 'Безопасные зоны'
+        indexes = [
+            models.Index(fields=['child', 'is_active', 'is_child_inside'], name='safezone_child_state_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.kind}) для {self.child_id}"
+
+    def clean(self):
+        if self.kind == self.CIRCLE:
+            if self.center_latitude is None or self.center_longitude is None:
+                raise ValidationError("Для круга нужен центр.")
+            if not (-90 <= self.center_latitude <= 90 and -180 <= self.center_longitude <= 180):
+                raise ValidationError("Координаты центра вне допустимого диапазона.")
+            if not self.radius_m or self.radius_m <= 0:
+                raise ValidationError({"radius_m": "Для круга нужен положительный радиус."})
+            if self.radius_m > settings.SAFE_ZONES["MAX_RADIUS_M"]:
+                raise ValidationError({"radius_m": f"Радиус не больше {settings.SAFE_ZONES['MAX_RADIUS_M']} м."})
+            return
+        if not isinstance(self.polygon, list) or len(self.polygon) < 3:
+            raise ValidationError({"polygon": "Для многоугольника нужно не меньше 3 вершин."})
+        for point in self.polygon:
+            if (
+                not isinstance(point, (list, tuple)) or len(point) != 2
+                or not all(isinstance(coord, (int, float)) for coord in point)
+            ):
+                raise ValidationError({"polygon": "Вершина должна быть парой [широта, долгота]."})
+
+    def save(self, *args, **kwargs):
+        from .geofence import circle_bounds, polygon_bounds  # избегаем циклического импорта
+
+        # границы считаются из геометрии — без неё сохранять нечего
+        self.clean()
+        if self.kind == self.CIRCLE:
+            bounds = circle_bounds(self.center_latitude, self.center_longitude, self.radius_m)
+        else:
+            bounds = polygon_bounds(self.polygon)
+        self.min_latitude, self.max_latitude, self.min_longitude, self.max_longitude = bounds
+        super().save(*args, **kwargs)
+
+
+class SafeZoneEvent(models.Model):
+    ENTER = 'enter'
+    EXIT = 'exit'
+    EVENT_CHOICES = [
+        (ENTER, 'enter'),
+        (EXIT, 'exit'),
+    ]
+    zone = models.ForeignKey(SafeZone, on_delete=models.CASCADE, related_name='events', verbose_name='Зона')
+    child = models.ForeignKey(User, on_delete=models.CASCADE, related_name='safe_zone_events', verbose_name='Ребёнок')
+    event = models.CharField(max_length=10, choices=EVENT_CHOICES, verbose_name='Событие')
+    latitude = models.FloatField(verbose_name='Широта')
+    longitude = models.FloatField(verbose_name='Долгота')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Событие безопасной зоны'
+        verbose_name_plural = 'События безопасных зон'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.child_id} {self.event} {self.zone_id} ({self.created_at})"
+
+
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    DEAD = 'dead'
+    STATUS_CHOICES = [
+        (PENDING, 'pending'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (DEAD, 'dead'),
+    ]
+    name = models.CharField(max_length=100, verbose_name='Задача')
+    queue = models.CharField(max_length=50, default='default', verbose_name='Очередь')
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder, verbose_name='Параметры')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING, verbose_name='Статус')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попыток')
+    max_attempts = models.PositiveIntegerField(default=5, verbose_name='Максимум попыток')
+    run_at = models.DateTimeField(default=timezone.now, verbose_name='Запустить не раньше')
+    locked_by = models.CharField(max_length=100, blank=True, verbose_name='Воркер')
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name='Взята в работу')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    periodic = models.BooleanField(default=False, verbose_name='Периодическая')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(fields=['status', 'queue', 'run_at'], name='job_claim_idx'),
+        ]
+        constraints = [
+            # воркеры, стартовавшие одновременно, не поставят одну периодическую задачу дважды
+            models.UniqueConstraint(
+                fields=['name'],
+                condition=models.Q(periodic=True, status__in=['pending', 'running']),
+                name='job_periodic_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name}#{self.pk} ({self.status}, попыток: {self.attempts})"
+
+
+class SosHeatCell(models.Model):
+    """Счётчики SOS-сигналов по ячейке сетки карты и временному бакету (инкрементальная агрегация)."""
+    HOUR = 'hour'
+    DAY = 'day'
+    GRANULARITY_CHOICES = [
+        (HOUR, 'hour'),
+        (DAY, 'day'),
+    ]
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES, verbose_name='Бакет')
+    bucket_start = models.DateTimeField(verbose_name='Начало бакета')
+    zoom = models.PositiveSmallIntegerField(verbose_name='Масштаб')
+    cell_x = models.IntegerField(verbose_name='Ячейка X')
+    cell_y = models.IntegerField(verbose_name='Ячейка Y')
+    total_count = models.IntegerField(default=0, verbose_name='Всего сигналов')
+    active_count = models.IntegerField(default=0, verbose_name='Активных сигналов')
+
+    class Meta:
+        verbose_name = 'Ячейка тепловой карты SOS'
+        verbose_name_plural = 'Ячейки тепловой карты SOS'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['granularity', 'zoom', 'bucket_start', 'cell_x', 'cell_y'],
+                name='sos_heat_cell_unique',
+            ),
+        ]
+
+    def __str__(self):
+        return f"z{self.zoom} ({self.cell_x}, {self.cell_y}) {self.granularity} {self.bucket_start}: {self.total_count}"
+
+
+class OutboxEvent(models.Model):
+    """
+    Доменное событие, записанное в той же транзакции, что и изменение данных.
+    Таблица есть в default и в каждом шарде Location: событие пишется в ту базу,
+    где меняются данные, а id задаёт порядок доставки внутри этой базы.
+    """
+    topic = models.CharField(max_length=64, verbose_name='Тема')
+    key = models.CharField(max_length=64, blank=True, verbose_name='Ключ')
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder, verbose_name='Данные')
+    created_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Событие outbox'
+        verbose_name_plural = 'События outbox'
+
+    def __str__(self):
+        return f"{self.topic}#{self.pk} ({self.key})"
+
+
+class OutboxOffset(models.Model):
+    """
+    Позиция потребителя в outbox одной базы-источника: последний доставленный id события
+    и пропуски — id ниже позиции, которых ещё не было видно (их транзакция могла не закоммититься).
+    """
+    consumer = models.CharField(max_length=100, verbose_name='Потребитель')
+    source = models.CharField(max_length=100, default='default', verbose_name='База-источник')
+    last_event_id = models.BigIntegerField(default=0, verbose_name='Последнее событие')
+    # {"id": момент, когда пропуск замечен (unix-время)}
+    gaps = models.JSONField(default=dict, blank=True, verbose_name='Пропуски')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
+
+    class Meta:
+        verbose_name = 'Позиция потребителя outbox'
+        verbose_name_plural = 'Позиции потребителей outbox'
+        constraints = [
+            models.UniqueConstraint(fields=['consumer', 'source'], name='outbox_offset_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.consumer}@{self.source}: {self.last_event_id}"
@@ -0,0 +1,256 @@
+"""
+Транзакционный outbox и лента доменных событий.
+
+publish() вызывается внутри транзакции, меняющей данные, и пишет OutboxEvent
+в ту же базу — событие появляется тогда и только тогда, когда закоммичено
+изменение. Ретранслятор (manage.py relay_outbox) читает события по
+возрастанию id пачками и передаёт их зарегистрированным потребителям;
+позиция каждого потребителя хранится в OutboxOffset отдельно для каждой
+базы-источника (default и шарды Location). id выдаются при вставке, а не
+при коммите, поэтому событие с меньшим id может появиться уже после
+сдвига позиции: не увиденные id ниже позиции запоминаются как пропуски
+и перечитываются, пока событие не появится или не выйдет
+OUTBOX["GAP_TIMEOUT"] (тогда транзакция считается откаченной). Такие
+события доставляются позже соседей по id. Доставка «хотя бы один раз»:
+позиция сдвигается только после успешной обработки пачки, так что
+потребители должны быть идемпотентными. Обработчик и сдвиг позиции идут
+в одной транзакции default: то, что потребитель пишет в default (например,
+счётчики тепловой карты), применяется ровно один раз. Повтор — replay_outbox.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import OutboxEvent, OutboxOffset
+from .sharding import shard_aliases
+
+logger = logging.getLogger(__name__)
+
+CONTACT_ACCEPTED = "contact.accepted"
+SOS_CREATED = "sos.created"
+SOS_RESOLVED = "sos.resolved"
+SOS_UPDATED = "sos.updated"  # перенос или смена статуса: {"before": …, "after": …}
+SOS_DELETED = "sos.deleted"
+LOCATION_UPDATED = "location.updated"
+FAVORITE_ADDED = "favorite.added"
+
+# id пропусков в одном запросе: SQLite до 3.32 принимает не больше 999 параметров
+GAP_QUERY_CHUNK = 500
+
+registry = {}
+
+
+def consumer(name, topics=None):
+    """Регистрирует потребителя: @consumer("family.dashboard", topics=[...]); получает список событий."""
+
+    def decorator(func):
+        registry[name] = (func, set(topics) if topics else None)
+        return func
+
+    return decorator
+
+
+def publish(topic, payload, key="", using="default"):
+    """Записывает событие. Вызывать внутри транзакции изменения (в той же базе using)."""
+    return OutboxEvent.objects.using(using).create(topic=topic, key=str(key), payload=payload)
+
+
+def publish_many(events, using="default"):
+    """events — тройки (тема, данные, ключ)."""
+    return OutboxEvent.objects.using(using).bulk_create(
+        [OutboxEvent(topic=topic, key=str(key), payload=payload) for topic, payload, key in events]
+    )
+
+
+def contact_payload(contact):
+    return {"contact_id": contact.pk, "from_user_id": contact.from_user_id, "to_user_id": contact.to_user_id}
+
+
+def favorite_payload(favorite):
+    return {"favorite_id": favorite.pk, "user_id": favorite.user_id, "contact_id": favorite.contact_id}
+
+
+def sos_payload(sos):
+    return {
+        "sos_id": sos.pk,
+        "sender_id": sos.sender_id,
+        "latitude": sos.latitude,
+        "longitude": sos.longitude,
+        "created_at": sos.created_at,
+        "is_active": sos.is_active,
+    }
+
+
+def sos_change_payload(before, after):
+    return {"sos_id": after.pk, "before": sos_payload(before), "after": sos_payload(after)}
+
+
+def location_payload(location):
+    return {
+        "user_id": location.user_id,
+        # из UpdateLocationView координаты приходят как есть, без приведения типов
+        "latitude": float(location.latitude),
+        "longitude": float(location.longitude),
+        "updated_at": location.updated_at,
+    }
+
+
+def sources():
+    """Базы, в которых могут лежать события: default и шарды Location."""
+    return list(dict.fromkeys(["default", *shard_aliases()]))
+
+
+def first_event_id(source):
+    """Самый ранний из хранимых id источника (None, если событий нет)."""
+    return OutboxEvent.objects.using(source).aggregate(first=Min("id"))["first"]
+
+
+def get_offset(name, source):
+    """Позиция потребителя; новая встаёт перед самым ранним хранимым событием, а не на 0."""
+    try:
+        return OutboxOffset.objects.get_or_create(
+            consumer=name, source=source, defaults={"last_event_id": (first_event_id(source) or 1) - 1}
+        )[0]
+    except IntegrityError:
+        # позицию только что создал параллельный ретранслятор
+        return OutboxOffset.objects.get(consumer=name, source=source)
+
+
+def live_gaps(gaps, now):
+    """Пропуски без просроченных: их событие уже не появится (транзакция откачена)."""
+    deadline = now - settings.OUTBOX["GAP_TIMEOUT"]
+    expired = [event_id for event_id, noticed_at in gaps.items() if noticed_at < deadline]
+    if expired:
+        logger.warning("События outbox не появились за GAP_TIMEOUT, считаем откаченными: %s", len(expired))
+    return {event_id: noticed_at for event_id, noticed_at in gaps.items() if noticed_at >= deadline}
+
+
+def pending_events(source, after_id, gaps, limit):
+    """
+    Следующая пачка событий источника: появившиеся на месте пропусков и новые (после after_id).
+    Пропуски проверяются кусками по GAP_QUERY_CHUNK id — в пределах лимита параметров SQL.
+    """
+    events = OutboxEvent.objects.using(source)
+    gap_ids = sorted(int(event_id) for event_id in gaps)
+    found = []
+    for start in range(0, len(gap_ids), GAP_QUERY_CHUNK):
+        found.extend(events.filter(id__in=gap_ids[start:start + GAP_QUERY_CHUNK]))
+    found.sort(key=lambda event: event.id)
+    return found + list(events.filter(id__gt=after_id).order_by("id")[:limit])
+
+
+def next_gaps(gaps, after_id, events, now, floor):
+    """
+    Пропуски после пачки: из живых уходят появившиеся, добавляются id между
+    after_id и последним событием пачки, которых в ней нет. Новые пропуски
+    берутся только не ниже floor (самого раннего хранимого id — ниже лежит
+    удалённая purge_events история) и не дальше BATCH_SIZE id от конца пачки.
+    """
+    seen = {event.id for event in events}
+    result = {event_id: noticed_at for event_id, noticed_at in gaps.items() if int(event_id) not in seen}
+    fresh = [event.id for event in events if event.id > after_id]
+    if fresh:
+        start = max(after_id + 1, floor, fresh[-1] - settings.OUTBOX["BATCH_SIZE"])
+        for event_id in range(start, fresh[-1]):
+            if event_id not in seen:
+                result[str(event_id)] = now
+    return result
+
+
+class OffsetMoved(Exception):
+    """Позицию сдвинул параллельный ретранслятор: пачка уже обработана им."""
+
+
+def deliver(name, source, batch_size=None):
+    """
+    Одна пачка для одного потребителя из одного источника.
+    Возвращает число просмотренных событий (0 — догнали ленту).
+    """
+    handler, topics = registry[name]
+    offset = get_offset(name, source)
+    now = time.time()
+    try:
+        with transaction.atomic():
+            # просроченные пропуски отбрасываются до запроса: иначе они бы копились вечно
+            gaps = live_gaps(offset.gaps, now)
+            events = pending_events(source, offset.last_event_id, gaps, batch_size or settings.OUTBOX["BATCH_SIZE"])
+            if events:
+                gaps = next_gaps(gaps, offset.last_event_id, events, now, first_event_id(source))
+            if not events and gaps == offset.gaps:
+                return 0
+            matching = [event for event in events if topics is None or event.topic in topics]
+            if matching:
+                handler(matching)
+            # условный UPDATE: если позицию сдвинул параллельный ретранслятор,
+            # откатываем и свою обработку, чтобы не применить пачку дважды
+            moved = OutboxOffset.objects.filter(
+                pk=offset.pk, last_event_id=offset.last_event_id, updated_at=offset.updated_at
+            ).update(
+                last_event_id=max([offset.last_event_id, *(event.id for event in events)]),
+                gaps=gaps,
+                updated_at=timezone.now(),
+            )
+            if not moved:
+                raise OffsetMoved
+    except OffsetMoved:
+        return 0
+    return len(events)
+
+
+def relay(consumers=None, batch_size=None):
+    """
+    Доставляет всё накопившееся всем потребителям. Ошибка потребителя
+    не мешает остальным: его позиция остаётся на месте до следующего прохода.
+    """
+    delivered = 0
+    for name in consumers or list(registry):
+        for source in sources():
+            try:
+                while True:
+                    count = deliver(name, source, batch_size)
+                    delivered += count
+                    if not count:
+                        break
+            except Exception:
+                logger.exception("Потребитель outbox %s упал на источнике %s", name, source)
+    return delivered
+
+
+def replay(name, source="default", from_id=None, since=None):
+    """
+    Перематывает позицию потребителя: следующим будет доставлено событие from_id,
+    первое событие не старше since или (без аргументов) самое раннее из хранимых.
+    Возвращает новую позицию.
+    """
+    events = OutboxEvent.objects.using(source)
+    if since is not None:
+        from_id = events.filter(created_at__gte=since).order_by("id").values_list("id", flat=True).first()
+        if from_id is None:
+            # после since событий нет — встаём в конец ленты
+            from_id = (events.aggregate(last=Max("id"))["last"] or 0) + 1
+    if from_id is None:
+        from_id = first_event_id(source) or 1
+    last_event_id = max(0, from_id - 1)
+    get_offset(name, source)
+    OutboxOffset.objects.filter(consumer=name, source=source).update(
+        last_event_id=last_event_id, gaps={}, updated_at=timezone.now()
+    )
+    return last_event_id
+
+
+def purge_events():
+    """Удаляет события старше OUTBOX["RETENTION"], уже доставленные всем потребителям."""
+    deadline = timezone.now() - settings.OUTBOX["RETENTION"]
+    deleted = 0
+    for source in sources():
+        offsets = [get_offset(name, source).last_event_id for name in registry]
+        delivered_up_to = min(offsets) if offsets else None
+        events = OutboxEvent.objects.using(source).filter(created_at__lt=deadline)
+        if delivered_up_to is not None:
+            events = events.filter(id__lte=delivered_up_to)
+        deleted += events.delete()[0]
+    return deleted
@@ -0,0 +1,40 @@
+from django.db.models import Q
+from rest_framework.permissions import BasePermission
+
+from .models import Contact, FamilyMember
+
+
+def is_guardian_of(parent, child):
+    """
+    Родитель может управлять зонами ребёнка, если оба приняли членство
+    в одной семье или (по-старому) они подтверждённые контакты.
+    """
+    if parent.role != "parent" or child.role != "child":
+        return False
+    if FamilyMember.objects.filter(
+        user=child,
+        role=FamilyMember.CHILD,
+        is_accepted=True,
+        family__members__user=parent,
+        family__members__role=FamilyMember.PARENT,
+        family__members__is_accepted=True,
+    ).exists():
+        return True
+    return Contact.objects.filter(
+        Q(from_user=parent, to_user=child) | Q(from_user=child, to_user=parent),
+        is_accepted=True,
+    ).exists()
+
+
+def is_family_parent(user, family_id):
+    return FamilyMember.objects.filter(
+        family_id=family_id, user=user, role=FamilyMember.PARENT, is_accepted=True
+    ).exists()
+
+
+class IsOperator(BasePermission):
+    """Операторы диспетчерской: персонал Django или пользователи с ролью admin."""
+
+    def has_permission(self, request, view):
+        user = request.user
+        return bool(user and user.is_authenticated and (user.is_staff or user.role == "admin"))
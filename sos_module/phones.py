@@ -0,0 +1,61 @@
+import hashlib
+import re
+
+from django.conf import settings
+
+NON_DIGITS = re.compile(r"\D")
+
+# E.164: не более 15 цифр вместе с кодом страны
+E164_MIN_DIGITS = 8
+E164_MAX_DIGITS = 15
+
+# Междугородние префиксы соседних стран, которые встречаются в телефонных книгах:
+# префикс -> (код страны, длина номера без префикса). 8 912 345 67 89 -> +7 912 345 67 89
+TRUNK_PREFIXES = {
+    "8": ("7", 10),
+}
+
+
+def normalize_phone(value):
+    """
+    Приводит номер телефона к формату E.164 (+996555123456).
+    Номера без кода страны дополняются PHONE_DEFAULT_COUNTRY_CODE.
+    Возвращает None, если номер не удаётся распознать.
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    digits = NON_DIGITS.sub("", value)
+    country_code = settings.PHONE_DEFAULT_COUNTRY_CODE
+
+    if value.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif digits.startswith("0"):
+        # национальный формат с префиксом 0 (0555 123 456)
+        digits = country_code + digits[1:]
+    elif len(digits) <= settings.PHONE_NATIONAL_NUMBER_LENGTH:
+        digits = country_code + digits
+    elif digits[0] in TRUNK_PREFIXES:
+        trunk_country_code, national_length = TRUNK_PREFIXES[digits[0]]
+        if len(digits) - 1 != national_length:
+            # префикс есть, а длина чужая — код страны угадать нельзя
+            return None
+        digits = trunk_country_code + digits[1:]
+
+    if not E164_MIN_DIGITS <= len(digits) <= E164_MAX_DIGITS:
+        return None
+    return f"+{digits}"
+
+
+def hash_phone(e164):
+    """Солёный SHA-256 от номера в формате E.164 — так клиент может не передавать сами номера."""
+    return hashlib.sha256(f"{settings.PHONE_HASH_SALT}{e164}".encode()).hexdigest()
+
+
+def chunked(values, size):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
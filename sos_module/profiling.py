@@ -0,0 +1,147 @@
+"""
+Выборочное профилирование запросов в продакшене.
+
+ProfilingMiddleware (sos_module.middleware) снимает cProfile с доли запросов
+или с запросов персонала с заголовком PROFILING["HEADER"]. Результат пишется
+в PROFILING["DIR"] парой файлов <id>.prof (сырые pstats) и <id>.json
+(view, пользователь, сводка SQL, топ функций); старые профили удаляются,
+когда их больше PROFILING["MAX_PROFILES"]. Скачать — /api/profiles/.
+"""
+import io
+import json
+import pstats
+import re
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+PROFILE_ID_RE = re.compile(r"^\d{8}T\d{12}-[0-9a-f]{8}$")
+
+
+def profile_dir():
+    return Path(settings.PROFILING["DIR"])
+
+
+def profile_path(profile_id, suffix):
+    """Путь к файлу профиля или None, если id не похож на наш (защита от ../)."""
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    path = profile_dir() / f"{profile_id}{suffix}"
+    return path if path.exists() else None
+
+
+class SqlRecorder:
+    """
+    execute_wrapper для connection: считает запросы и время по тексту SQL
+    (параметры передаются отдельно, так что одинаковые запросы схлопываются).
+    """
+
+    def __init__(self):
+        self.statements = defaultdict(lambda: [0, 0.0])
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            entry = self.statements[sql]
+            entry[0] += 1
+            entry[1] += time.perf_counter() - started
+
+    def summary(self, top):
+        ranked = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            "queries": sum(count for count, _ in self.statements.values()),
+            "time_ms": round(sum(elapsed for _, elapsed in self.statements.values()) * 1000, 3),
+            "top": [
+                {"sql": sql[:1000], "count": count, "time_ms": round(elapsed * 1000, 3)}
+                for sql, (count, elapsed) in ranked[:top]
+            ],
+        }
+
+
+def view_name(request):
+    """'ContactViewSet.list' для DRF, путь к функции для обычных view."""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return None
+    cls = getattr(match.func, "cls", None)
+    if cls is None:
+        return match._func_path
+    action = (getattr(match.func, "actions", None) or {}).get(request.method.lower())
+    return f"{cls.__name__}.{action}" if action else cls.__name__
+
+
+def top_functions(profiler, limit):
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    result = []
+    for func in stats.fcn_list[:limit]:
+        calls, primitive, own, cumulative, _ = stats.stats[func]
+        filename, line, name = func
+        result.append({
+            "function": f"{filename}:{line}({name})",
+            "calls": calls,
+            "own_ms": round(own * 1000, 3),
+            "cumulative_ms": round(cumulative * 1000, 3),
+        })
+    return result
+
+
+def save_profile(profiler, request, response, elapsed, sql, reason):
+    config = settings.PROFILING
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+
+    now = timezone.now()
+    profile_id = f"{now:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+    user = getattr(request, "user", None)
+    meta = {
+        "id": profile_id,
+        "created_at": now,
+        "reason": reason,
+        "method": request.method,
+        "path": request.path,
+        "view": view_name(request),
+        "user_id": user.pk if user is not None and user.is_authenticated else None,
+        "status": response.status_code,
+        "duration_ms": round(elapsed * 1000, 3),
+        "sql": sql.summary(config["TOP_SQL"]),
+        "functions": top_functions(profiler, config["TOP_FUNCTIONS"]),
+    }
+    profiler.dump_stats(directory / f"{profile_id}.prof")
+    (directory / f"{profile_id}.json").write_text(json.dumps(meta, cls=DjangoJSONEncoder, ensure_ascii=False))
+    rotate(config["MAX_PROFILES"])
+    return profile_id
+
+
+def rotate(max_profiles):
+    """Оставляет max_profiles самых свежих профилей (id начинается с времени)."""
+    files = sorted(profile_dir().glob("*.json"))
+    for path in files[: max(0, len(files) - max_profiles)]:
+        path.unlink(missing_ok=True)
+        path.with_suffix(".prof").unlink(missing_ok=True)
+
+
+def list_profiles():
+    """Метаданные профилей, новые сначала (без топа функций — он есть в детальном ответе)."""
+    directory = profile_dir()
+    if not directory.exists():
+        return []
+    result = []
+    for path in sorted(directory.glob("*.json"), reverse=True):
+        try:
+            meta = json.loads(path.read_text())
+        except (OSError, ValueError):
+            # файл мог удалиться ротацией в соседнем процессе
+            continue
+        meta.pop("functions", None)
+        meta["sql"] = {key: value for key, value in meta["sql"].items() if key != "top"}
+        result.append(meta)
+    return result
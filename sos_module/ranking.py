@@ -0,0 +1,88 @@
+import numpy as np
+from django.conf import settings
+from django.db.models import Value
+from django.utils import timezone
+
+from .models import Contact, FavoriteContact, Location
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_m(lat, lon, lats, lons):
+    """Расстояние в метрах от точки (lat, lon) до массивов координат (в градусах)."""
+    lat1 = np.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - np.radians(lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def candidate_locations(sender):
+    """
+    Геолокации всех, кого стоит оповестить: избранные отправителя и его
+    подтверждённые контакты. Кандидаты выбираются одним запросом (UNION),
+    точки — по одному запросу на шард Location.
+    """
+    favorites = FavoriteContact.objects.filter(user=sender).values_list("contact_id", Value(True))
+    contacts_to = Contact.objects.filter(from_user=sender, is_accepted=True).values_list("to_user_id", Value(False))
+    contacts_from = Contact.objects.filter(to_user=sender, is_accepted=True).values_list("from_user_id", Value(False))
+
+    candidates = {}
+    for user_id, is_favorite in favorites.union(contacts_to, contacts_from, all=True):
+        if user_id != sender.pk:
+            candidates[user_id] = candidates.get(user_id, False) or bool(is_favorite)
+
+    locations = Location.objects.for_users(candidates)
+    return [
+        (user_id, location.latitude, location.longitude, location.updated_at, candidates[user_id])
+        for user_id, location in locations.items()
+    ]
+
+
+def rank_candidates(latitude, longitude, rows, limit, now=None):
+    """
+    Ранжирует кандидатов по «эффективному» расстоянию: к расстоянию добавляется
+    путь, который человек мог пройти с момента последней точки, а избранным
+    даётся скидка. Все вычисления — над массивами NumPy.
+    """
+    config = settings.SOS_RANKING
+    if not rows:
+        return []
+
+    now = (now or timezone.now()).timestamp()
+    user_ids, lats, lons, updated, favorites = zip(*rows)
+    lats = np.fromiter(lats, dtype=np.float64, count=len(rows))
+    lons = np.fromiter(lons, dtype=np.float64, count=len(rows))
+    ages = now - np.fromiter((dt.timestamp() for dt in updated), dtype=np.float64, count=len(rows))
+    ages = np.maximum(ages, 0.0)
+    favorites = np.fromiter(favorites, dtype=bool, count=len(rows))
+
+    distances = haversine_m(latitude, longitude, lats, lons)
+    scores = distances + ages * config["STALENESS_SPEED"]
+    scores = np.where(favorites, scores * config["FAVORITE_WEIGHT"], scores)
+    scores = np.where(ages > config["MAX_LOCATION_AGE"], np.inf, scores)
+
+    fresh = np.flatnonzero(np.isfinite(scores))
+    if limit < len(fresh):
+        fresh = fresh[np.argpartition(scores[fresh], limit)[:limit]]
+    order = fresh[np.argsort(scores[fresh], kind="stable")]
+    etas = distances / config["TRAVEL_SPEED"]
+
+    return [
+        {
+            "user_id": user_ids[i],
+            "distance_m": int(distances[i]),
+            "eta_seconds": int(etas[i]),
+            "location_age_seconds": int(ages[i]),
+            "is_favorite": bool(favorites[i]),
+        }
+        for i in order
+    ]
+
+
+def rank_responders(signal, limit=None):
+    """Top-K ближайших к SOS-сигналу людей из окружения отправителя."""
+    limit = limit or settings.SOS_RANKING["TOP_K"]
+    rows = list(candidate_locations(signal.sender))
+    return rank_candidates(signal.latitude, signal.longitude, rows, limit)
@@ -1,9 +1,27 @@
+from django.conf import settings
+from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
 from datetime import timedelta
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Contact, Keyword, Location, FavoriteContact, SosSignal
+from .models import (
+    Contact,
+    Family,
+    FamilyMember,
+    FavoriteContact,
+    Keyword,
+    Location,
+    SafeZone,
+    SafeZoneEvent,
+    SosSignal,
+)
+from .permissions import is_guardian_of
+from .phones import normalize_phone
+from .geofence import evaluate_location
+from .ranking import rank_responders
+from . import outbox
+from .sharding import shard_for
 
 User = get_user_model()
 
@@ -51,9 +69,8 @@ class UserSerializer(serializers.ModelSerializer):
 
     def get_location(self, obj):
         """Возвращает последнюю геолокацию пользователя (если есть)."""
-        from .models import Location  # избегаем циклического импорта
-
-        location = Location.objects.filter(user=obj).order_by("-updated_at").first()
+        # без запроса, если геолокация подгружена через prefetch_related (по запросу на шард)
+        location = getattr(obj, "location", None)
         if location:
             return {
                 "latitude": location.latitude,
@@ -86,10 +103,13 @@ class ContactSerializer(serializers.ModelSerializer):
 
         current_user = request.user
         # определяем, кто является "контактным пользователем" относительно текущего юзера
-        contact_user = obj.to_user if obj.from_user == current_user else obj.from_user
+        contact_user_id = obj.to_user_id if obj.from_user_id == current_user.pk else obj.from_user_id
 
+        favorite_ids = self.context.get("favorite_ids")
+        if favorite_ids is not None:
+            return contact_user_id in favorite_ids
         return FavoriteContact.objects.filter(
-            user=current_user, contact=contact_user
+            user=current_user, contact_id=contact_user_id
         ).exists()
 
 class CreateContactSerializer(serializers.ModelSerializer):
@@ -127,6 +147,46 @@ class CreateContactSerializer(serializers.ModelSerializer):
         to_user = User.objects.get(identifier=identifier)
         return Contact.objects.create(from_user=user, to_user=to_user)
 
+class PhoneMatchSerializer(serializers.Serializer):
+    """Пакет номеров (или их солёных хешей) из телефонной книги клиента."""
+
+    phones = serializers.ListField(
+        child=serializers.CharField(max_length=32),
+        required=False,
+        max_length=settings.PHONE_MATCH_MAX_NUMBERS,
+    )
+    hashes = serializers.ListField(
+        child=serializers.RegexField(r"^[0-9a-fA-F]{64}$"),
+        required=False,
+        max_length=settings.PHONE_MATCH_MAX_NUMBERS,
+    )
+
+    def validate(self, attrs):
+        phones = attrs.get("phones", [])
+        hashes = attrs.get("hashes", [])
+        if not phones and not hashes:
+            raise serializers.ValidationError({"detail": "Передайте phones или hashes."})
+        if len(phones) + len(hashes) > settings.PHONE_MATCH_MAX_NUMBERS:
+            raise serializers.ValidationError(
+                {"detail": f"Не более {settings.PHONE_MATCH_MAX_NUMBERS} номеров за запрос."}
+            )
+
+        # нормализованный номер -> как его прислал клиент
+        attrs["phones"] = {}
+        for raw in phones:
+            e164 = normalize_phone(raw)
+            if e164:
+                attrs["phones"].setdefault(e164, raw)
+        attrs["hashes"] = {value.lower() for value in hashes}
+        return attrs
+
+class MatchedUserSerializer(serializers.ModelSerializer):
+    """Публичная карточка найденного пользователя (без геолокации и контактов)."""
+
+    class Meta:
+        model = User
+        fields = ["id", "first_name", "last_name", "identifier", "avatar"]
+
 class LocationSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
@@ -136,9 +196,16 @@ class LocationSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         user = self.context["request"].user
-        location, _ = Location.objects.update_or_create(
-            user=user, defaults=validated_data
-        )
+        # точка и событие пишутся в одной транзакции в шард пользователя
+        with transaction.atomic(using=shard_for(user.pk)):
+            location, _ = Location.objects.update_or_create(
+                user=user, defaults=validated_data
+            )
+            outbox.publish(
+                outbox.LOCATION_UPDATED, outbox.location_payload(location), key=user.pk, using=location._state.db
+            )
+        if user.role == "child":
+            evaluate_location(user, location.latitude, location.longitude)
         return location
 
 class FavoriteContactSerializer(serializers.ModelSerializer):
@@ -156,7 +223,7 @@ class FavoriteContactSerializer(serializers.ModelSerializer):
         fields = ["id", "contact", "contact_id", "location", "is_favorite"]
 
     def get_location(self, obj):
-        location = Location.objects.filter(user=obj.contact).order_by("-updated_at").first()
+        location = getattr(obj.contact, "location", None)
         if location:
             return LocationSerializer(location).data
         return None
@@ -165,6 +232,9 @@ class FavoriteContactSerializer(serializers.ModelSerializer):
         request = self.context.get("request")
         if not request or not request.user.is_authenticated:
             return False
+        favorite_ids = self.context.get("favorite_ids")
+        if favorite_ids is not None:
+            return obj.contact_id in favorite_ids
         return FavoriteContact.objects.filter(user=request.user, contact=obj.contact).exists()
 
     def validate(self, attrs):
@@ -182,17 +252,185 @@ class FavoriteContactSerializer(serializers.ModelSerializer):
 
 class SosSignalSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
+    responders = serializers.SerializerMethodField()
 
     class Meta:
         model = SosSignal
-        fields = ["id", "sender", "latitude", "longitude", "created_at", "is_active"]
+        fields = ["id", "sender", "latitude", "longitude", "created_at", "is_active", "responders"]
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # ранжирование считается только там, где оно нужно (создание и детальный просмотр)
+        if not self.context.get("include_responders"):
+            fields.pop("responders")
+        return fields
+
+    def get_responders(self, obj):
+        """Ближайшие к сигналу избранные и контакты с оценкой времени прибытия."""
+        ranked = rank_responders(obj, limit=self.context.get("responders_limit"))
+        users = User.objects.in_bulk([item["user_id"] for item in ranked])
+        users_data = MatchedUserSerializer(
+            [users[item["user_id"]] for item in ranked], many=True, context=self.context
+        ).data
+        return [{**item, "user": user_data} for item, user_data in zip(ranked, users_data)]
 
     def create(self, validated_data):
         user = self.context["request"].user
         sos = SosSignal.objects.create(sender=user, **validated_data)
-        # Здесь можно триггерить задачу Celery для уведомлений
+        # уведомления ставятся в очередь в SosSignalViewSet.perform_create (задача sos.notify)
         return sos
     
+class SafeZoneSerializer(serializers.ModelSerializer):
+    child = MatchedUserSerializer(read_only=True)
+    child_id = serializers.PrimaryKeyRelatedField(
+        queryset=User.objects.filter(role="child"),
+        source="child",
+        write_only=True
+    )
+
+    class Meta:
+        model = SafeZone
+        fields = [
+            "id", "child", "child_id", "name", "kind",
+            "center_latitude", "center_longitude", "radius_m", "polygon",
+            "is_active", "is_child_inside", "state_changed_at", "created_at", "updated_at",
+        ]
+        read_only_fields = ["is_child_inside", "state_changed_at"]
+        extra_kwargs = {
+            "center_latitude": {"min_value": -90, "max_value": 90},
+            "center_longitude": {"min_value": -180, "max_value": 180},
+        }
+
+    def validate_radius_m(self, value):
+        max_radius = settings.SAFE_ZONES["MAX_RADIUS_M"]
+        if value is not None and not 0 < value <= max_radius:
+            raise serializers.ValidationError(f"Радиус должен быть от 0 до {max_radius} м.")
+        return value
+
+    def validate_child_id(self, value):
+        if not is_guardian_of(self.context["request"].user, value):
+            raise serializers.ValidationError("Ребёнок не привязан к вашему аккаунту.")
+        return value
+
+    def validate_polygon(self, value):
+        if value is None:
+            return value
+        max_points = settings.SAFE_ZONES["MAX_POLYGON_POINTS"]
+        if not isinstance(value, list) or not 3 <= len(value) <= max_points:
+            raise serializers.ValidationError(f"Нужно от 3 до {max_points} вершин.")
+        points = []
+        for point in value:
+            try:
+                lat, lon = (float(coord) for coord in point)
+            except (TypeError, ValueError):
+                raise serializers.ValidationError("Вершина должна быть парой [широта, долгота].")
+            if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                raise serializers.ValidationError("Координаты вершины вне допустимого диапазона.")
+            points.append([lat, lon])
+        return points
+
+    def validate(self, attrs):
+        kind = attrs.get("kind", getattr(self.instance, "kind", SafeZone.CIRCLE))
+        merged = {
+            field: attrs.get(field, getattr(self.instance, field, None))
+            for field in ("center_latitude", "center_longitude", "radius_m", "polygon")
+        }
+        if kind == SafeZone.CIRCLE:
+            if merged["center_latitude"] is None or merged["center_longitude"] is None:
+                raise serializers.ValidationError({"detail": "Для круга нужен центр."})
+            if not merged["radius_m"] or merged["radius_m"] <= 0:
+                raise serializers.ValidationError({"detail": "Для круга нужен положительный радиус."})
+        elif not merged["polygon"]:
+            raise serializers.ValidationError({"detail": "Для многоугольника нужны вершины."})
+        return attrs
+
+    def create(self, validated_data):
+        return SafeZone.objects.create(parent=self.context["request"].user, **validated_data)
+
+class SafeZoneEventSerializer(serializers.ModelSerializer):
+    zone_name = serializers.CharField(source="zone.name", read_only=True)
+
+    class Meta:
+        model = SafeZoneEvent
+        fields = ["id", "zone", "zone_name", "child", "event", "latitude", "longitude", "created_at"]
+
+class BulkIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_MAX_ITEMS,
+    )
+
+    def validate_ids(self, value):
+        return list(dict.fromkeys(value))
+
+class BulkFavoritesSerializer(serializers.Serializer):
+    """id пользователей, которых нужно добавить в избранное или убрать из него."""
+
+    add = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+    remove = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+
+    def validate(self, attrs):
+        attrs["add"] = list(dict.fromkeys(attrs["add"]))
+        attrs["remove"] = list(dict.fromkeys(attrs["remove"]))
+        if not attrs["add"] and not attrs["remove"]:
+            raise serializers.ValidationError({"detail": "Передайте add или remove."})
+        if len(attrs["add"]) + len(attrs["remove"]) > settings.BULK_MAX_ITEMS:
+            raise serializers.ValidationError({"detail": f"Не более {settings.BULK_MAX_ITEMS} элементов за запрос."})
+        if set(attrs["add"]) & set(attrs["remove"]):
+            raise serializers.ValidationError({"detail": "Один и тот же контакт нельзя одновременно добавить и удалить."})
+        return attrs
+
+class KeywordReplaceSerializer(serializers.Serializer):
+    words = serializers.ListField(
+        child=serializers.CharField(max_length=255),
+        allow_empty=True,
+        max_length=settings.BULK_MAX_ITEMS,
+    )
+
+    def validate_words(self, value):
+        return list(dict.fromkeys(word.strip() for word in value if word.strip()))
+
+class FamilyMemberSerializer(serializers.ModelSerializer):
+    user = MatchedUserSerializer(read_only=True)
+    identifier = serializers.CharField(write_only=True)
+
+    class Meta:
+        model = FamilyMember
+        fields = ["id", "user", "identifier", "role", "is_accepted", "joined_at"]
+        read_only_fields = ["is_accepted"]
+
+    def validate(self, attrs):
+        family = self.context["family"]
+        try:
+            user = User.objects.get(identifier=attrs.pop("identifier"))
+        except User.DoesNotExist:
+            raise serializers.ValidationError({"identifier": "Пользователь с таким идентификатором не найден."})
+        if user.role != attrs["role"]:
+            raise serializers.ValidationError({"role": "Роль в семье должна совпадать с ролью пользователя."})
+        if FamilyMember.objects.filter(family=family, user=user).exists():
+            raise serializers.ValidationError({"detail": "Пользователь уже в этой семье или приглашён в неё."})
+        attrs["user"] = user
+        return attrs
+
+    def create(self, validated_data):
+        return FamilyMember.objects.create(family=self.context["family"], **validated_data)
+
+class FamilySerializer(serializers.ModelSerializer):
+    members = FamilyMemberSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Family
+        fields = ["id", "name", "created_at", "members"]
+
+    def create(self, validated_data):
+        user = self.context["request"].user
+        if user.role != "parent":
+            raise serializers.ValidationError({"detail": "Создать семью может только родитель."})
+        family = Family.objects.create(created_by=user, **validated_data)
+        FamilyMember.objects.create(family=family, user=user, role=FamilyMember.PARENT, is_accepted=True)
+        return family
+
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     password2 = serializers.CharField(write_only=True)
@@ -0,0 +1,185 @@
+"""
+Шардирование таблицы Location по id пользователя.
+
+settings.LOCATION_SHARDS — список алиасов баз данных; точка пользователя
+хранится в шарде LOCATION_SHARDS[user_id % len(LOCATION_SHARDS)]. Маршрутизацию
+делают LocationShardRouter (обращения через user.location и сохранение
+экземпляров) и LocationQuerySet (запросы с user/user_id в аргументах), так что
+код, работающий с одним пользователем, не знает о шардах. Выборки по многим
+пользователям идут через Location.objects.for_users() или
+prefetch_related("…__location") — по одному запросу на шард.
+
+Запрос, шард которого определить нельзя (Q-объекты, user__in, all(), count()),
+при нескольких шардах падает с UnroutableQuery, а не читает молча первый шард:
+такой запрос нужно явно направить через .using(<алиас>) или for_users().
+
+Новый шард создаётся командой init_location_shard: обычный
+migrate --database=<алиас> повторил бы 0001 с внешним ключом на таблицу
+пользователей, которой в шарде нет.
+"""
+from django.conf import settings
+from django.db import connections, models
+from django.db.models.fields.related_descriptors import ReverseOneToOneDescriptor
+
+SHARDED_MODEL = "location"
+# таблицы, которые есть и в default, и в каждом шарде: пишутся в одной транзакции с Location
+SHARD_LOCAL_MODELS = ("outboxevent",)
+USER_LOOKUPS = ("user", "user_id", "user__pk", "user__id")
+
+
+def shard_aliases():
+    return list(getattr(settings, "LOCATION_SHARDS", None) or ["default"])
+
+
+def shard_for(user_id):
+    aliases = shard_aliases()
+    return aliases[int(user_id) % len(aliases)]
+
+
+def group_by_shard(user_ids):
+    groups = {}
+    for user_id in user_ids:
+        groups.setdefault(shard_for(user_id), []).append(user_id)
+    return groups
+
+
+def add_sqlite_alias(alias, path):
+    """Регистрирует SQLite-файл как алиас базы на лету (бенчмарки, тесты, миграция шардов)."""
+    connections.settings[alias] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": str(path),
+        # IMMEDIATE: конкурентные update_or_create ждут блокировку, а не падают с «database is locked»
+        "OPTIONS": {"timeout": 30, "transaction_mode": "IMMEDIATE"},
+    }
+    connections.settings = connections.configure_settings(connections.settings)
+
+
+class UnroutableQuery(Exception):
+    """Запрос к Location без пользователя в фильтре при нескольких шардах."""
+
+
+def _is_location(model):
+    return model._meta.app_label == "sos_module" and model._meta.model_name == SHARDED_MODEL
+
+
+class LocationShardRouter:
+    """
+    Location живёт в шардах, всё остальное — в default. Связь Location ↔ User
+    между базами разрешена (внешний ключ без ограничения в БД).
+    """
+
+    def _db_for(self, model, hints):
+        instance = hints.get("instance")
+        if _is_location(model):
+            user_id = None
+            if instance is not None:
+                user_id = instance.user_id if _is_location(type(instance)) else instance.pk
+            if user_id is not None:
+                return shard_for(user_id)
+            aliases = shard_aliases()
+            if len(aliases) == 1:
+                return aliases[0]
+            raise UnroutableQuery(
+                "Шард Location не определить: фильтруйте по user/user_id, "
+                "используйте for_users() или укажите базу через using()."
+            )
+        if instance is not None and _is_location(type(instance)):
+            # location.user: пользователь всегда в default, а не в шарде точки
+            return "default"
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if _is_location(type(obj1)) or _is_location(type(obj2)):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == "sos_module" and model_name == SHARDED_MODEL:
+            return db in shard_aliases()
+        if app_label == "sos_module" and model_name in SHARD_LOCAL_MODELS:
+            return db == "default" or db in shard_aliases()
+        if db != "default" and db in shard_aliases():
+            return False
+        return None
+
+
+class LocationQuerySet(models.QuerySet):
+    """QuerySet, который сам выбирает шард по пользователю из аргументов фильтра."""
+
+    def _routed(self, kwargs):
+        if self._db is not None:
+            return self
+        for lookup in USER_LOOKUPS:
+            if lookup in kwargs:
+                value = kwargs[lookup]
+                user_id = getattr(value, "pk", value)
+                if user_id is not None:
+                    return self.using(shard_for(user_id))
+        return self
+
+    def filter(self, *args, **kwargs):
+        return super(LocationQuerySet, self._routed(kwargs)).filter(*args, **kwargs)
+
+    def create(self, **kwargs):
+        return super(LocationQuerySet, self._routed(kwargs)).create(**kwargs)
+
+    def get_or_create(self, defaults=None, **kwargs):
+        return super(LocationQuerySet, self._routed(kwargs)).get_or_create(defaults, **kwargs)
+
+    def update_or_create(self, defaults=None, create_defaults=None, **kwargs):
+        return super(LocationQuerySet, self._routed(kwargs)).update_or_create(defaults, create_defaults, **kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None:
+            return super().bulk_create(objs, *args, **kwargs)
+        created = []
+        groups = {}
+        for obj in objs:
+            groups.setdefault(shard_for(obj.user_id), []).append(obj)
+        for alias, group in groups.items():
+            created.extend(super(LocationQuerySet, self.using(alias)).bulk_create(group, *args, **kwargs))
+        return created
+
+    def for_users(self, users):
+        """
+        Точки пользователей (объекты или id) — по одному запросу на шард.
+        Возвращает словарь user_id → Location.
+        """
+        user_ids = {getattr(user, "pk", user) for user in users}
+        result = {}
+        for alias, ids in group_by_shard(user_ids).items():
+            queryset = super(LocationQuerySet, self.using(alias)).filter(user_id__in=ids)
+            result.update((location.user_id, location) for location in queryset)
+        return result
+
+
+class ShardedReverseOneToOneDescriptor(ReverseOneToOneDescriptor):
+    """
+    user.location с поддержкой prefetch_related по нескольким шардам:
+    пользователи раскладываются по шардам, и каждый шард читается одним запросом.
+    """
+
+    def get_prefetch_querysets(self, instances, querysets=None):
+        if querysets and len(querysets) != 1:
+            raise ValueError("querysets argument of get_prefetch_querysets() should have a length of 1.")
+        queryset = querysets[0] if querysets else self.related.related_model.objects.all()
+
+        rel_obj_attr = self.related.field.get_local_related_value
+        instance_attr = self.related.field.get_foreign_related_value
+        instances_dict = {instance_attr(instance): instance for instance in instances}
+        related = list(queryset.for_users(instances).values())
+        for rel_obj in related:
+            self.related.field.set_cached_value(rel_obj, instances_dict[rel_obj_attr(rel_obj)])
+        return related, rel_obj_attr, instance_attr, True, self.related.cache_name, False
+
+
+class ShardedOneToOneField(models.OneToOneField):
+    """OneToOneField, чья обратная сторона умеет читать из нескольких шардов."""
+
+    related_accessor_class = ShardedReverseOneToOneDescriptor
@@ -0,0 +1,182 @@
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Contact, FavoriteContact, Keyword, Location, SosSignal, Tombstone, User
+
+CURSOR_SALT = "sos_module.sync"
+
+CONTACTS = "contacts"
+FAVORITES = "favorites"
+KEYWORDS = "keywords"
+SOS = "sos"
+RESOURCES = (CONTACTS, FAVORITES, KEYWORDS, SOS)
+
+
+def make_cursor(moment):
+    return signing.dumps(moment.timestamp(), salt=CURSOR_SALT)
+
+
+def parse_cursor(cursor):
+    """
+    Момент, с которого нужно отдавать изменения, или None — тогда клиент
+    получит полный снимок (курсор битый или старше хранения tombstone-записей).
+    """
+    if not cursor:
+        return None
+    try:
+        since = datetime.fromtimestamp(signing.loads(cursor, salt=CURSOR_SALT), tz=dt_timezone.utc)
+    except (signing.BadSignature, TypeError, ValueError, OverflowError):
+        return None
+    if since < timezone.now() - settings.SYNC_TOMBSTONE_TTL:
+        return None
+    return since
+
+
+# Отметки пишет сигнал post_delete, поэтому их получают и каскадные удаления
+# (например, заявки удалённого пользователя у его контактов).
+TRACKED_MODELS = {
+    Contact: (CONTACTS, ("from_user_id", "to_user_id")),  # заявка видна обоим участникам
+    FavoriteContact: (FAVORITES, ("user_id",)),
+    Keyword: (KEYWORDS, ("user_id",)),
+    SosSignal: (SOS, ("sender_id",)),
+}
+
+_state = threading.local()
+
+
+def _deleting_users():
+    if not hasattr(_state, "deleting_users"):
+        _state.deleting_users = set()
+    return _state.deleting_users
+
+
+@contextmanager
+def tombstone_batch():
+    """Копит отметки удалений внутри блока и пишет их одним INSERT при выходе."""
+    if getattr(_state, "batch", None) is not None:
+        yield  # вложенный блок пишет вместе с внешним
+        return
+    _state.batch = []
+    try:
+        yield
+        rows = _state.batch
+    finally:
+        _state.batch = None
+    Tombstone.objects.bulk_create(rows)
+
+
+@receiver(pre_delete, sender=User)
+def mark_user_deleting(sender, instance, **kwargs):
+    # отметки самому удаляемому пользователю не нужны, а вставить их не даст его же удаление
+    _deleting_users().add(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def unmark_user_deleting(sender, instance, **kwargs):
+    _deleting_users().discard(instance.pk)
+
+
+def record_deletion(sender, instance, **kwargs):
+    resource, owner_fields = TRACKED_MODELS[sender]
+    deleting = _deleting_users()
+    rows = [
+        Tombstone(user_id=user_id, resource=resource, object_id=instance.pk)
+        for user_id in {getattr(instance, field) for field in owner_fields}
+        if user_id not in deleting
+    ]
+    batch = getattr(_state, "batch", None)
+    if batch is not None:
+        batch.extend(rows)
+    elif rows:
+        Tombstone.objects.bulk_create(rows)
+
+
+for _model in TRACKED_MODELS:
+    post_delete.connect(record_deletion, sender=_model, dispatch_uid=f"sync.tombstone.{_model.__name__}")
+
+
+def purge_tombstones():
+    """Отметки старше SYNC_TOMBSTONE_TTL не нужны: такие курсоры всё равно получают полный снимок."""
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=timezone.now() - settings.SYNC_TOMBSTONE_TTL).delete()
+    return deleted
+
+
+def moved_counterparts(user, since):
+    """id контактов и избранных пользователя, чья точка обновилась после since."""
+    pairs = Contact.objects.filter(Q(from_user=user) | Q(to_user=user)).values_list("from_user_id", "to_user_id")
+    others = {to_id if from_id == user.pk else from_id for from_id, to_id in pairs}
+    others.update(FavoriteContact.objects.filter(user=user).values_list("contact_id", flat=True))
+    return set(Location.objects.filter(updated_at__gt=since).for_users(others))
+
+
+def collect_changes(user, since=None):
+    """
+    Снимок (since=None) или изменения после since по всем ресурсам приложения.
+    Число запросов не зависит от объёма данных.
+    """
+    changed = Q() if since is None else Q(updated_at__gt=since)
+    contacts_changed = favorites_changed = changed
+    if since is not None:
+        # карточки контактов несут их местоположение: переместившийся контакт — тоже изменение
+        moved = moved_counterparts(user, since)
+        contacts_changed = changed | Q(from_user_id__in=moved) | Q(to_user_id__in=moved)
+        favorites_changed = changed | Q(contact_id__in=moved)
+
+    contacts = (
+        Contact.objects
+        .filter(contacts_changed, Q(from_user=user) | Q(to_user=user))
+        .select_related("from_user", "to_user")
+        .prefetch_related("from_user__location", "to_user__location")
+        .order_by("id")
+    )
+    favorites = (
+        FavoriteContact.objects
+        .filter(favorites_changed, user=user)
+        .select_related("contact")
+        .prefetch_related("contact__location")
+        .order_by("id")
+    )
+    keywords = Keyword.objects.filter(changed, user=user).order_by("id")
+    signals = (
+        SosSignal.objects
+        .filter(changed, sender=user)
+        .select_related("sender")
+        .prefetch_related("sender__location")
+        .order_by("-created_at")
+    )
+
+    result = {
+        CONTACTS: [],
+        "incoming_requests": [],
+        "outgoing_requests": [],
+        "deleted": {resource: [] for resource in RESOURCES},
+    }
+    for contact in contacts:
+        # раскладываем заявки так же, как /contacts/, /incoming-requests/ и /outgoing-requests/
+        if contact.is_accepted and contact.from_user_id == user.pk:
+            result[CONTACTS].append(contact)
+        elif not contact.is_accepted and contact.to_user_id == user.pk:
+            result["incoming_requests"].append(contact)
+        elif not contact.is_accepted:
+            result["outgoing_requests"].append(contact)
+        elif since is not None:
+            # принятая входящая заявка пропадает из списков получателя
+            result["deleted"][CONTACTS].append(contact.pk)
+
+    result[FAVORITES] = list(favorites)
+    result[KEYWORDS] = list(keywords)
+    result[SOS] = list(signals)
+
+    if since is not None:
+        tombstones = Tombstone.objects.filter(user=user, deleted_at__gt=since).values_list("resource", "object_id")
+        for resource, object_id in tombstones:
+            result["deleted"].setdefault(resource, []).append(object_id)
+    return result
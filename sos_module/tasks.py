@@ -0,0 +1,39 @@
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from .idempotency import purge_expired_keys
+from .jobs import task
+from .models import Job, SosSignal
+from .outbox import purge_events
+from .ranking import rank_responders
+from .sync import purge_tombstones
+
+logger = logging.getLogger(__name__)
+
+
+@task("sos.notify", max_attempts=10)
+def notify_sos(sos_id):
+    """Рассылка оповещений о SOS ближайшим избранным и контактам отправителя."""
+    sos = SosSignal.objects.select_related("sender").filter(pk=sos_id, is_active=True).first()
+    if sos is None:
+        return
+    responders = rank_responders(sos, limit=settings.SOS_RANKING["MAX_TOP_K"])
+    # push-провайдера пока нет: фиксируем, кого и в каком порядке нужно оповестить
+    logger.info(
+        "SOS #%s от %s: оповестить %s",
+        sos.pk, sos.sender_id, [item["user_id"] for item in responders],
+    )
+
+
+@task("maintenance.purge")
+def purge_expired():
+    """Чистка устаревших служебных строк: ключей идемпотентности, tombstone-отметок, выполненных задач и событий outbox."""
+    keys = purge_expired_keys()
+    tombstones = purge_tombstones()
+    jobs, _ = Job.objects.filter(
+        status=Job.DONE, updated_at__lt=timezone.now() - settings.JOBS["KEEP_DONE_FOR"]
+    ).delete()
+    events = purge_events()
+    logger.info("Очистка: ключей %s, отметок %s, задач %s, событий %s", keys, tombstones, jobs, events)
@@ -1,3 +1,1502 @@
-from django.test import TestCase
+import importlib
+import io
+import json
+import pstats
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.core.paginator import EmptyPage
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Q, QuerySet
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .admin import EstimatedCountPaginator
+from .idempotency import request_fingerprint
+from .middleware import TOTAL, AdmissionControlMiddleware, AdmissionController
+from . import heatmap, jobs, outbox
+from .family import dashboard_cache_key
+from .geofence import ZoneIndex, ZoneShape, circle_bounds, evaluate_location, record_transitions
+from .models import (
+    Contact,
+    FavoriteContact,
+    Family,
+    FamilyMember,
+    IdempotencyKey,
+    Job,
+    Keyword,
+    Location,
+    OutboxEvent,
+    OutboxOffset,
+    SafeZone,
+    SafeZoneEvent,
+    SosHeatCell,
+    SosSignal,
+    Tombstone,
+    User,
+)
+from .phones import hash_phone, normalize_phone
+from .ranking import rank_candidates, rank_responders
+from .sharding import UnroutableQuery, add_sqlite_alias
+from .views import SosSignalViewSet
+
+
+class PhoneNormalizationTests(SimpleTestCase):
+    SAMPLES = {
+        "+996 555 123 456": "+996555123456",
+        "0555 123 456": "+996555123456",
+        "555123456": "+996555123456",
+        "00996555123456": "+996555123456",
+        "8 912 345-67-89": "+79123456789",
+        "89123": "+99689123",
+        "812345678901": None,
+        "": None,
+        "abc": None,
+    }
+
+    def test_normalize_phone(self):
+        for raw, expected in self.SAMPLES.items():
+            with self.subTest(raw=raw):
+                self.assertEqual(normalize_phone(raw), expected)
+
+    def test_hash_is_salted_and_stable(self):
+        digest = hash_phone("+996555123456")
+        self.assertEqual(digest, hash_phone("+996555123456"))
+        self.assertRegex(digest, r"^[0-9a-f]{64}$")
+        self.assertNotEqual(digest, hash_phone("+996555123457"))
+        with self.settings(PHONE_HASH_SALT="other"):
+            self.assertNotEqual(hash_phone("+996555123456"), digest)
+
+    def test_migration_copy_matches_live_code(self):
+        migration = importlib.import_module("sos_module.migrations.0004_user_phone_index")
+        for raw in self.SAMPLES:
+            with self.subTest(raw=raw):
+                e164 = migration.normalize_phone(raw)
+                self.assertEqual(e164, normalize_phone(raw))
+                if e164:
+                    self.assertEqual(migration.hash_phone(e164), hash_phone(e164))
+
+
+class PhoneMatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="me@sakbol.app", username="me", phone_number="+996555000001")
+        self.friend = User.objects.create(email="friend@sakbol.app", username="friend", phone_number="0555 000 002")
+        self.stranger = User.objects.create(email="stranger@sakbol.app", username="stranger", phone_number="89123456789")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def match(self, **data):
+        response = self.client.post("/api/contacts/match/", data, format="json")
+        self.assertEqual(response.status_code, 200, response.data)
+        return {item["user"]["id"]: item for item in response.data["results"]}
+
+    def test_matches_numbers_and_hashes(self):
+        results = self.match(phones=["+996 555 000 002", "8 (912) 345 67 89", "+996555000001"])
+        self.assertEqual(set(results), {self.friend.id, self.stranger.id})
+        self.assertEqual(results[self.stranger.id]["query"], "8 (912) 345 67 89")
+        self.assertEqual(results[self.friend.id]["contact_status"], "none")
+
+        results = self.match(hashes=[hash_phone("+79123456789").upper()])
+        self.assertEqual(list(results), [self.stranger.id])
+
+    def test_status_is_deterministic_with_requests_in_both_directions(self):
+        outgoing = Contact.objects.create(from_user=self.user, to_user=self.friend)
+        accepted = Contact.objects.create(from_user=self.friend, to_user=self.user, is_accepted=True)
+        incoming = Contact.objects.create(from_user=self.stranger, to_user=self.user)
+        Contact.objects.create(from_user=self.user, to_user=self.stranger)
+
+        results = self.match(phones=["+996555000002", "+79123456789"])
+        self.assertEqual(
+            (results[self.friend.id]["contact_status"], results[self.friend.id]["contact_id"]), ("accepted", accepted.id)
+        )
+        self.assertEqual(
+            (results[self.stranger.id]["contact_status"], results[self.stranger.id]["contact_id"]), ("incoming", incoming.id)
+        )
+        self.assertLess(outgoing.id, accepted.id)
+
+    def test_requires_phones_or_hashes(self):
+        self.assertEqual(self.client.post("/api/contacts/match/", {}, format="json").status_code, 400)
+
+
+class FakeEstimatePaginator(EstimatedCountPaginator):
+    exact_count_threshold = 0
+    estimate = None
+
+    def _estimated_count(self):
+        return self.estimate
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(email="words@sakbol.app")
+        Keyword.objects.bulk_create(Keyword(user=user, word=f"w{i}") for i in range(5))
+
+    def paginator(self, estimate):
+        paginator = FakeEstimatePaginator(Keyword.objects.order_by("id"), 2)
+        paginator.estimate = estimate
+        return paginator
+
+    def test_overestimate_falls_back_to_last_real_page(self):
+        paginator = self.paginator(1000)
+        self.assertEqual(paginator.count, 1000)
+        page = paginator.page(10)
+        self.assertEqual([k.word for k in page.object_list], ["w4"])
+        self.assertEqual((page.number, paginator.count, paginator.num_pages), (3, 5, 3))
+
+    def test_underestimate_still_serves_real_pages(self):
+        paginator = self.paginator(2)
+        page = paginator.page(3)
+        self.assertEqual([k.word for k in page.object_list], ["w4"])
+        self.assertEqual(paginator.count, 5)
+
+    def test_exact_count_still_raises_past_the_end(self):
+        with self.assertRaises(EmptyPage):
+            self.paginator(None).page(4)
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="user@sakbol.app", first_name="Test", last_name="User")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_retry_replays_first_response(self):
+        payload = {"latitude": 42.87, "longitude": 74.59}
+        first = self.client.post("/api/sos/", payload, format="json", HTTP_IDEMPOTENCY_KEY="abc")
+        second = self.client.post("/api/sos/", payload, format="json", HTTP_IDEMPOTENCY_KEY="abc")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data["id"], first.data["id"])
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(SosSignal.objects.count(), 1)
+
+    def test_key_reused_for_other_payload(self):
+        self.client.post("/api/sos/", {"latitude": 1, "longitude": 2}, format="json", HTTP_IDEMPOTENCY_KEY="abc")
+        response = self.client.post("/api/sos/", {"latitude": 3, "longitude": 4}, format="json", HTTP_IDEMPOTENCY_KEY="abc")
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(SosSignal.objects.count(), 1)
+
+    def test_failed_request_is_not_remembered(self):
+        response = self.client.post("/api/location/update/", {}, format="json", HTTP_IDEMPOTENCY_KEY="loc")
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(
+            "/api/location/update/", {"latitude": 1, "longitude": 2}, format="json", HTTP_IDEMPOTENCY_KEY="loc2"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Location.objects.count(), 1)
+
+    def test_in_flight_key_returns_409_without_waiting(self):
+        payload = {"latitude": 42.87, "longitude": 74.59}
+        record = IdempotencyKey.objects.create(
+            user=self.user, key="busy", request_hash="", locked_at=timezone.now(),
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        response = self.client.post("/api/sos/", payload, format="json", HTTP_IDEMPOTENCY_KEY="busy")
+        # отпечаток другой — это не повтор, а конфликт ключа
+        self.assertEqual(response.status_code, 422)
+
+        record.request_hash = self.fingerprint(payload)
+        record.save(update_fields=["request_hash"])
+        response = self.client.post("/api/sos/", payload, format="json", HTTP_IDEMPOTENCY_KEY="busy")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Retry-After"], "1")
+        self.assertFalse(SosSignal.objects.exists())
+
+    def test_abandoned_key_is_taken_over_after_lease(self):
+        payload = {"latitude": 42.87, "longitude": 74.59}
+        # запрос занял ключ, и его процесс умер, не записав ответ
+        IdempotencyKey.objects.create(
+            user=self.user, key="dead", request_hash=self.fingerprint(payload),
+            locked_at=timezone.now() - settings.IDEMPOTENCY_LOCK_TIMEOUT - timedelta(seconds=1),
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        first = self.client.post("/api/sos/", payload, format="json", HTTP_IDEMPOTENCY_KEY="dead")
+        second = self.client.post("/api/sos/", payload, format="json", HTTP_IDEMPOTENCY_KEY="dead")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(second.data["id"], first.data["id"])
+        self.assertEqual(SosSignal.objects.count(), 1)
+
+    def fingerprint(self, payload):
+        return request_fingerprint(SimpleNamespace(method="POST", path="/api/sos/", data=payload))
+
+    def test_without_header_every_request_is_executed(self):
+        self.client.post("/api/sos/", {"latitude": 1, "longitude": 2}, format="json")
+        self.client.post("/api/sos/", {"latitude": 1, "longitude": 2}, format="json")
+
+        self.assertEqual(SosSignal.objects.count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class ConcurrentIdempotencyTests(TransactionTestCase):
+    def test_concurrent_duplicates_create_one_signal(self):
+        user = User.objects.create(email="user@sakbol.app", first_name="Test", last_name="User")
+        barrier = threading.Barrier(8)
+        responses = []
+
+        def submit():
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                responses.append(client.post(
+                    "/api/sos/", {"latitude": 42.87, "longitude": 74.59}, format="json", HTTP_IDEMPOTENCY_KEY="storm"
+                ))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=submit) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(SosSignal.objects.count(), 1)
+        signal_id = SosSignal.objects.get().id
+        # повторы, пришедшие во время обработки, сразу получают 409 и повторяют позже
+        self.assertLessEqual({r.status_code for r in responses}, {201, 409})
+        self.assertEqual({r.data["id"] for r in responses if r.status_code == 201}, {signal_id})
+
+        client = APIClient()
+        client.force_authenticate(user)
+        retry = client.post(
+            "/api/sos/", {"latitude": 42.87, "longitude": 74.59}, format="json", HTTP_IDEMPOTENCY_KEY="storm"
+        )
+        self.assertEqual((retry.status_code, retry.data["id"]), (201, signal_id))
+
+
+    @override_settings(IDEMPOTENCY_LOCK_TIMEOUT=timedelta(0))
+    def test_retry_after_lease_expiry_waits_for_slow_request(self):
+        user = User.objects.create(email="user@sakbol.app", first_name="Test", last_name="User")
+        payload = {"latitude": 42.87, "longitude": 74.59}
+        in_view = threading.Event()
+        responses = {}
+        get_success_headers = SosSignalViewSet.get_success_headers
+
+        def slow_response(view, data):
+            # сигнал уже записан, ответ ещё не сохранён; аренда истекла, повтор перехватывает ключ
+            in_view.set()
+            time.sleep(0.3)
+            return get_success_headers(view, data)
+
+        def submit(name):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                responses[name] = client.post("/api/sos/", payload, format="json", HTTP_IDEMPOTENCY_KEY="slow")
+            finally:
+                connection.close()
+
+        with mock.patch.object(SosSignalViewSet, "get_success_headers", slow_response):
+            slow = threading.Thread(target=submit, args=("slow",))
+            slow.start()
+            self.assertTrue(in_view.wait(5))
+            submit("retry")
+            slow.join()
+
+        self.assertEqual(SosSignal.objects.count(), 1)
+        self.assertEqual(responses["slow"].status_code, 201)
+        self.assertEqual(responses["retry"]["Idempotent-Replayed"], "true")
+        self.assertEqual(responses["retry"].data["id"], responses["slow"].data["id"])
+
+
+ADMISSION_CONFIG = {
+    "DEFAULT_CLASS": "best_effort",
+    "CLASSES": {
+        "critical": {},
+        "bulk": {"MAX_CONCURRENCY": 2},
+        "best_effort": {"MAX_CONCURRENCY": 1, "MAX_LATENCY": 0.5},
+    },
+    "ROUTES": [
+        ("POST", r"^/api/sos/$", "critical"),
+        ("*", r"^/api/location/", "bulk"),
+    ],
+}
+
+
+class AdmissionControlTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        with self.settings(ADMISSION_CONTROL=ADMISSION_CONFIG):
+            self.middleware = AdmissionControlMiddleware(lambda request: HttpResponse())
+        self.controller = self.middleware.controller
+
+    def test_routes_are_classified(self):
+        classify = self.controller.classify
+        self.assertEqual(classify(self.factory.post("/api/sos/")).name, "critical")
+        self.assertEqual(classify(self.factory.get("/api/sos/")).name, "best_effort")
+        self.assertEqual(classify(self.factory.post("/api/location/update/")).name, "bulk")
+        self.assertIsNone(classify(self.factory.get("/admin/")))
+
+    def test_low_priority_is_shed_when_saturated(self):
+        self.controller.counters.incr("best_effort")
+
+        response = self.middleware(self.factory.get("/api/contacts/"))
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "2")
+        self.assertEqual(self.controller.counters.incr("best_effort", 0), 1)
+
+    def test_sos_is_never_shed(self):
+        for name in self.controller.classes:
+            self.controller.counters.incr(name, 100)
+        self.controller.counters.incr(TOTAL, 300)
+
+        response = self.middleware(self.factory.post("/api/sos/"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.controller.counters.incr("critical", 0), 100)
+
+    def test_high_latency_sheds_until_estimate_expires(self):
+        best_effort = self.controller.classes["best_effort"]
+        self.controller.counters.incr("best_effort")
+        self.controller.counters.incr(TOTAL)
+        self.controller.release(best_effort, 2.0)
+
+        self.assertEqual(self.middleware(self.factory.get("/api/contacts/")).status_code, 503)
+
+        best_effort.latency_updated_at -= self.controller.latency_window + 1
+        self.assertEqual(self.middleware(self.factory.get("/api/contacts/")).status_code, 200)
+
+    def test_shedding_is_proportional_to_overload(self):
+        best_effort = self.controller.classes["best_effort"]
+        best_effort.latency = 0.75  # на 50% выше MAX_LATENCY
+        best_effort.latency_updated_at = time.monotonic()
+        bulk = self.controller.classes["bulk"]
+        bulk.max_queue_depth = 10
+        self.controller.counters.incr(TOTAL, 8)  # между SHED_START (5) и лимитом: 60%
+
+        self.controller.random = lambda: 0.4
+        self.assertFalse(self.controller.try_acquire(best_effort))
+        self.assertFalse(self.controller.try_acquire(bulk))
+        self.controller.random = lambda: 0.65
+        self.assertTrue(self.controller.try_acquire(best_effort))
+        self.controller.random = lambda: 0.55
+        self.assertFalse(self.controller.try_acquire(bulk))
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_shared_counters_are_seen_by_every_worker(self):
+        config = {**ADMISSION_CONFIG, "SHARED_CACHE": "default"}
+        workers = [AdmissionController(config) for _ in range(2)]
+        best_effort = [worker.classes["best_effort"] for worker in workers]
+
+        self.assertTrue(workers[0].try_acquire(best_effort[0]))
+        # другой процесс видит запрос первого и упирается в MAX_CONCURRENCY=1
+        self.assertFalse(workers[1].try_acquire(best_effort[1]))
+        workers[0].release(best_effort[0], 0.01)
+        self.assertTrue(workers[1].try_acquire(best_effort[1]))
+        workers[1].release(best_effort[1], 0.01)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_shared_counters_survive_expiry_during_in_flight_requests(self):
+        config = {**ADMISSION_CONFIG, "SHARED_CACHE": "default", "COUNTER_TTL": 1}
+        controller = AdmissionController(config)
+        bulk = controller.classes["bulk"]
+        key = "admission:bulk"
+
+        self.assertTrue(controller.try_acquire(bulk))
+        time.sleep(0.6)
+        self.assertTrue(controller.try_acquire(bulk))
+        time.sleep(0.6)
+        # каждое изменение продлевает ключ: под нагрузкой он не истекает
+        self.assertEqual(cache.get(key), 2)
+
+        # запросы в работе, ключ всё же истёк (долгий простой, вытеснение из кэша)
+        cache.delete(key)
+        controller.release(bulk, 0.01)
+        controller.release(bulk, 0.01)
+        self.assertEqual(cache.get(key), 0)
+
+        admitted = [controller.try_acquire(bulk) for _ in range(5)]
+        self.assertEqual(admitted.count(True), 2)
+
+
+class ResponderRankingTests(TestCase):
+    def setUp(self):
+        self.sender = User.objects.create(email="sender@sakbol.app", first_name="Send", last_name="Er")
+        self.client = APIClient()
+        self.client.force_authenticate(self.sender)
+
+    def make_user(self, email, latitude, longitude):
+        user = User.objects.create(email=email)
+        Location.objects.create(user=user, latitude=latitude, longitude=longitude)
+        return user
+
+    def test_signal_response_ranks_contacts_and_favorites_by_distance(self):
+        far = self.make_user("far@sakbol.app", 42.95, 74.70)
+        near = self.make_user("near@sakbol.app", 42.871, 74.591)
+        favorite = self.make_user("fav@sakbol.app", 42.88, 74.60)
+        stranger = self.make_user("stranger@sakbol.app", 42.87, 74.59)
+        Contact.objects.create(from_user=self.sender, to_user=far, is_accepted=True)
+        Contact.objects.create(from_user=near, to_user=self.sender, is_accepted=True)
+        FavoriteContact.objects.create(user=self.sender, contact=favorite)
+
+        response = self.client.post("/api/sos/", {"latitude": 42.87, "longitude": 74.59}, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        ranked = [item["user_id"] for item in response.data["responders"]]
+        self.assertEqual(ranked, [near.id, favorite.id, far.id])
+        self.assertNotIn(stranger.id, ranked)
+        self.assertTrue(response.data["responders"][1]["is_favorite"])
+        self.assertGreater(response.data["responders"][2]["eta_seconds"], 0)
+
+        response = self.client.get(f"/api/sos/{response.data['id']}/responders/?limit=1")
+        self.assertEqual([item["user_id"] for item in response.data], [near.id])
+
+    def test_list_does_not_rank(self):
+        SosSignal.objects.create(sender=self.sender, latitude=1, longitude=2)
+
+        response = self.client.get("/api/sos/")
+
+        self.assertNotIn("responders", response.data["results"][0])
+
+    def test_stale_locations_are_penalized_and_expired_dropped(self):
+        now = timezone.now()
+        rows = [
+            (1, 42.871, 74.591, now - timedelta(hours=1), False),
+            (2, 42.875, 74.595, now, False),
+            (3, 42.870, 74.590, now - timedelta(days=2), False),
+        ]
+
+        ranked = rank_candidates(42.87, 74.59, rows, limit=10, now=now)
+
+        self.assertEqual([item["user_id"] for item in ranked], [2, 1])
+
+
+class SafeZoneTests(TestCase):
+    def setUp(self):
+        self.parent = User.objects.create(email="parent@sakbol.app", role="parent")
+        self.child = User.objects.create(email="child@sakbol.app", role="child")
+        Contact.objects.create(from_user=self.parent, to_user=self.child, is_accepted=True)
+        self.parent_client = APIClient()
+        self.parent_client.force_authenticate(self.parent)
+        self.child_client = APIClient()
+        self.child_client.force_authenticate(self.child)
+
+    def ping(self, latitude, longitude):
+        response = self.child_client.post(
+            "/api/location/update/", {"latitude": latitude, "longitude": longitude}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_only_transitions_emit_events(self):
+        response = self.parent_client.post("/api/safe-zones/", {
+            "child_id": self.child.id, "name": "Школа", "kind": "circle",
+            "center_latitude": 42.87, "center_longitude": 74.59, "radius_m": 300,
+        }, format="json")
+        self.assertEqual(response.status_code, 201, response.data)
+        self.parent_client.post("/api/safe-zones/", {
+            "child_id": self.child.id, "name": "Парк", "kind": "polygon",
+            "polygon": [[42.90, 74.60], [42.90, 74.62], [42.92, 74.62], [42.92, 74.60]],
+        }, format="json")
+
+        self.ping(42.8701, 74.5901)
+        self.ping(42.8702, 74.5902)
+        self.ping(42.91, 74.61)
+
+        events = list(SafeZoneEvent.objects.order_by("id").values_list("zone__name", "event"))
+        self.assertEqual(events, [("Школа", "enter"), ("Школа", "exit"), ("Парк", "enter")])
+
+        response = self.parent_client.get("/api/safe-zones/events/")
+        self.assertEqual(response.data["count"], 3)
+
+    def test_stale_read_does_not_duplicate_transition(self):
+        zone = SafeZone.objects.create(
+            parent=self.parent, child=self.child, name="Дом", kind="circle",
+            center_latitude=42.87, center_longitude=74.59, radius_m=300,
+        )
+        self.assertEqual(len(evaluate_location(self.child, 42.8701, 74.5901)), 1)
+
+        # вторая точка прочитала состояние до того, как первая его записала
+        self.assertEqual(record_transitions(self.child, {zone.id}, 42.8701, 74.5901), [])
+        self.assertEqual(SafeZoneEvent.objects.count(), 1)
+
+    def test_zone_without_geometry_is_a_validation_error(self):
+        zone = SafeZone(parent=self.parent, child=self.child, name="Пусто", kind="polygon", polygon=None)
+
+        with self.assertRaises(ValidationError):
+            zone.clean()
+        with self.assertRaises(ValidationError):
+            zone.save()
+        self.assertFalse(SafeZone.objects.exists())
+
+    def test_zone_requires_linked_child(self):
+        stranger = User.objects.create(email="other@sakbol.app", role="child")
+
+        response = self.parent_client.post("/api/safe-zones/", {
+            "child_id": stranger.id, "name": "Дом", "kind": "circle",
+            "center_latitude": 42.87, "center_longitude": 74.59, "radius_m": 100,
+        }, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(SafeZone.objects.exists())
+
+    def test_circle_center_and_radius_are_range_checked(self):
+        base = {"child_id": self.child.id, "name": "Дом", "kind": "circle",
+                "center_latitude": 42.87, "center_longitude": 74.59, "radius_m": 100}
+        for field, value in (
+            ("center_latitude", 500), ("center_latitude", -91), ("center_longitude", 181),
+            ("radius_m", 0), ("radius_m", settings.SAFE_ZONES["MAX_RADIUS_M"] + 1),
+        ):
+            response = self.parent_client.post("/api/safe-zones/", {**base, field: value}, format="json")
+            self.assertEqual(response.status_code, 400, (field, value))
+            self.assertIn(field, response.data)
+        self.assertFalse(SafeZone.objects.exists())
+
+        with self.assertRaises(ValidationError):
+            SafeZone(parent=self.parent, child=self.child, name="Дом", kind="circle",
+                     center_latitude=500, center_longitude=74.59, radius_m=100).save()
+
+    def test_index_matches_exact_test_for_large_zones(self):
+        small = ZoneShape(1, SafeZone.CIRCLE, circle_bounds(42.87, 74.59, 100), (42.87, 74.59), 100)
+        large = ZoneShape(2, SafeZone.CIRCLE, circle_bounds(42.87, 74.59, 50000), (42.87, 74.59), 50000)
+        index = ZoneIndex([small, large], cell_size=0.01, max_cells_per_zone=16)
+
+        self.assertEqual(index.large, [large])
+        self.assertEqual(index.containing(42.8701, 74.5901), {1, 2})
+        self.assertEqual(index.containing(43.0, 74.59), {2})
+        self.assertEqual(index.containing(45.0, 74.59), set())
+
+
+class SyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="user@sakbol.app", first_name="Test", last_name="User")
+        Location.objects.create(user=self.user, latitude=1, longitude=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_contacts(self, count, offset=0):
+        for i in range(offset, offset + count):
+            other = User.objects.create(email=f"friend{i}@sakbol.app")
+            Location.objects.create(user=other, latitude=1, longitude=2)
+            Contact.objects.create(from_user=self.user, to_user=other, is_accepted=True)
+            FavoriteContact.objects.create(user=self.user, contact=other)
+            Contact.objects.create(from_user=User.objects.create(email=f"fan{i}@sakbol.app"), to_user=self.user)
+            Keyword.objects.create(user=self.user, word=f"word{i}")
+            SosSignal.objects.create(sender=self.user, latitude=1, longitude=2)
+
+    def sync_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/sync/")
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_full_sync_uses_fixed_number_of_queries(self):
+        self.add_contacts(2)
+        response, small = self.sync_queries()
+        self.add_contacts(10, offset=2)
+        response, large = self.sync_queries()
+
+        self.assertEqual(small, large)
+        self.assertTrue(response.data["full"])
+        self.assertEqual(len(response.data["contacts"]), 12)
+        self.assertEqual(len(response.data["incoming_requests"]), 12)
+        self.assertEqual(len(response.data["favorites"]), 12)
+        self.assertTrue(all(contact["is_favorite"] for contact in response.data["contacts"]))
+
+    @override_settings(SYNC_CURSOR_SKEW=timedelta(0))
+    def test_delta_returns_only_changes_and_deletions(self):
+        self.add_contacts(3)
+        cursor = self.client.get("/api/sync/").data["cursor"]
+        keyword = Keyword.objects.first()
+        self.client.delete(f"/api/keywords/{keyword.id}/")
+        incoming = Contact.objects.filter(to_user=self.user).first()
+        self.client.post(f"/api/contacts/{incoming.id}/accept/")
+
+        response = self.client.get("/api/sync/", {"cursor": cursor})
+
+        self.assertFalse(response.data["full"])
+        self.assertEqual(response.data["keywords"], [])
+        self.assertEqual(response.data["deleted"]["keywords"], [keyword.id])
+        self.assertEqual(response.data["deleted"]["contacts"], [incoming.id])
+        self.assertEqual(response.data["contacts"], [])
+
+    @override_settings(SYNC_CURSOR_SKEW=timedelta(0))
+    def test_delta_includes_contacts_that_moved(self):
+        self.add_contacts(2)
+        cursor = self.client.get("/api/sync/").data["cursor"]
+        moved = Contact.objects.filter(from_user=self.user).order_by("id").first().to_user
+        Location.objects.filter(user=moved).update(latitude=5, updated_at=timezone.now())
+
+        response = self.client.get("/api/sync/", {"cursor": cursor})
+
+        self.assertEqual([contact["to_user"]["id"] for contact in response.data["contacts"]], [moved.id])
+        self.assertEqual([favorite["contact"]["id"] for favorite in response.data["favorites"]], [moved.id])
+
+    @override_settings(SYNC_CURSOR_SKEW=timedelta(0))
+    def test_cascade_delete_leaves_tombstones_for_the_other_side(self):
+        self.add_contacts(1)
+        cursor = self.client.get("/api/sync/").data["cursor"]
+        contact = Contact.objects.get(from_user=self.user)
+        fan_request = Contact.objects.get(to_user=self.user)
+        favorite = FavoriteContact.objects.get(user=self.user)
+
+        contact.to_user.delete()
+        fan_request.from_user.delete()
+        response = self.client.get("/api/sync/", {"cursor": cursor})
+
+        self.assertEqual(sorted(response.data["deleted"]["contacts"]), sorted([contact.id, fan_request.id]))
+        self.assertEqual(response.data["deleted"]["favorites"], [favorite.id])
+        self.assertFalse(Tombstone.objects.exclude(user=self.user).exists())
+
+    def test_bad_cursor_falls_back_to_full_sync(self):
+        response = self.client.get("/api/sync/", {"cursor": "garbage"})
+
+        self.assertTrue(response.data["full"])
+
+
+class BulkMutationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email="user@sakbol.app")
+        self.others = [User.objects.create(email=f"other{i}@sakbol.app") for i in range(5)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_accept_reports_each_item(self):
+        pending = [Contact.objects.create(from_user=other, to_user=self.user) for other in self.others[:3]]
+        accepted = Contact.objects.create(from_user=self.others[3], to_user=self.user, is_accepted=True)
+        foreign = Contact.objects.create(from_user=self.user, to_user=self.others[4])
+
+        ids = [c.id for c in pending] + [accepted.id, foreign.id]
+        response = self.client.post("/api/contacts/bulk-accept/", {"ids": ids}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["status"] for r in response.data["results"]], ["ok", "ok", "ok", "error", "error"])
+        self.assertEqual(Contact.objects.filter(to_user=self.user, is_accepted=True).count(), 4)
+
+    def test_bulk_cancel_deletes_pending_outgoing(self):
+        pending = [Contact.objects.create(from_user=self.user, to_user=other) for other in self.others[:2]]
+        accepted = Contact.objects.create(from_user=self.user, to_user=self.others[2], is_accepted=True)
+
+        ids = [c.id for c in pending] + [accepted.id]
+        response = self.client.post("/api/contacts/bulk-cancel/", {"ids": ids}, format="json")
+
+        self.assertEqual([r["status"] for r in response.data["results"]], ["ok", "ok", "error"])
+        self.assertEqual(list(Contact.objects.values_list("id", flat=True)), [accepted.id])
+
+    def test_bulk_favorites_validation_is_set_based(self):
+        FavoriteContact.objects.create(user=self.user, contact=self.others[0])
+        FavoriteContact.objects.create(user=self.user, contact=self.others[1])
+        add = [other.id for other in self.others] + [self.user.id, 999]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                "/api/favorites/bulk/", {"add": add, "remove": []}, format="json"
+            )
+        statuses = [r["status"] for r in response.data["results"]]
+
+        self.assertEqual(statuses, ["error", "error", "ok", "ok", "ok", "error", "error"])
+        self.assertLess(len(queries), 10)
+        self.assertEqual(FavoriteContact.objects.filter(user=self.user).count(), 5)
+
+        response = self.client.post("/api/favorites/bulk/", {"remove": [self.others[0].id, 999]}, format="json")
+        self.assertEqual([r["status"] for r in response.data["results"]], ["ok", "error"])
+        self.assertEqual(FavoriteContact.objects.filter(user=self.user).count(), 4)
+
+    def test_bulk_favorites_survive_concurrent_duplicate(self):
+        real_bulk_create = FavoriteContact.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            # другой запрос успел добавить тот же контакт после проверки
+            FavoriteContact.objects.create(user=self.user, contact=self.others[0])
+            return real_bulk_create(objs, **kwargs)
+
+        add = [self.others[0].id, self.others[1].id]
+        with mock.patch.object(FavoriteContact.objects, "bulk_create", side_effect=racing_bulk_create):
+            response = self.client.post("/api/favorites/bulk/", {"add": add}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r["status"] for r in response.data["results"]], ["ok", "ok"])
+        self.assertEqual(
+            sorted(FavoriteContact.objects.filter(user=self.user).values_list("contact_id", flat=True)), sorted(add)
+        )
+
+    def test_keywords_replace_keeps_matching_rows(self):
+        help_word = Keyword.objects.create(user=self.user, word="помогите")
+        Keyword.objects.create(user=self.user, word="старое")
+
+        response = self.client.put(
+            "/api/keywords/replace/", {"words": ["помогите", "спасите", "спасите "]}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"], [
+            {"word": "помогите", "status": "kept"},
+            {"word": "спасите", "status": "created"},
+        ])
+        self.assertEqual(response.data["keywords"][0]["id"], help_word.id)
+        self.assertEqual(sorted(Keyword.objects.values_list("word", flat=True)), ["помогите", "спасите"])
+
+
+calls = []
+
+
+@jobs.task("tests.flaky", max_attempts=2)
+def flaky_task(fail=False, value=None):
+    calls.append(value)
+    if fail:
+        raise RuntimeError("boom")
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_failed_job_is_retried_with_backoff_then_dead_lettered(self):
+        job = jobs.enqueue("tests.flaky", {"fail": True})
+
+        [claimed] = jobs.claim("worker", ["default"], 10)
+        with self.assertLogs("sos_module.jobs", level="WARNING"):
+            self.assertFalse(jobs.execute(claimed))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn("boom", job.last_error)
+
+        self.assertEqual(jobs.claim("worker", ["default"], 10), [])
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        [claimed] = jobs.claim("worker", ["default"], 10)
+        with self.assertLogs("sos_module.jobs", level="ERROR"):
+            jobs.execute(claimed)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DEAD, 2))
+
+    def test_claimed_job_is_not_claimed_twice(self):
+        jobs.enqueue("tests.flaky", {"value": 1})
+
+        self.assertEqual(len(jobs.claim("a", ["default"], 10)), 1)
+        self.assertEqual(jobs.claim("b", ["default"], 10), [])
+
+    def test_stale_job_is_requeued(self):
+        job = jobs.enqueue("tests.flaky")
+        jobs.claim("gone", ["default"], 1)
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(jobs.requeue_stale(["default"]), 1)
+        self.assertEqual(jobs.claim("alive", ["default"], 1)[0].attempts, 2)
+
+    def test_job_that_keeps_killing_its_worker_goes_dead(self):
+        job = jobs.enqueue("tests.flaky", max_attempts=1)
+        jobs.claim("gone", ["default"], 1)
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+
+        with self.assertLogs("sos_module.jobs", level="ERROR"):
+            self.assertEqual(jobs.requeue_stale(["default"]), 0)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.DEAD, ""))
+
+    def test_heartbeat_keeps_long_job_leased(self):
+        job = jobs.enqueue("tests.flaky")
+        jobs.claim("busy", ["default"], 1)
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(jobs.heartbeat("busy"), 1)
+        self.assertEqual(jobs.requeue_stale(["default"]), 0)
+        self.assertEqual(Job.objects.get(pk=job.pk).locked_by, "busy")
+
+    @override_settings(JOBS={**settings.JOBS, "PERIODIC": {"tests.flaky": timedelta(hours=1)}})
+    def test_periodic_job_is_scheduled_once_per_interval(self):
+        [job] = jobs.schedule_periodic()
+        self.assertEqual(jobs.schedule_periodic(), [])
+
+        done_at = timezone.now()
+        Job.objects.filter(pk=job.pk).update(status=Job.DONE, updated_at=done_at)
+        [next_job] = jobs.schedule_periodic()
+        self.assertEqual(next_job.run_at, done_at + timedelta(hours=1))
+
+    @override_settings(JOBS={**settings.JOBS, "PERIODIC": {"tests.flaky": timedelta(hours=1)}})
+    def test_concurrent_schedulers_enqueue_periodic_job_once(self):
+        jobs.schedule_periodic()
+        # второй воркер проверял очередь до коммита первого и задачи не увидел
+        with mock.patch.object(QuerySet, "exists", return_value=False):
+            self.assertEqual(jobs.schedule_periodic(), [])
+        self.assertEqual(Job.objects.filter(name="tests.flaky", status=Job.PENDING).count(), 1)
+        # разовые задачи с тем же именем ограничение не трогает
+        jobs.enqueue("tests.flaky")
+        self.assertEqual(Job.objects.filter(name="tests.flaky", status=Job.PENDING).count(), 2)
+
+    def test_sos_creation_enqueues_notification(self):
+        user = User.objects.create(email="user@sakbol.app")
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.post("/api/sos/", {"latitude": 1, "longitude": 2}, format="json")
+
+        job = Job.objects.get(name="sos.notify")
+        self.assertEqual(job.payload, {"sos_id": response.data["id"]})
+        self.assertTrue(jobs.execute(jobs.claim("worker", ["default"], 1)[0]))
+
+
+class JobWorkerTests(TransactionTestCase):
+    def test_worker_pool_drains_queue(self):
+        for value in range(20):
+            jobs.enqueue("tests.flaky", {"value": value})
+        calls.clear()
+
+        processed = jobs.Worker(concurrency=4, poll_interval=0.01).run(burst=True)
+
+        self.assertEqual(processed, 20)
+        self.assertEqual(sorted(calls), list(range(20)))
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 20)
+
+
+class FamilyDashboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.parent = User.objects.create(email="parent@sakbol.app", role="parent", identifier="11PAPA")
+        self.client = APIClient()
+        self.client.force_authenticate(self.parent)
+        self.family_id = self.client.post("/api/families/", {"name": "Семья"}, format="json").data["id"]
+
+    def add_child(self, i):
+        child = User.objects.create(email=f"child{i}@sakbol.app", role="child", identifier=f"{i:02d}CHLD")
+        Location.objects.create(user=child, latitude=42.87, longitude=74.59)
+        self.invite(child)
+        child_client = APIClient()
+        child_client.force_authenticate(child)
+        response = child_client.post(f"/api/families/{self.family_id}/accept/")
+        self.assertEqual(response.status_code, 200, response.data)
+        return child
+
+    def invite(self, user, role="child"):
+        response = self.client.post(
+            f"/api/families/{self.family_id}/members/", {"identifier": user.identifier, "role": role}, format="json"
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertFalse(response.data["is_accepted"])
+        return response
+
+    def test_dashboard_aggregates_members_in_one_query(self):
+        children = [self.add_child(i) for i in range(5)]
+        SosSignal.objects.create(sender=children[0], latitude=1, longitude=2)
+        SosSignal.objects.create(sender=children[0], latitude=1, longitude=2, is_active=False)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/api/families/{self.family_id}/dashboard/")
+
+        self.assertEqual(response.status_code, 200)
+        # проверка роли + сам дашборд + геолокации (по запросу на шард, здесь шард один)
+        self.assertEqual(len(queries), 3)
+        members = {m["user_id"]: m for m in response.data["members"]}
+        self.assertEqual(len(members), 6)
+        self.assertEqual(members[children[0].id]["active_sos"], 1)
+        self.assertEqual(members[children[1].id]["freshness"], "fresh")
+        self.assertIsNone(members[self.parent.id]["location"])
+
+    def test_dashboard_is_cached_and_supports_etag(self):
+        self.add_child(1)
+        first = self.client.get(f"/api/families/{self.family_id}/dashboard/")
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(
+                f"/api/families/{self.family_id}/dashboard/", HTTP_IF_NONE_MATCH=first["ETag"]
+            )
+
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(len(queries), 1)
+
+        self.add_child(2)
+        third = self.client.get(f"/api/families/{self.family_id}/dashboard/", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(third.status_code, 200)
+        self.assertEqual(len(third.data["members"]), 3)
+
+    def test_children_cannot_see_dashboard_or_manage_members(self):
+        child = self.add_child(1)
+        self.client.force_authenticate(child)
+
+        self.assertEqual(self.client.get(f"/api/families/{self.family_id}/dashboard/").status_code, 404)
+        response = self.client.post(
+            f"/api/families/{self.family_id}/members/", {"identifier": "11PAPA", "role": "parent"}, format="json"
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_invited_child_is_not_linked_until_accepting(self):
+        child = User.objects.create(email="victim@sakbol.app", role="child", identifier="99VICT")
+        Location.objects.create(user=child, latitude=42.87, longitude=74.59)
+        self.invite(child)
+
+        dashboard = self.client.get(f"/api/families/{self.family_id}/dashboard/")
+        self.assertEqual([m["user_id"] for m in dashboard.data["members"]], [self.parent.id])
+        response = self.client.post("/api/safe-zones/", {
+            "child_id": child.id, "name": "Дом", "kind": "circle",
+            "center_latitude": 42.87, "center_longitude": 74.59, "radius_m": 100,
+        }, format="json")
+        self.assertEqual(response.status_code, 400)
+
+        # отклонить приглашение можно, выйдя из семьи
+        child_client = APIClient()
+        child_client.force_authenticate(child)
+        self.assertEqual(child_client.delete(f"/api/families/{self.family_id}/members/{child.id}/").status_code, 204)
+        self.assertFalse(FamilyMember.objects.filter(user=child).exists())
+
+    def test_invited_parent_cannot_act_before_accepting(self):
+        other = User.objects.create(email="other@sakbol.app", role="parent", identifier="22PAPA")
+        self.invite(other, role="parent")
+        client = APIClient()
+        client.force_authenticate(other)
+
+        self.assertEqual(client.get(f"/api/families/{self.family_id}/dashboard/").status_code, 404)
+        stranger = User.objects.create(email="stranger@sakbol.app", role="child", identifier="33CHLD")
+        response = client.post(
+            f"/api/families/{self.family_id}/members/", {"identifier": stranger.identifier, "role": "child"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 403)
+
+        self.assertEqual(client.post(f"/api/families/{self.family_id}/accept/").status_code, 200)
+        self.assertEqual(client.get(f"/api/families/{self.family_id}/dashboard/").status_code, 200)
+
+    def add_parent(self, identifier):
+        other = User.objects.create(email=f"{identifier}@sakbol.app", role="parent", identifier=identifier)
+        self.invite(other, role="parent")
+        client = APIClient()
+        client.force_authenticate(other)
+        self.assertEqual(client.post(f"/api/families/{self.family_id}/accept/").status_code, 200)
+        return other, client
+
+    def remove(self, client, user):
+        return client.delete(f"/api/families/{self.family_id}/members/{user.id}/").status_code
+
+    def test_second_parent_cannot_remove_other_parents(self):
+        second, second_client = self.add_parent("22PAPA")
+        third, _ = self.add_parent("33PAPA")
+
+        self.assertEqual(self.remove(second_client, self.parent), 403)
+        self.assertEqual(self.remove(second_client, third), 403)
+        self.assertTrue(FamilyMember.objects.filter(family_id=self.family_id, user=third).exists())
+
+    def test_creator_cannot_be_removed_even_by_themselves(self):
+        self.assertEqual(self.remove(self.client, self.parent), 403)
+        self.assertTrue(FamilyMember.objects.filter(family_id=self.family_id, user=self.parent).exists())
+
+    def test_creator_removes_parents_and_parents_remove_children_or_themselves(self):
+        second, second_client = self.add_parent("22PAPA")
+        third, third_client = self.add_parent("33PAPA")
+        child = self.add_child(1)
+
+        self.assertEqual(self.remove(second_client, child), 204)
+        self.assertEqual(self.remove(third_client, third), 204)
+        self.assertEqual(self.remove(self.client, second), 204)
+        self.assertEqual(
+            list(FamilyMember.objects.filter(family_id=self.family_id).values_list("user_id", flat=True)),
+            [self.parent.id],
+        )
+
+    def test_only_the_invited_user_can_accept(self):
+        outsider = User.objects.create(email="outsider@sakbol.app", role="child", identifier="44CHLD")
+        client = APIClient()
+        client.force_authenticate(outsider)
+
+        self.assertEqual(client.post(f"/api/families/{self.family_id}/accept/").status_code, 404)
+        self.assertFalse(FamilyMember.objects.filter(user=outsider).exists())
+
+    def test_family_link_allows_safe_zones(self):
+        child = self.add_child(1)
+
+        response = self.client.post("/api/safe-zones/", {
+            "child_id": child.id, "name": "Дом", "kind": "circle",
+            "center_latitude": 42.87, "center_longitude": 74.59, "radius_m": 100,
+        }, format="json")
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertTrue(FamilyMember.objects.filter(user=child).exists())
+
+
+class SosHeatmapTests(TestCase):
+    BBOX = "74.5,42.8,74.7,42.95"
+
+    def setUp(self):
+        self.sender = User.objects.create(email="sender@sakbol.app", first_name="Send", last_name="Er")
+        self.operator = User.objects.create(email="operator@sakbol.app", role="admin")
+        self.client = APIClient()
+
+    def send(self, latitude, longitude):
+        self.client.force_authenticate(self.sender)
+        response = self.client.post("/api/sos/", {"latitude": latitude, "longitude": longitude}, format="json")
+        self.assertEqual(response.status_code, 201)
+        return response.data["id"]
+
+    def fetch(self, **params):
+        outbox.relay([heatmap.CONSUMER])
+        self.client.force_authenticate(self.operator)
+        return self.client.get("/api/sos/heatmap/", {"bbox": self.BBOX, "zoom": 12, "window": "day", **params})
+
+    def test_rollups_follow_create_and_resolve(self):
+        first = self.send(42.8700, 74.5900)
+        self.send(42.8701, 74.5901)
+        self.send(42.9000, 74.6500)
+
+        cells = self.fetch().data["cells"]
+        self.assertEqual(sorted((c["total"], c["active"]) for c in cells), [(1, 1), (2, 2)])
+
+        self.client.force_authenticate(self.sender)
+        self.assertEqual(self.client.post(f"/api/sos/{first}/resolve/").status_code, 200)
+
+        cells = self.fetch().data["cells"]
+        self.assertEqual(sorted((c["total"], c["active"]) for c in cells), [(1, 1), (2, 1)])
+        self.assertEqual(self.fetch(bbox="10,10,11,11").data["cells"], [])
+
+    def test_admin_and_cascade_deletes_reach_the_heatmap(self):
+        first = self.send(42.8700, 74.5900)
+        second = self.send(42.8701, 74.5901)
+        self.send(42.9000, 74.6500)
+        self.assertEqual(sum(c["total"] for c in self.fetch().data["cells"]), 3)
+
+        admin_user = User.objects.create(email="admin@sakbol.app", is_staff=True, is_superuser=True)
+        admin_client = APIClient()
+        admin_client.force_login(admin_user)
+        response = admin_client.post(f"/admin/sos_module/sossignal/{first}/delete/", {"post": "yes"})
+        self.assertEqual(response.status_code, 302)
+        admin_client.post("/admin/sos_module/sossignal/", {
+            "action": "delete_selected", "_selected_action": [second], "post": "yes",
+        })
+        self.assertEqual(sorted(c["total"] for c in self.fetch().data["cells"]), [1])
+
+        # каскад: удаление отправителя удаляет и его сигналы
+        self.sender.delete()
+        self.assertEqual(self.fetch().data["cells"], [])
+
+        # координаты и статус в админке не редактируются — менять их можно только с событием outbox
+        signal = SosSignal.objects.create(sender=admin_user, latitude=42.87, longitude=74.59)
+        edit = admin_client.get(f"/admin/sos_module/sossignal/{signal.pk}/change/")
+        self.assertNotIn('name="latitude"', edit.content.decode())
+        self.assertNotIn('name="is_active"', edit.content.decode())
+
+    def test_sos_creation_does_not_touch_heat_cells(self):
+        with CaptureQueriesContext(connection) as queries:
+            sos_id = self.send(42.87, 74.59)
+        self.assertFalse([q for q in queries if "sosheatcell" in q["sql"]])
+        self.assertFalse(SosHeatCell.objects.exists())
+
+        self.assertEqual(self.fetch().data["cells"][0]["total"], 1)
+        # повторный проход ретранслятора не считает сигнал второй раз
+        self.assertEqual(outbox.relay([heatmap.CONSUMER]), 0)
+        self.assertEqual(self.fetch().data["cells"][0]["total"], 1)
+
+        self.client.force_authenticate(self.sender)
+        self.client.patch(f"/api/sos/{sos_id}/", {"latitude": 42.93, "longitude": 74.68}, format="json")
+        moved = self.fetch().data["cells"]
+        self.assertEqual([(c["total"], c["active"]) for c in moved], [(1, 1)])
+        self.assertGreater(moved[0]["latitude"], 42.9)
+
+        self.client.force_authenticate(self.sender)
+        self.client.delete(f"/api/sos/{sos_id}/")
+        self.assertEqual(self.fetch().data["cells"], [])
+
+    @override_settings(SOS_HEATMAP={**settings.SOS_HEATMAP, "MAX_CELLS": 1})
+    def test_too_many_cells_coarsen_zoom_then_truncate(self):
+        self.send(42.8700, 74.5900)
+        self.send(42.9000, 74.6500)
+
+        response = self.fetch().data
+        # на zoom 12 и 10 это две ячейки, на 8 — уже одна
+        self.assertEqual((response["zoom"], response["truncated"]), (8, False))
+        self.assertEqual(response["cells"][0]["total"], 2)
+
+        self.send(10.0, 10.0)
+        response = self.fetch(bbox="0,0,100,60").data
+        self.assertEqual((response["zoom"], response["truncated"], len(response["cells"])), (4, True, 1))
+
+    def test_weekly_window_reads_daily_buckets_and_matches_rebuild(self):
+        self.send(42.87, 74.59)
+        old = SosSignal.objects.create(sender=self.sender, latitude=42.87, longitude=74.59, is_active=False)
+        SosSignal.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=3))
+        heatmap.rebuild()
+
+        self.assertEqual(self.fetch(window="day").data["cells"][0]["total"], 1)
+        week = self.fetch(window="week").data["cells"]
+        self.assertEqual((week[0]["total"], week[0]["active"]), (2, 1))
+        self.assertTrue(SosHeatCell.objects.filter(granularity=SosHeatCell.DAY, zoom=12).exists())
+
+    def test_heatmap_is_operator_only_and_validates_params(self):
+        self.client.force_authenticate(self.sender)
+        self.assertEqual(self.client.get("/api/sos/heatmap/", {"bbox": self.BBOX, "zoom": 12}).status_code, 403)
+
+        self.assertEqual(self.fetch(bbox="1,2,3").status_code, 400)
+        self.assertEqual(self.fetch(window="month").status_code, 400)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.fetch().status_code, 200)
+        self.assertEqual(len([q for q in queries if "sosheatcell" in q["sql"]]), 1)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.settings_override = override_settings(PROFILING={
+            "SAMPLE_RATE": 0.0, "HEADER": "X-Profile", "PATH_PREFIX": "/api/",
+            "DIR": self.directory.name, "MAX_PROFILES": 2, "TOP_SQL": 5, "TOP_FUNCTIONS": 10,
+        })
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.staff = User.objects.create(email="staff@sakbol.app", is_staff=True)
+        self.user = User.objects.create(email="user@sakbol.app")
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(user)}")
+        return client
+
+    def test_staff_header_records_downloadable_profile(self):
+        client = self.client_for(self.staff)
+        response = client.get("/api/contacts/", HTTP_X_PROFILE="1")
+        profile_id = response["X-Profile-Id"]
+
+        listed = client.get("/api/profiles/").data
+        self.assertEqual([item["id"] for item in listed], [profile_id])
+        self.assertEqual(listed[0]["view"], "ContactViewSet.list")
+        self.assertEqual(listed[0]["user_id"], self.staff.id)
+        self.assertGreater(listed[0]["sql"]["queries"], 0)
+
+        detail = json.loads(b"".join(client.get(f"/api/profiles/{profile_id}/").streaming_content))
+        self.assertTrue(detail["functions"])
+
+        download = client.get(f"/api/profiles/{profile_id}/download/")
+        path = f"{self.directory.name}/copy.prof"
+        with open(path, "wb") as stream:
+            stream.write(b"".join(download.streaming_content))
+        self.assertTrue(pstats.Stats(path).total_calls)
+
+    def test_header_from_regular_user_is_ignored(self):
+        client = self.client_for(self.user)
+        response = client.get("/api/contacts/", HTTP_X_PROFILE="1")
+
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(client.get("/api/profiles/").status_code, 403)
+
+    def test_sampled_profiles_are_rotated(self):
+        with self.settings(PROFILING={**settings.PROFILING, "SAMPLE_RATE": 1.0}):
+            client = self.client_for(self.user)
+            ids = [client.get("/api/keywords/")["X-Profile-Id"] for _ in range(3)]
+
+        staff = self.client_for(self.staff)
+        self.assertEqual([item["id"] for item in staff.get("/api/profiles/").data], sorted(ids[1:], reverse=True))
+        self.assertEqual(staff.get("/api/profiles/20200101T000000000000-deadbeef/download/").status_code, 404)
+
+
+# второй шард регистрируется при импорте, чтобы раннер создал для него тестовую базу
+SHARD = "location_shard_test"
+
+
+def register_shard(alias):
+    path = Path(tempfile.gettempdir()) / f"sakbol_{alias}.sqlite3"
+    path.unlink(missing_ok=True)
+    add_sqlite_alias(alias, path)
+    return path
+
+
+def unregister_shard(alias, path):
+    connections[alias].close()
+    del connections[alias]
+    del connections.settings[alias]
+    path.unlink(missing_ok=True)
+
+
+@override_settings(LOCATION_SHARDS=["default", SHARD])
+class LocationShardingTests(TestCase):
+    """
+    Шард — отдельный SQLite-файл, который регистрируется только на время класса:
+    до super().setUpClass(), чтобы "__all__" включил его и TestCase открыл в нём транзакцию теста.
+    """
+
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.shard_path = register_shard(SHARD)
+        with override_settings(LOCATION_SHARDS=["default", SHARD]):
+            call_command("init_location_shard", SHARD, stdout=io.StringIO())
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        unregister_shard(SHARD, cls.shard_path)
+
+    def setUp(self):
+        self.users = [User.objects.create(email=f"user{i}@sakbol.app") for i in range(6)]
+        self.client = APIClient()
+
+    def shard_of(self, user):
+        return "default" if user.pk % 2 == 0 else SHARD
+
+    def test_writes_and_reads_are_routed_by_user(self):
+        for user in self.users:
+            self.client.force_authenticate(user)
+            response = self.client.post("/api/location/update/", {"latitude": 42.87, "longitude": 74.59}, format="json")
+            self.assertEqual(response.status_code, 200)
+
+        for user in self.users:
+            self.assertTrue(Location.objects.using(self.shard_of(user)).filter(user_id=user.pk).exists())
+            user.refresh_from_db()
+            self.assertEqual(user.location.latitude, 42.87)
+        self.assertEqual(Location.objects.using(SHARD).count(), 3)
+        # событие outbox лежит в той же базе, что и точка
+        self.assertEqual(OutboxEvent.objects.using(SHARD).filter(topic=outbox.LOCATION_UPDATED).count(), 3)
+
+        self.client.force_authenticate(self.users[1])
+        self.assertEqual(self.client.get("/api/location/me/").data["latitude"], 42.87)
+
+        self.users[1].delete()
+        self.assertFalse(Location.objects.using(SHARD).filter(user_id=self.users[1].pk).exists())
+
+    def test_contact_lists_read_each_shard_once(self):
+        owner, *others = self.users
+        for i, user in enumerate(others):
+            Location.objects.create(user=user, latitude=42.87 + i / 1000, longitude=74.59)
+            FavoriteContact.objects.create(user=owner, contact=user)
+        self.client.force_authenticate(owner)
+
+        with CaptureQueriesContext(connection) as default, CaptureQueriesContext(connections[SHARD]) as shard:
+            response = self.client.get("/api/favorites/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(all(item["location"] for item in response.data["results"]))
+        self.assertEqual(len([q for q in default if "location" in q["sql"]]), 1)
+        self.assertEqual(len(shard), 1)
+
+        signal = SosSignal.objects.create(sender=owner, latitude=42.87, longitude=74.59)
+        self.assertEqual(len(rank_responders(signal, limit=10)), len(others))
+
+    def test_unroutable_queries_fail_instead_of_reading_one_shard(self):
+        for user in self.users[:2]:
+            Location.objects.create(user=user, latitude=1, longitude=2)
+
+        for queryset in (
+            Location.objects.all(),
+            Location.objects.filter(Q(user=self.users[0])),
+            Location.objects.filter(user__in=self.users),
+        ):
+            with self.assertRaises(UnroutableQuery):
+                list(queryset)
+        with self.assertRaises(UnroutableQuery):
+            Location.objects.count()
+
+        self.assertEqual(len(Location.objects.for_users(self.users)), 2)
+        self.assertEqual(sum(Location.objects.using(alias).count() for alias in ("default", SHARD)), 2)
+
+    def test_admin_changelist_lists_one_explicit_shard(self):
+        admin_user = User.objects.create(email="admin@sakbol.app", is_staff=True, is_superuser=True)
+        for user in self.users:
+            Location.objects.create(user=user, latitude=1, longitude=2)
+        self.client.force_login(admin_user)
+
+        default = self.client.get("/admin/sos_module/location/")
+        shard = self.client.get("/admin/sos_module/location/", {"shard": SHARD})
+
+        self.assertEqual(default.status_code, 200)
+        self.assertEqual(default.context["cl"].queryset.db, "default")
+        self.assertEqual(shard.context["cl"].queryset.db, SHARD)
+        self.assertEqual(
+            {location.user_id for location in shard.context["cl"].result_list},
+            {user.pk for user in self.users if self.shard_of(user) == SHARD},
+        )
+
+    def test_split_locations_moves_rows_to_their_shard(self):
+        with self.settings(LOCATION_SHARDS=["default"]):
+            for user in self.users:
+                Location.objects.create(user=user, latitude=1, longitude=2)
+        stamp = timezone.now() - timedelta(hours=1)
+        Location.objects.using("default").update(updated_at=stamp)
+
+        call_command("split_locations", stdout=io.StringIO())
+        call_command("split_locations", stdout=io.StringIO())
+
+        for user in self.users:
+            location = Location.objects.using(self.shard_of(user)).get(user_id=user.pk)
+            self.assertEqual(location.updated_at, stamp)
+        self.assertEqual(Location.objects.using("default").count(), 3)
+
+
+@override_settings(OUTBOX={"BATCH_SIZE": 2, "POLL_INTERVAL": 0.1, "GAP_TIMEOUT": 60, "RETENTION": timedelta(days=7)})
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(email="alice@sakbol.app")
+        self.bob = User.objects.create(email="bob@sakbol.app")
+        self.client = APIClient()
+        self.received = []
+        self.failures = 0
+
+        def collect(events):
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError("потребитель недоступен")
+            self.received.extend((event.topic, event.key) for event in events)
+
+        outbox.consumer("test.collect")(collect)
+        self.addCleanup(outbox.registry.pop, "test.collect")
+
+    def topics(self):
+        return list(OutboxEvent.objects.order_by("id").values_list("topic", flat=True))
+
+    def test_events_are_written_in_the_same_transaction_as_changes(self):
+        contact = Contact.objects.create(from_user=self.bob, to_user=self.alice)
+        self.client.force_authenticate(self.alice)
+
+        self.client.post(f"/api/contacts/{contact.id}/accept/")
+        self.client.post("/api/sos/", {"latitude": 42.87, "longitude": 74.59}, format="json")
+        self.client.post("/api/location/update/", {"latitude": 42.87, "longitude": 74.59}, format="json")
+        self.client.post("/api/favorites/bulk/", {"add": [self.bob.id], "remove": []}, format="json")
+
+        self.assertEqual(self.topics(), [
+            outbox.CONTACT_ACCEPTED, outbox.SOS_CREATED, outbox.LOCATION_UPDATED, outbox.FAVORITE_ADDED,
+        ])
+        self.assertEqual(OutboxEvent.objects.get(topic=outbox.FAVORITE_ADDED).payload["contact_id"], self.bob.id)
+
+        # повторное принятие отклоняется — и события нет
+        self.client.post(f"/api/contacts/{contact.id}/accept/")
+        self.assertEqual(len(self.topics()), 4)
+
+    def test_relay_delivers_in_order_at_least_once(self):
+        for key in range(5):
+            outbox.publish("test.event", {}, key=key)
+        self.failures = 1
+
+        with self.assertLogs("sos_module.outbox", "ERROR"):
+            outbox.relay(["test.collect"])
+        self.assertEqual(self.received, [])
+        self.assertEqual(OutboxOffset.objects.get(consumer="test.collect").last_event_id, 0)
+
+        outbox.relay(["test.collect"])
+        self.assertEqual([key for _, key in self.received], ["0", "1", "2", "3", "4"])
+        self.assertEqual(outbox.relay(["test.collect"]), 0)
+
+    def test_event_committed_below_the_offset_is_delivered_late(self):
+        for key in range(1, 4):
+            outbox.publish("test.event", {}, key=key)
+        # транзакция события 2 ещё не закоммичена, когда ретранслятор видит 3
+        late_id = OutboxEvent.objects.get(key="2").id
+        OutboxEvent.objects.filter(id=late_id).delete()
+
+        outbox.relay(["test.collect"])
+        offset = OutboxOffset.objects.get(consumer="test.collect")
+        self.assertEqual(offset.last_event_id, late_id + 1)
+        self.assertEqual(list(offset.gaps), [str(late_id)])
+
+        OutboxEvent.objects.create(id=late_id, topic="test.event", key="2")
+        self.assertEqual(outbox.relay(["test.collect"]), 1)
+        self.assertEqual([key for _, key in self.received], ["1", "3", "2"])
+        self.assertEqual(OutboxOffset.objects.get(consumer="test.collect").gaps, {})
+        self.assertEqual(outbox.relay(["test.collect"]), 0)
+
+    def test_gap_is_dropped_after_timeout(self):
+        outbox.publish("test.event", {}, key=1)
+        rolled_back = outbox.publish("test.event", {}, key=2)
+        outbox.publish("test.event", {}, key=3)
+        rolled_back.delete()
+        outbox.relay(["test.collect"])
+
+        later = time.time() + settings.OUTBOX["GAP_TIMEOUT"] + 1
+        with mock.patch("sos_module.outbox.time.time", return_value=later), self.assertLogs("sos_module.outbox", "WARNING"):
+            self.assertEqual(outbox.relay(["test.collect"]), 0)
+        self.assertEqual(OutboxOffset.objects.get(consumer="test.collect").gaps, {})
+        self.assertEqual([key for _, key in self.received], ["1", "3"])
+
+    def test_purged_history_does_not_become_gaps(self):
+        ids = [outbox.publish("test.event", {}, key=key).id for key in range(10)]
+        # позиция заведена давно, а ранние события с тех пор удалены purge_events
+        OutboxOffset.objects.create(consumer="test.collect", source="default", last_event_id=0)
+        OutboxEvent.objects.filter(id__lt=ids[7]).delete()
+
+        outbox.relay(["test.collect"])
+        self.assertEqual([key for _, key in self.received], ["7", "8", "9"])
+        self.assertEqual(OutboxOffset.objects.get(consumer="test.collect").gaps, {})
+
+        # новая позиция и replay() без аргументов встают перед самым ранним хранимым событием
+        self.assertEqual(outbox.get_offset("test.new", "default").last_event_id, ids[7] - 1)
+        self.assertEqual(outbox.replay("test.collect"), ids[7] - 1)
+
+    def test_large_gap_sets_are_queried_in_chunks_and_expire_first(self):
+        event = outbox.publish("test.event", {}, key=1)
+        now = time.time()
+        # позиция, застрявшая с огромным числом пропусков (больше лимита параметров SQLite)
+        gaps = {str(event_id): now for event_id in range(10**6, 10**6 + 40000)}
+        OutboxOffset.objects.create(consumer="test.collect", source="default", last_event_id=event.id - 1, gaps=gaps)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(outbox.relay(["test.collect"]), 1)
+        gap_queries = [q for q in queries if "outboxevent" in q["sql"] and " IN (" in q["sql"]]
+        self.assertEqual(len(gap_queries), 2 * 40000 // outbox.GAP_QUERY_CHUNK)  # доставка и проверка «догнали»
+        self.assertEqual(len(OutboxOffset.objects.get(consumer="test.collect").gaps), 40000)
+
+        later = now + settings.OUTBOX["GAP_TIMEOUT"] + 1
+        with mock.patch("sos_module.outbox.time.time", return_value=later), self.assertLogs("sos_module.outbox", "WARNING"):
+            outbox.relay(["test.collect"])
+        self.assertEqual(OutboxOffset.objects.get(consumer="test.collect").gaps, {})
+        self.assertEqual([key for _, key in self.received], ["1"])
+
+    def test_replay_redelivers_from_given_id(self):
+        first = outbox.publish("test.event", {}, key=1)
+        outbox.publish("test.event", {}, key=2)
+
+        outbox.relay(["test.collect"])
+        call_command("replay_outbox", "test.collect", "--from-id", str(first.id + 1), stdout=io.StringIO())
+        outbox.relay(["test.collect"])
+        self.assertEqual([key for _, key in self.received], ["1", "2", "2"])
+
+    def test_family_dashboard_cache_is_invalidated_by_location_events(self):
+        family = Family.objects.create(name="Семья", created_by=self.alice)
+        FamilyMember.objects.create(family=family, user=self.bob, role=FamilyMember.CHILD)
+        cache.set(dashboard_cache_key(family.id), ("etag", {}))
+        self.client.force_authenticate(self.bob)
+
+        self.client.post("/api/location/update/", {"latitude": 42.87, "longitude": 74.59}, format="json")
+        self.assertIsNotNone(cache.get(dashboard_cache_key(family.id)))
+
+        outbox.relay(["family.dashboard_cache"])
+        self.assertIsNone(cache.get(dashboard_cache_key(family.id)))
+
+
+class LocationShardInitTests(SimpleTestCase):
+    """init_location_shard на пустом файле: без транзакции теста, DDL в SQLite её не терпит."""
+
+    databases = "__all__"
+    alias = "location_shard_init_test"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.shard_path = register_shard(cls.alias)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        unregister_shard(cls.alias, cls.shard_path)
+
+    def test_init_location_shard_creates_tables_without_user_fk(self):
+        alias = self.alias
+        with self.settings(LOCATION_SHARDS=["default", alias]):
+            call_command("init_location_shard", alias, stdout=io.StringIO())
+            shard = connections[alias]
+            with shard.cursor() as cursor:
+                tables = set(shard.introspection.table_names(cursor))
+                constraints = shard.introspection.get_constraints(cursor, Location._meta.db_table)
+            self.assertLessEqual({Location._meta.db_table, OutboxEvent._meta.db_table}, tables)
+            self.assertNotIn(User._meta.db_table, tables)
+            self.assertFalse([c for c in constraints.values() if c["foreign_key"]])
+
+            # дальше шард мигрируется обычным migrate: применять нечего
+            executor = MigrationExecutor(shard)
+            self.assertEqual(executor.migration_plan(executor.loader.graph.leaf_nodes()), [])
+            with self.assertRaises(CommandError):
+                call_command("init_location_shard", alias, stdout=io.StringIO())
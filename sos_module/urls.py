@@ -5,11 +5,15 @@ from .views import (
     KeywordViewSet,
     MeView,
     ContactViewSet,
+    FamilyViewSet,
     LocationView,
     FavoriteContactViewSet,
     OutgoingRequestsView,
+    ProfileViewSet,
     RegisterView,
+    SafeZoneViewSet,
     SosSignalViewSet,
+    SyncView,
     UpdateLocationView,
     UpdateOnlineStatusView,
 )
@@ -22,6 +26,9 @@ router.register("contacts", ContactViewSet, basename="contacts")
 router.register("favorites", FavoriteContactViewSet, basename="favorites")
 router.register("sos", SosSignalViewSet, basename="sos")
 router.register(r"keywords", KeywordViewSet, basename="keywords")
+router.register("safe-zones", SafeZoneViewSet, basename="safe-zones")
+router.register("families", FamilyViewSet, basename="families")
+router.register("profiles", ProfileViewSet, basename="profiles")
 
 urlpatterns = [
     # Auth & Profile
@@ -35,10 +42,13 @@ urlpatterns = [
     path("contacts/outgoing-requests/", OutgoingRequestsView.as_view(), name="outgoing-requests"),
     path("contacts/incoming-requests/", IncomingRequestsView.as_view(), name="incoming-requests"),
 
+    # Bootstrap & delta sync
+    path("sync/", SyncView.as_view(), name="sync"),
+
     # Location
     path("location/update/", UpdateLocationView.as_view(), name="location-update"),
     path("location/me/", LocationView.as_view(), name="location-me"),
 
-    # Routers (contacts, favorites, sos)
+    # Routers (contacts, favorites, sos, keywords, safe-zones, families, profiles)
     path("", include(router.urls)),
 ]
\ No newline at end of file
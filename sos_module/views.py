@@ -1,16 +1,51 @@
-from django.db import models
+import copy
+
+from django.conf import settings
+from django.db import models, transaction
+from django.http import FileResponse
 from django.utils import timezone
 from rest_framework import generics, permissions, status, viewsets
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, PermissionDenied
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from .models import Contact, Keyword, Location, FavoriteContact, SosSignal
+from .family import get_dashboard, invalidate_dashboard
+from .geofence import evaluate_location
+from . import heatmap
+from .idempotency import idempotent
+from . import jobs
+from . import outbox
+from .models import (
+    Contact,
+    Family,
+    FamilyMember,
+    FavoriteContact,
+    Keyword,
+    Location,
+    SafeZone,
+    SafeZoneEvent,
+    SosSignal,
+)
+from .permissions import IsOperator, is_family_parent
+from .phones import chunked
+from .sharding import shard_for
+from . import profiling
+from . import sync
 from .serializers import (
+    BulkFavoritesSerializer,
+    BulkIdsSerializer,
+    FamilyMemberSerializer,
+    FamilySerializer,
+    KeywordReplaceSerializer,
     KeywordSerializer,
+    MatchedUserSerializer,
+    PhoneMatchSerializer,
+    SafeZoneEventSerializer,
+    SafeZoneSerializer,
     RegisterSerializer,
     UserSerializer,
     ContactSerializer,
@@ -43,14 +78,17 @@ class ContactViewSet(viewsets.ModelViewSet):
     - POST: отправка заявки по identifier
     - POST /accept/{id}/ — принять заявку
     - POST /cancel/{id}/ — отменить исходящую заявку
+    - POST /match/ — найти зарегистрированных пользователей по телефонной книге
+    - POST /bulk-accept/, /bulk-cancel/ — принять или отменить много заявок разом
     """
     queryset = Contact.objects.all()
 
     def get_queryset(self):
         user = self.request.user
-        return Contact.objects.filter(
-            models.Q(from_user=user),
-            is_accepted=True
+        return (
+            Contact.objects.filter(models.Q(from_user=user), is_accepted=True)
+            .select_related("from_user", "to_user")
+            .prefetch_related("from_user__location", "to_user__location")
         )
 
     def get_serializer_class(self):
@@ -69,8 +107,10 @@ class ContactViewSet(viewsets.ModelViewSet):
         contact = get_object_or_404(Contact, pk=pk, to_user=request.user)
         if contact.is_accepted:
             return Response({"detail": "Уже подтверждено."}, status=400)
-        contact.is_accepted = True
-        contact.save()
+        with transaction.atomic():
+            contact.is_accepted = True
+            contact.save()
+            outbox.publish(outbox.CONTACT_ACCEPTED, outbox.contact_payload(contact), key=contact.to_user_id)
         return Response(ContactSerializer(contact, context={"request": request}).data)
 
     @action(detail=True, methods=["post"])
@@ -84,12 +124,126 @@ class ContactViewSet(viewsets.ModelViewSet):
         contact.delete()
         return Response({"detail": "Заявка отменена."}, status=204)
 
+    @action(detail=False, methods=["post"], url_path="bulk-accept")
+    def bulk_accept(self, request):
+        """
+        Принять несколько входящих заявок одной транзакцией
+        """
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data["ids"]
+        now = timezone.now()
+
+        results = []
+        with transaction.atomic():
+            contacts = Contact.objects.select_for_update().filter(pk__in=ids, to_user=request.user).in_bulk()
+            accepted = []
+            for contact_id in ids:
+                contact = contacts.get(contact_id)
+                if contact is None:
+                    results.append({"id": contact_id, "status": "error", "detail": "Заявка не найдена."})
+                elif contact.is_accepted:
+                    results.append({"id": contact_id, "status": "error", "detail": "Уже подтверждено."})
+                else:
+                    contact.is_accepted = True
+                    contact.updated_at = now
+                    accepted.append(contact)
+                    results.append({"id": contact_id, "status": "ok"})
+            Contact.objects.bulk_update(accepted, ["is_accepted", "updated_at"])
+            outbox.publish_many(
+                [(outbox.CONTACT_ACCEPTED, outbox.contact_payload(contact), contact.to_user_id) for contact in accepted]
+            )
+        return Response({"results": results})
+
+    @action(detail=False, methods=["post"], url_path="bulk-cancel")
+    def bulk_cancel(self, request):
+        """
+        Отменить несколько исходящих заявок одной транзакцией
+        """
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data["ids"]
+
+        results = []
+        with transaction.atomic():
+            contacts = Contact.objects.select_for_update().filter(pk__in=ids, from_user=request.user).in_bulk()
+            cancelled = []
+            for contact_id in ids:
+                contact = contacts.get(contact_id)
+                if contact is None:
+                    results.append({"id": contact_id, "status": "error", "detail": "Заявка не найдена."})
+                elif contact.is_accepted:
+                    results.append({"id": contact_id, "status": "error", "detail": "Нельзя отменить — уже принято."})
+                else:
+                    cancelled.append(contact)
+                    results.append({"id": contact_id, "status": "ok"})
+            with sync.tombstone_batch():
+                Contact.objects.filter(pk__in=[contact.pk for contact in cancelled]).delete()
+        return Response({"results": results})
+
+    @action(detail=False, methods=["post"])
+    def match(self, request):
+        """
+        Сопоставить телефонную книгу (номера или их хеши) с пользователями.
+        Поиск идёт по индексированным phone_e164/phone_hash пачками IN-запросов.
+        """
+        serializer = PhoneMatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        phones = serializer.validated_data["phones"]
+        hashes = serializer.validated_data["hashes"]
+        chunk_size = settings.PHONE_MATCH_CHUNK_SIZE
+        user = request.user
+
+        matched = {}  # id пользователя -> (пользователь, что прислал клиент)
+        fields = ["id", "first_name", "last_name", "identifier", "avatar", "phone_e164", "phone_hash"]
+        for chunk in chunked(phones, chunk_size):
+            for found in User.objects.filter(phone_e164__in=chunk).exclude(pk=user.pk).only(*fields):
+                matched.setdefault(found.pk, (found, phones[found.phone_e164]))
+        for chunk in chunked(hashes, chunk_size):
+            for found in User.objects.filter(phone_hash__in=chunk).exclude(pk=user.pk).only(*fields):
+                matched.setdefault(found.pk, (found, found.phone_hash))
+
+        # заявки могут быть в обе стороны — берём самую «сильную», при равенстве самую раннюю
+        priority = {"accepted": 0, "incoming": 1, "outgoing": 2}
+        statuses = {}  # id пользователя -> (статус, id заявки)
+        for chunk in chunked(matched, chunk_size):
+            rows = Contact.objects.filter(
+                models.Q(from_user=user, to_user_id__in=chunk)
+                | models.Q(to_user=user, from_user_id__in=chunk)
+            ).values_list("id", "from_user_id", "to_user_id", "is_accepted")
+            for contact_id, from_id, to_id, is_accepted in rows:
+                if is_accepted:
+                    contact_status = "accepted"
+                elif from_id == user.pk:
+                    contact_status = "outgoing"
+                else:
+                    contact_status = "incoming"
+                other_id = to_id if from_id == user.pk else from_id
+                current = statuses.get(other_id)
+                if current is None or (priority[contact_status], contact_id) < (priority[current[0]], current[1]):
+                    statuses[other_id] = (contact_status, contact_id)
+
+        found_users = [found for found, _ in matched.values()]
+        users_data = MatchedUserSerializer(found_users, many=True, context={"request": request}).data
+        results = []
+        for (found, query), user_data in zip(matched.values(), users_data):
+            contact_status, contact_id = statuses.get(found.pk, ("none", None))
+            results.append({
+                "query": query,
+                "user": user_data,
+                "contact_status": contact_status,
+                "contact_id": contact_id,
+            })
+        return Response({"count": len(results), "results": results})
+
 class IncomingRequestsView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         user = request.user
-        qs = Contact.objects.filter(to_user=user, is_accepted=False)
+        qs = Contact.objects.filter(to_user=user, is_accepted=False).select_related(
+            "from_user", "to_user"
+        ).prefetch_related("from_user__location", "to_user__location")
         serializer = ContactSerializer(qs, many=True, context={"request": request})
         return Response(serializer.data)
 
@@ -99,10 +253,38 @@ class OutgoingRequestsView(APIView):
 
     def get(self, request):
         user = request.user
-        qs = Contact.objects.filter(from_user=user, is_accepted=False)
+        qs = Contact.objects.filter(from_user=user, is_accepted=False).select_related(
+            "from_user", "to_user"
+        ).prefetch_related("from_user__location", "to_user__location")
         serializer = ContactSerializer(qs, many=True, context={"request": request})
         return Response(serializer.data)
 
+class ProfileViewSet(viewsets.ViewSet):
+    """
+    /api/profiles/ — профили запросов, снятые ProfilingMiddleware (только персонал)
+    - list (GET): метаданные, новые сначала
+    - retrieve (GET /{id}/): метаданные с топом функций и SQL
+    - GET /{id}/download/ — файл .prof для pstats/snakeviz
+    """
+    permission_classes = [IsAdminUser]
+    lookup_value_regex = r"[0-9T]+-[0-9a-f]+"
+
+    def get_path(self, pk, suffix):
+        path = profiling.profile_path(pk, suffix)
+        if path is None:
+            raise NotFound("Профиль не найден.")
+        return path
+
+    def list(self, request):
+        return Response(profiling.list_profiles())
+
+    def retrieve(self, request, pk=None):
+        return FileResponse(self.get_path(pk, ".json").open("rb"), content_type="application/json")
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        return FileResponse(self.get_path(pk, ".prof").open("rb"), as_attachment=True, filename=f"{pk}.prof")
+
 class LocationView(generics.CreateAPIView, generics.RetrieveAPIView):
     """
     POST /api/location/update/ — обновить местоположение
@@ -113,6 +295,10 @@ class LocationView(generics.CreateAPIView, generics.RetrieveAPIView):
     def get_object(self):
         return Location.objects.filter(user=self.request.user).first()
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         serializer.save()
 
@@ -122,32 +308,168 @@ class FavoriteContactViewSet(viewsets.ModelViewSet):
     - list (GET): список избранных
     - create (POST): добавить контакт
     - delete (DELETE): удалить контакт
+    - POST /bulk/ — добавить и удалить много контактов разом ({"add": [id], "remove": [id]})
     """
     serializer_class = FavoriteContactSerializer
 
     def get_queryset(self):
-        return FavoriteContact.objects.filter(user=self.request.user)
+        return (
+            FavoriteContact.objects.filter(user=self.request.user)
+            .select_related("contact")
+            .prefetch_related("contact__location")
+        )
 
     def perform_create(self, serializer):
-        serializer.save()
+        with transaction.atomic():
+            favorite = serializer.save()
+            outbox.publish(outbox.FAVORITE_ADDED, outbox.favorite_payload(favorite), key=favorite.user_id)
+
+    @action(detail=False, methods=["post"])
+    def bulk(self, request):
+        """
+        Пакетное изменение избранного: проверки делаются одним запросом на весь набор
+        """
+        serializer = BulkFavoritesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        add = serializer.validated_data["add"]
+        remove = serializer.validated_data["remove"]
+        user = request.user
+
+        results = []
+        with transaction.atomic():
+            existing_users = set(User.objects.filter(pk__in=add).values_list("pk", flat=True))
+            already = set(
+                FavoriteContact.objects.filter(user=user, contact_id__in=add).values_list("contact_id", flat=True)
+            )
+            candidates = []
+            for contact_id in add:
+                if contact_id == user.pk:
+                    detail = "Нельзя добавить самого себя в избранное."
+                elif contact_id not in existing_users:
+                    detail = "Пользователь не найден."
+                elif contact_id in already:
+                    detail = "Этот пользователь уже добавлен в избранное."
+                else:
+                    candidates.append(contact_id)
+                    results.append({"contact_id": contact_id, "action": "add", "status": "ok"})
+                    continue
+                results.append({"contact_id": contact_id, "action": "add", "status": "error", "detail": detail})
+            # параллельный запрос мог добавить те же контакты между проверкой и вставкой:
+            # такие строки пропускаем вместо IntegrityError, а созданные перечитываем с id
+            FavoriteContact.objects.bulk_create(
+                [FavoriteContact(user=user, contact_id=contact_id) for contact_id in candidates],
+                ignore_conflicts=True,
+            )
+            created = list(
+                FavoriteContact.objects.filter(user=user, contact_id__in=candidates).order_by("id")
+            )
+            outbox.publish_many(
+                [(outbox.FAVORITE_ADDED, outbox.favorite_payload(favorite), favorite.user_id) for favorite in created]
+            )
+
+            removed = dict(
+                FavoriteContact.objects.filter(user=user, contact_id__in=remove).values_list("contact_id", "pk")
+            )
+            for contact_id in remove:
+                if contact_id in removed:
+                    results.append({"contact_id": contact_id, "action": "remove", "status": "ok"})
+                else:
+                    results.append({
+                        "contact_id": contact_id, "action": "remove", "status": "error",
+                        "detail": "Контакта нет в избранном.",
+                    })
+            with sync.tombstone_batch():
+                FavoriteContact.objects.filter(pk__in=removed.values()).delete()
+        return Response({"results": results})
 
 class SosSignalViewSet(viewsets.ModelViewSet):
     """
     /api/sos/
     - list (GET): список своих SOS-сигналов
-    - create (POST): отправить новый сигнал
+    - create (POST): отправить новый сигнал (поддерживает заголовок Idempotency-Key)
+    - GET /{id}/responders/?limit=N — ближайшие избранные и контакты с ETA
+    - POST /{id}/resolve/ — закрыть сигнал
+    - GET /heatmap/?bbox=min_lon,min_lat,max_lon,max_lat&zoom=Z&window=hour|day|week — тепловая карта (операторы)
     """
     serializer_class = SosSignalSerializer
 
     def get_queryset(self):
-        return SosSignal.objects.filter(sender=self.request.user)
+        return (
+            SosSignal.objects.filter(sender=self.request.user)
+            .select_related("sender")
+            .prefetch_related("sender__location")
+            .order_by("-created_at")
+        )
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context["include_responders"] = self.action in ("create", "retrieve")
+        return context
+
+    @action(detail=True, methods=["get"])
+    def responders(self, request, pk=None):
+        """
+        Ранжированный список тех, кого оповестить первыми
+        """
+        try:
+            limit = int(request.query_params.get("limit", settings.SOS_RANKING["TOP_K"]))
+        except ValueError:
+            return Response({"detail": "limit должен быть числом."}, status=400)
+        limit = max(1, min(limit, settings.SOS_RANKING["MAX_TOP_K"]))
+
+        serializer = self.get_serializer(
+            self.get_object(),
+            context={**self.get_serializer_context(), "include_responders": True, "responders_limit": limit},
+        )
+        return Response(serializer.data["responders"])
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    @action(detail=True, methods=["post"])
+    def resolve(self, request, pk=None):
+        sos = self.get_object()
+        heatmap.resolve_signals(SosSignal.objects.filter(pk=sos.pk))
+        sos.refresh_from_db()
+        return Response(self.get_serializer(sos).data)
+
+    @action(detail=False, methods=["get"], url_path="heatmap", url_name="heatmap", permission_classes=[IsOperator])
+    def heat_map(self, request):
+        """
+        Число сигналов по ячейкам сетки внутри bbox — из предрасчитанных счётчиков
+        """
+        params = request.query_params
+        try:
+            bbox = heatmap.parse_bbox(params.get("bbox", ""))
+            zoom = int(params.get("zoom", ""))
+        except ValueError:
+            return Response({"detail": "Нужны bbox=min_lon,min_lat,max_lon,max_lat и целый zoom."}, status=400)
+        window = params.get("window", "day")
+        if window not in heatmap.WINDOWS:
+            return Response({"detail": "window должен быть hour, day или week."}, status=400)
+        return Response(heatmap.heatmap(bbox, max(0, min(zoom, 22)), window))
 
     def perform_create(self, serializer):
-        sos = serializer.save()
-        # TODO: запустить Celery-задачу для рассылки уведомлений избранным
+        # тепловую карту обновит потребитель outbox — сигнал не ждёт блокировок её ячеек
+        with transaction.atomic():
+            sos = serializer.save()
+            jobs.enqueue("sos.notify", {"sos_id": sos.pk})
+            outbox.publish(outbox.SOS_CREATED, outbox.sos_payload(sos), key=sos.sender_id)
         return sos
 
+    def perform_update(self, serializer):
+        before = copy.copy(serializer.instance)
+        with transaction.atomic():
+            sos = serializer.save()
+            if (before.latitude, before.longitude, before.is_active) != (sos.latitude, sos.longitude, sos.is_active):
+                outbox.publish(outbox.SOS_UPDATED, outbox.sos_change_payload(before, sos), key=sos.sender_id)
+
 class KeywordViewSet(viewsets.ModelViewSet):
+    """
+    /api/keywords/
+    - PUT /replace/ — заменить весь набор ключевых слов ({"words": [...]})
+    """
     serializer_class = KeywordSerializer
 
     def get_queryset(self):
@@ -156,7 +478,211 @@ class KeywordViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=["put"])
+    def replace(self, request):
+        """
+        Заменить все ключевые слова пользователя одной транзакцией.
+        Совпадающие слова сохраняют свои id, лишние удаляются, новые создаются.
+        """
+        serializer = KeywordReplaceSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        words = serializer.validated_data["words"]
+        user = request.user
+
+        with transaction.atomic():
+            kept = {}
+            obsolete = []
+            for keyword in Keyword.objects.select_for_update().filter(user=user).order_by("id"):
+                if keyword.word in words and keyword.word not in kept:
+                    kept[keyword.word] = keyword
+                else:
+                    obsolete.append(keyword.pk)
+            created = Keyword.objects.bulk_create(
+                [Keyword(user=user, word=word) for word in words if word not in kept]
+            )
+            with sync.tombstone_batch():
+                Keyword.objects.filter(pk__in=obsolete).delete()
+
+        created_words = {keyword.word for keyword in created}
+        keywords = {**kept, **{keyword.word: keyword for keyword in created}}
+        return Response({
+            "results": [
+                {"word": word, "status": "created" if word in created_words else "kept"}
+                for word in words
+            ],
+            "removed": obsolete,
+            "keywords": KeywordSerializer([keywords[word] for word in words], many=True).data,
+        })
+
+class SyncView(APIView):
+    """
+    GET /api/sync/?cursor=<курсор>
+    Всё, что приложение загружает при старте, одним ответом. Без курсора —
+    полный снимок, с курсором — только строки, изменённые или удалённые после него.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        user = request.user
+        # курсор берём с запасом назад: транзакции, начатые до снимка, могут закоммититься позже
+        next_cursor = sync.make_cursor(timezone.now() - settings.SYNC_CURSOR_SKEW)
+        since = sync.parse_cursor(request.query_params.get("cursor"))
+        changes = sync.collect_changes(user, since)
+
+        favorite_ids = set(FavoriteContact.objects.filter(user=user).values_list("contact_id", flat=True))
+        context = {"request": request, "favorite_ids": favorite_ids}
+        return Response({
+            "cursor": next_cursor,
+            "full": since is None,
+            "me": UserSerializer(user, context=context).data,
+            "contacts": ContactSerializer(changes["contacts"], many=True, context=context).data,
+            "incoming_requests": ContactSerializer(changes["incoming_requests"], many=True, context=context).data,
+            "outgoing_requests": ContactSerializer(changes["outgoing_requests"], many=True, context=context).data,
+            "favorites": FavoriteContactSerializer(changes["favorites"], many=True, context=context).data,
+            "keywords": KeywordSerializer(changes["keywords"], many=True, context=context).data,
+            "sos": SosSignalSerializer(changes["sos"], many=True, context=context).data,
+            "deleted": changes["deleted"],
+        })
+
+class FamilyViewSet(viewsets.ModelViewSet):
+    """
+    /api/families/
+    - list (GET): семьи, в которых состоит пользователь
+    - create (POST): создать семью (создатель становится родителем)
+    - POST /{id}/members/ — пригласить участника по identifier и роли
+    - POST /{id}/accept/ — принять приглашение в семью
+    - DELETE /{id}/members/{user_id}/ — убрать участника (выйти самому или отклонить приглашение)
+    - GET /{id}/dashboard/ — состояние всех членов семьи (только для родителей)
+    """
+    serializer_class = FamilySerializer
+    lookup_value_regex = r"\d+"
+
+    def get_queryset(self):
+        return (
+            Family.objects.filter(members__user=self.request.user)
+            .prefetch_related("members__user")
+            .order_by("id")
+            .distinct()
+        )
+
+    def check_parent(self, family):
+        if not is_family_parent(self.request.user, family.pk):
+            raise PermissionDenied("Действие доступно только родителям семьи.")
+
+    def perform_update(self, serializer):
+        self.check_parent(serializer.instance)
+        serializer.save()
+
+    def perform_destroy(self, instance):
+        self.check_parent(instance)
+        invalidate_dashboard(instance.pk)
+        instance.delete()
+
+    @action(detail=True, methods=["post"])
+    def members(self, request, pk=None):
+        """
+        Пригласить участника в семью. Членом семьи он станет,
+        только когда сам примет приглашение.
+        """
+        family = self.get_object()
+        self.check_parent(family)
+        serializer = FamilyMemberSerializer(data=request.data, context={"request": request, "family": family})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        invalidate_dashboard(family.pk)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=["post"])
+    def accept(self, request, pk=None):
+        """
+        Принять приглашение в семью
+        """
+        family = self.get_object()
+        membership = get_object_or_404(FamilyMember, family=family, user=request.user)
+        if membership.is_accepted:
+            return Response({"detail": "Уже подтверждено."}, status=400)
+        membership.is_accepted = True
+        membership.save(update_fields=["is_accepted"])
+        invalidate_dashboard(family.pk)
+        return Response(FamilyMemberSerializer(membership, context={"request": request}).data)
+
+    @action(detail=True, methods=["delete"], url_path=r"members/(?P<user_id>\d+)")
+    def remove_member(self, request, pk=None, user_id=None):
+        """
+        Убрать участника из семьи. Выйти может любой, кроме создателя;
+        детей убирает любой родитель, других родителей — только создатель.
+        """
+        family = self.get_object()
+        is_self = int(user_id) == request.user.pk
+        if not is_self:
+            self.check_parent(family)
+        membership = FamilyMember.objects.filter(family=family, user_id=user_id).first()
+        if membership is None:
+            return Response({"detail": "Участник не найден."}, status=status.HTTP_404_NOT_FOUND)
+        if membership.user_id == family.created_by_id:
+            raise PermissionDenied("Создателя семьи нельзя убрать из неё.")
+        if not is_self and membership.role == FamilyMember.PARENT and request.user.pk != family.created_by_id:
+            raise PermissionDenied("Убрать другого родителя может только создатель семьи.")
+        membership.delete()
+        invalidate_dashboard(family.pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=["get"])
+    def dashboard(self, request, pk=None):
+        """
+        Присутствие, последняя точка, свежесть и активные SOS всех членов семьи.
+        Ответ кешируется на несколько секунд и поддерживает If-None-Match.
+        """
+        if not is_family_parent(request.user, pk):
+            raise NotFound()
+        etag, payload = get_dashboard(int(pk))
+        if request.headers.get("If-None-Match") == etag:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(payload)
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, max-age=0"
+        return response
+
+class SafeZoneViewSet(viewsets.ModelViewSet):
+    """
+    /api/safe-zones/
+    - list (GET): зоны, которые создал родитель (или зоны самого ребёнка)
+    - create (POST): создать круг или многоугольник для привязанного ребёнка
+    - GET /events/?child=<id> — журнал входов и выходов
+    """
+    serializer_class = SafeZoneSerializer
+
+    def get_queryset(self):
+        user = self.request.user
+        qs = SafeZone.objects.select_related("child")
+        if self.action in ("list", "retrieve"):
+            qs = qs.filter(models.Q(parent=user) | models.Q(child=user))
+        else:
+            qs = qs.filter(parent=user)
+        child_id = self.request.query_params.get("child")
+        if child_id:
+            qs = qs.filter(child_id=child_id)
+        return qs.order_by("-created_at")
+
+    @action(detail=False, methods=["get"])
+    def events(self, request):
+        """
+        События входа/выхода по зонам родителя или самого ребёнка
+        """
+        user = request.user
+        qs = SafeZoneEvent.objects.filter(
+            models.Q(zone__parent=user) | models.Q(child=user)
+        ).select_related("zone")
+        child_id = request.query_params.get("child")
+        if child_id:
+            qs = qs.filter(child_id=child_id)
+        page = self.paginate_queryset(qs)
+        serializer = SafeZoneEventSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
 class UpdateLocationView(APIView):
+    @idempotent
     def post(self, request):
         user = request.user
         lat = request.data.get("latitude")
@@ -165,10 +691,14 @@ class UpdateLocationView(APIView):
         if lat is None or lon is None:
             return Response({"error": "Отсутствуют координаты"}, status=status.HTTP_400_BAD_REQUEST)
 
-        location, _ = Location.objects.get_or_create(user=user)
-        location.latitude = lat
-        location.longitude = lon
-        location.save()
+        # точка и событие пишутся в одной транзакции в шард пользователя
+        with transaction.atomic(using=shard_for(user.pk)):
+            location, _ = Location.objects.update_or_create(user=user, defaults={"latitude": lat, "longitude": lon})
+            outbox.publish(
+                outbox.LOCATION_UPDATED, outbox.location_payload(location), key=user.pk, using=location._state.db
+            )
+        if user.role == "child":
+            evaluate_location(user, lat, lon)
 
         return Response({"message": "Геолокация успешно обновлена"})
     